@@ -0,0 +1,185 @@
+# benchmark.py
+
+import argparse
+import json
+import math
+import time
+from file_cleaner import iter_clean_lines, iter_statements, replace_intro_variable_in_statement, clean_statement
+from pipeline import WORDS_TO_REMOVE, STATEMENT_KEYWORDS
+from statement_translator import StatementTranslator
+from synthetic_corpus import generate_corpus, generate_templates
+from text_compiler import compile_output
+
+STAGES = [
+    "clean",
+    "extract_statements",
+    "tokenization",
+    "match_templates",
+    "replace_intro_variable",
+    "clean_output",
+    "compile_output",
+]
+
+def time_stages(content: str, template_dict: dict) -> dict:
+    """
+    Run the pipeline of translate_file.py on content one stage at a time.
+
+    Returns the wall time of each stage in seconds. Tokenization includes translating
+    the bracketed sub-expressions, as in StatementTranslator.tokenize_statement, and
+    match_templates is the rest of the translation.
+    """
+    timings = dict.fromkeys(STAGES, 0.0)
+
+    # Steps 1-2: Remove unneeded text and clean up syntax
+    start = time.perf_counter()
+    cleaned_lines = list(iter_clean_lines(content.splitlines(), WORDS_TO_REMOVE))
+    timings["clean"] = time.perf_counter() - start
+
+    # Step 3: Extract statements
+    start = time.perf_counter()
+    statements = list(iter_statements(cleaned_lines, STATEMENT_KEYWORDS))
+    timings["extract_statements"] = time.perf_counter() - start
+
+    # Step 4: Translate, timing tokenization separately
+    statement_translator = StatementTranslator(template_dict)
+    tokenize_statement = statement_translator.tokenize_statement
+    def timed_tokenize_statement(statement):
+        start = time.perf_counter()
+        try:
+            return tokenize_statement(statement)
+        finally:
+            timings["tokenization"] += time.perf_counter() - start
+    statement_translator.tokenize_statement = timed_tokenize_statement
+
+    start = time.perf_counter()
+    translated_statements = [statement_translator(statement) for statement in statements]
+    timings["match_templates"] = time.perf_counter() - start - timings["tokenization"]
+
+    # Step 5: Fix intro statements
+    start = time.perf_counter()
+    translated_statements = [replace_intro_variable_in_statement(statement) for statement in translated_statements]
+    timings["replace_intro_variable"] = time.perf_counter() - start
+
+    # Step 6: Clean up the output
+    start = time.perf_counter()
+    cleaned_statements = [clean_statement(statement) for statement in translated_statements]
+    timings["clean_output"] = time.perf_counter() - start
+
+    # Step 7: Compile the output into LaTeX
+    start = time.perf_counter()
+    for statement in cleaned_statements:
+        compile_output([statement])
+    timings["compile_output"] = time.perf_counter() - start
+
+    return timings
+
+def best_timings(content: str, template_dict: dict, repeat: int) -> dict:
+    """Return the fastest time of each stage over repeat runs, which is the least noisy estimate."""
+    runs = [time_stages(content, template_dict) for _ in range(repeat)]
+    return {stage: min(run[stage] for run in runs) for stage in STAGES}
+
+def scaling_exponent(sizes: list, times: list) -> float:
+    """Return the least-squares slope of log(time) against log(size); 1.0 means linear."""
+    points = [(math.log(size), math.log(t)) for size, t in zip(sizes, times) if t > 0]
+    if len(points) < 2:
+        return 0.0
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    variance = sum((x - mean_x) ** 2 for x, _ in points)
+    if variance == 0:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / variance
+
+def run_benchmark(sizes: list, proof_depth: int = 2, bracket_nesting: int = 1, tactic_density: float = 0.2,
+                  num_templates: int = 0, base_templates_path: str = "templates.json", repeat: int = 3,
+                  tolerance: float = 0.25, min_time: float = 1e-3, seed: int = 0) -> dict:
+    """
+    Time each stage on synthetic corpora of the given declaration counts.
+
+    A stage passes the scaling check if the slope of log(time) against log(size) is at
+    most 1 + tolerance. Stages faster than min_time at the largest size are too noisy to
+    judge and always pass.
+    """
+    with open(base_templates_path, 'r', encoding='utf-8') as file:
+        base_templates = json.load(file)
+    templates = generate_templates(num_templates, base_templates, seed)
+    template_dict = {template["expression"]: template for template in templates}
+    num_aux_lemmas = len(templates) - len(base_templates)
+
+    results = []
+    for size in sizes:
+        content = generate_corpus(size, proof_depth, bracket_nesting, tactic_density, num_aux_lemmas, seed)
+        timings = best_timings(content, template_dict, repeat)
+        results.append({"declarations": size, "lines": content.count("\n") + 1, "timings": timings})
+
+    scaling = {}
+    for stage in STAGES + ["total"]:
+        if stage == "total":
+            times = [sum(result["timings"].values()) for result in results]
+        else:
+            times = [result["timings"][stage] for result in results]
+        exponent = scaling_exponent(sizes, times)
+        scaling[stage] = {
+            "exponent": exponent,
+            "linear": times[-1] < min_time or exponent <= 1 + tolerance,
+        }
+
+    return {
+        "parameters": {
+            "proof_depth": proof_depth,
+            "bracket_nesting": bracket_nesting,
+            "tactic_density": tactic_density,
+            "templates": len(templates),
+            "repeat": repeat,
+            "tolerance": tolerance,
+            "seed": seed,
+        },
+        "results": results,
+        "scaling": scaling,
+        "linear": all(check["linear"] for check in scaling.values()),
+    }
+
+def print_report(report: dict):
+    """Print a table of per-declaration stage times and the scaling exponents."""
+    header = f"{'stage':<24}" + "".join(f"{result['declarations']:>12}" for result in report["results"]) + f"{'exponent':>10}"
+    print("Microseconds per declaration")
+    print(header)
+    print("-" * len(header))
+    for stage in STAGES + ["total"]:
+        row = f"{stage:<24}"
+        for result in report["results"]:
+            if stage == "total":
+                seconds = sum(result["timings"].values())
+            else:
+                seconds = result["timings"][stage]
+            row += f"{seconds / result['declarations'] * 1e6:>12.1f}"
+        check = report["scaling"][stage]
+        row += f"{check['exponent']:>10.2f}" + ("" if check["linear"] else "  SUPERLINEAR")
+        print(row)
+    print("\nScaling:", "linear" if report["linear"] else "superlinear")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark each translation stage on synthetic Lean corpora.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 400, 800], help="declaration counts to run")
+    parser.add_argument("--proof-depth", type=int, default=2)
+    parser.add_argument("--bracket-nesting", type=int, default=1)
+    parser.add_argument("--tactic-density", type=float, default=0.2, help="fraction of declarations using intro/obtain/exact")
+    parser.add_argument("--templates", type=int, default=0, help="size of the template set")
+    parser.add_argument("--base-templates", default="templates.json")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed excess of the scaling exponent over 1")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the full report to this path")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.sizes, args.proof_depth, args.bracket_nesting, args.tactic_density, args.templates,
+        args.base_templates, args.repeat, args.tolerance, seed=args.seed,
+    )
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, indent=4)
+
+    # A non-zero exit status lets CI catch scaling regressions
+    raise SystemExit(0 if report["linear"] else 1)
@@ -0,0 +1,110 @@
+# compiled_template.py
+
+import functools
+import re
+import operators
+
+# Argument placeholders {0}, {1}, ... in a template string
+ARGUMENT_PATTERN = re.compile(r"\{(\d+)\}")
+# Anything that looks like a stack reference, {s1} or {s1, negate_inequality}
+STACK_REFERENCE_PATTERN = re.compile(r"\{s\d+(?:,\s*)?[^\}]+\}")
+# A well-formed stack reference
+STACK_REFERENCE_FORMAT = re.compile(r"\{(s(\d+))(?:,\s*(\w+))?\}")
+
+
+class StackReference:
+    """A parsed {sN} or {sN, operation} reference, with its operator looked up in the registry."""
+    __slots__ = ("text", "index", "operation_name", "operation")
+
+    def __init__(self, text: str, index: int, operation_name: str = None):
+        self.text = text
+        self.index = index
+        self.operation_name = operation_name
+        # An unknown operator only raises when the reference is resolved, as before
+        self.operation = operators.OPERATORS.get(operation_name) if operation_name else None
+
+    def resolve(self, statement_stack) -> str:
+        """Apply the operation to the Nth statement from the top of the stack."""
+        try:
+            statement = statement_stack.peek_n(self.index)
+        except IndexError as e:
+            raise ValueError(f"Stack does not contain s{self.index}: {e}")
+
+        # If no operation is specified, return the statement directly
+        if not self.operation_name:
+            return statement
+        operation = self.operation or operators.get_operator(self.operation_name)
+        return operation(statement)
+
+    def __repr__(self):
+        return f"StackReference({self.text!r})"
+
+@functools.lru_cache(maxsize=4096)
+def parse_stack_reference(text: str) -> StackReference:
+    """Parse a stack reference, raising ValueError if it is malformed."""
+    match = STACK_REFERENCE_FORMAT.match(text)
+    if not match:
+        raise ValueError(f"Invalid command format: {text}")
+    _, index_str, operation_name = match.groups()
+    return StackReference(text, int(index_str), operation_name)
+
+class CompiledTemplate:
+    """
+    A templates.json entry compiled into a list of segments.
+
+    Segments are either literal strings or argument indices, so applying the template
+    is a single join with no rescanning of the template string. Stack references are
+    left in the literal text: the translator resolves them in the finished line, which
+    may also hold references from the arguments.
+    """
+    __slots__ = ("expression", "template", "arity", "segments")
+
+    def __init__(self, expression: str, template: str, arity: int):
+        if not isinstance(arity, int) or arity < 0:
+            raise ValueError(f"Template '{expression}' has an invalid number of variables: {arity!r}")
+
+        self.expression = expression
+        self.template = template
+        self.arity = arity
+
+        # Split the template into literal text and argument indices
+        segments = []
+        position = 0
+        for match in ARGUMENT_PATTERN.finditer(template):
+            index = int(match.group(1))
+            if index >= arity:
+                raise ValueError(
+                    f"Template '{expression}' uses {{{index}}} but only takes {arity} variables."
+                )
+            if match.start() > position:
+                segments.append(template[position:match.start()])
+            segments.append(index)
+            position = match.end()
+        if position < len(template):
+            segments.append(template[position:])
+        self.segments = tuple(segments)
+
+    @classmethod
+    def from_dict(cls, template_info: dict) -> "CompiledTemplate":
+        """Compile a template in the templates.json format."""
+        return cls(template_info["expression"], template_info["template"], template_info["variables"])
+
+    def apply(self, args: list, start: int = 0) -> str:
+        """
+        Fill the argument slots from args[start:], leaving the placeholders of missing arguments in place.
+
+        Passing a token list and an offset lets callers apply a template without slicing out its arguments.
+        """
+        num_args = len(args)
+        return "".join(
+            segment if segment.__class__ is str
+            else (str(args[start + segment]) if start + segment < num_args else f"{{{segment}}}")
+            for segment in self.segments
+        )
+
+    def __repr__(self):
+        return f"CompiledTemplate({self.expression!r}, {self.template!r}, {self.arity})"
+
+def compile_templates(template_dict: dict) -> dict:
+    """Compile every template in a dictionary keyed by expression."""
+    return {expression: CompiledTemplate.from_dict(template_info) for expression, template_info in template_dict.items()}
@@ -0,0 +1,262 @@
+# corpus_job.py
+
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from declaration_index import lookups_match, open_declaration_index, update_declaration_index
+from error_log import ErrorLog
+from template_store import load_template_store
+from statement_translator import SUB_EXPRESSION_CACHE_SIZE
+from translate_file import find_lean_files, corpus_output_paths, _init_corpus_worker, _translate_corpus_file
+from translation_cache import hash_file
+
+# Bump when journal records change meaning, so older journals are ignored
+JOURNAL_FORMAT_VERSION = 1
+
+class Journal:
+    """
+    An append-only record of the files a job has finished, one JSON object per line.
+
+    Every line is flushed and fsynced before the job goes on, so after a crash all lines
+    but a torn last one are intact. Lines that do not parse are skipped on load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.completed = {}  # file path -> its latest record
+
+        ends_with_newline = True
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    ends_with_newline = line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get("version") == JOURNAL_FORMAT_VERSION:
+                        self.completed[record["file"]] = record
+        except FileNotFoundError:
+            pass
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+        if not ends_with_newline:
+            # End the torn line, so it does not swallow the next record
+            self.file.write("\n")
+
+    def is_done(self, file_path: str, source_hash: str, templates_hash: str, output_path: str,
+                uses_index: bool = False, declaration_index=None) -> bool:
+        """
+        Check whether a file was finished from the same source and templates, and its output is
+        still there. With uses_index, every name the file looked up in the declaration index
+        must also give the same in declaration_index (None if there is no index yet).
+        """
+        record = self.completed.get(file_path)
+        if not (
+            record is not None
+            and record["source_hash"] == source_hash
+            and record["templates_hash"] == templates_hash
+            and record["output"] == output_path
+            and os.path.exists(output_path)
+        ):
+            return False
+        if uses_index:
+            return "index_lookups" in record and lookups_match(declaration_index, record["index_lookups"])
+        return True
+
+    def append(self, record: dict):
+        record = dict(record, version=JOURNAL_FORMAT_VERSION)
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.completed[record["file"]] = record
+
+    def close(self):
+        self.file.close()
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class CorpusJob:
+    """
+    A corpus translation that can be killed and restarted without losing finished work.
+
+    Each file's LaTeX is written atomically, then recorded in the journal with the
+    hashes of its source and of templates.json. A restarted job skips the files whose
+    record still matches, and so only redoes the files that were in flight. Within
+    those, declarations translated before the interruption are reused from the
+    translation cache, if the job has one. Progress, with an ETA from the throughput
+    observed so far (in source bytes), is printed every progress_interval seconds.
+
+    With an index_path, each file's declarations are journaled with it and the
+    declaration index is rebuilt from the journal when the run ends or is interrupted,
+    so obtain and exact can refer to them from other files in the next run. The names
+    each file looked up in the index are journaled too, and a file is redone when any
+    of them, found or not, gives something else in the index of the last run.
+    """
+
+    def __init__(self, source: str, templates_path: str, output_dir: str, journal_path: str = None,
+                 max_workers: int = None, cache_dir: str = None, store_path: str = None,
+                 error_log: ErrorLog = None, progress_interval: float = 10.0, index_path: str = None,
+                 cache_size: int = SUB_EXPRESSION_CACHE_SIZE):
+        self.source = source
+        self.templates_path = templates_path
+        self.output_dir = output_dir
+        self.journal_path = journal_path or os.path.join(output_dir, "job.journal")
+        self.max_workers = max_workers
+        self.cache_dir = cache_dir
+        self.store_path = store_path
+        self.error_log = error_log
+        self.progress_interval = progress_interval
+        self.index_path = index_path
+        self.cache_size = cache_size
+
+    def run(self) -> dict:
+        """Translate every file the journal does not have yet, and return a summary of this run."""
+        file_paths = find_lean_files(self.source)
+        output_paths = corpus_output_paths(self.source, file_paths, self.output_dir) if file_paths else []
+        templates_hash = hash_file(self.templates_path)
+        journal = Journal(self.journal_path)
+        # The index of the last run, which the workers look names up in
+        declaration_index = open_declaration_index(self.index_path) if self.index_path else None
+
+        # Step 1: Find the unfinished files
+        pending = []
+        for file_path, output_path in zip(file_paths, output_paths):
+            source_hash = hash_file(file_path)
+            done = journal.is_done(
+                file_path, source_hash, templates_hash, output_path, bool(self.index_path), declaration_index
+            )
+            if not done:
+                pending.append((file_path, output_path, source_hash, os.path.getsize(file_path)))
+        if declaration_index is not None:
+            declaration_index.close()
+        print(f"{len(file_paths) - len(pending)} of {len(file_paths)} files already done, {len(pending)} to translate.")
+
+        if pending and self.store_path:
+            load_template_store(self.templates_path, self.store_path).close()
+
+        # Step 2: Translate them, journaling each file as it finishes
+        start_time = time.perf_counter()
+        last_report = start_time
+        total_bytes = sum(size for *_, size in pending)
+        done_bytes = 0
+        done_files = 0
+        statement_count = 0
+        failed_count = 0
+        initargs = (
+            self.templates_path, self.cache_dir, False, self.store_path, self.error_log is not None, self.index_path,
+            self.cache_size,
+        )
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_corpus_worker, initargs=initargs) as executor:
+                futures = {
+                    executor.submit(_translate_corpus_file, file_path, output_path): (file_path, output_path, source_hash, size)
+                    for file_path, output_path, source_hash, size in pending
+                }
+                for future in as_completed(futures):
+                    file_path, output_path, source_hash, size = futures[future]
+                    try:
+                        num_statements, _, errors, declarations, index_lookups = future.result()
+                    except BaseException:
+                        # Leaving the executor waits for its files, so only those already running finish
+                        for pending_future in futures:
+                            pending_future.cancel()
+                        raise
+                    record = {
+                        "file": file_path,
+                        "output": output_path,
+                        "source_hash": source_hash,
+                        "templates_hash": templates_hash,
+                        "statements": num_statements,
+                        "failed": len(errors),
+                    }
+                    if self.index_path:
+                        record["declarations"] = declarations
+                        record["index_lookups"] = index_lookups
+                    journal.append(record)
+                    if self.error_log is not None:
+                        for record in errors:
+                            self.error_log.add(record)
+
+                    done_files += 1
+                    done_bytes += size
+                    statement_count += num_statements
+                    failed_count += len(errors)
+                    now = time.perf_counter()
+                    if now - last_report >= self.progress_interval and done_files < len(pending):
+                        last_report = now
+                        self.report_progress(done_files, len(pending), done_bytes, total_bytes, statement_count, now - start_time)
+        finally:
+            journal.close()
+            if self.index_path:
+                # Files journaled without declarations keep what the index has for them
+                update_declaration_index(self.index_path, {
+                    file_path: journal.completed[file_path]["declarations"]
+                    for file_path in file_paths
+                    if "declarations" in journal.completed.get(file_path, {})
+                })
+        elapsed = time.perf_counter() - start_time
+
+        summary = {
+            "files": len(file_paths),
+            "skipped": len(file_paths) - len(pending),
+            "translated": done_files,
+            "statements": statement_count,
+            "failed": failed_count,
+            "seconds": elapsed,
+            "statements_per_second": statement_count / elapsed if elapsed else 0.0,
+        }
+        print(
+            f"Translated {done_files} files ({statement_count} statements) in {format_duration(elapsed)}, "
+            f"skipped {summary['skipped']} finished files."
+        )
+        return summary
+
+    def report_progress(self, done_files: int, num_files: int, done_bytes: int, total_bytes: int,
+                        statement_count: int, elapsed: float):
+        bytes_per_second = done_bytes / elapsed if elapsed else 0.0
+        eta = (total_bytes - done_bytes) / bytes_per_second if bytes_per_second else 0.0
+        print(
+            f"{done_files}/{num_files} files ({100 * done_bytes / max(total_bytes, 1):.1f}% of source), "
+            f"{statement_count / elapsed if elapsed else 0.0:.1f} statements/s, ETA {format_duration(eta)}",
+            flush=True,
+        )
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Translate a Lean corpus as a resumable job.")
+    parser.add_argument("source", help="directory or glob of Lean files to translate")
+    parser.add_argument("--templates", default="templates.json", help="path to templates.json")
+    parser.add_argument("--output-dir", default="output", help="directory for the translated LaTeX files")
+    parser.add_argument("--journal", default=None, help="job journal, <output-dir>/job.journal by default")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--cache-dir", default=None, help="translation cache, <output-dir>/.translation_cache by default")
+    parser.add_argument("--no-cache", action="store_true", help="do not keep the translation cache, so interrupted files restart from scratch")
+    parser.add_argument("--template-store", default=None, help="compiled template store, built from --templates if missing or stale")
+    parser.add_argument("--error-log", default=None, help="keep going past declarations that fail, logging them to this JSON-lines file")
+    parser.add_argument("--declaration-index", default=None, help="index of declarations for obtain and exact to find in other files, updated by the job")
+    parser.add_argument("--sub-expression-cache-size", type=int, default=SUB_EXPRESSION_CACHE_SIZE, help="sub-expression translations each translator keeps, 0 to turn the cache off")
+    parser.add_argument("--progress-interval", type=float, default=10.0, help="seconds between progress reports")
+    args = parser.parse_args()
+
+    cache_dir = None if args.no_cache else args.cache_dir or os.path.join(args.output_dir, ".translation_cache")
+    error_log = ErrorLog(args.error_log) if args.error_log else None
+    job = CorpusJob(
+        args.source, args.templates, args.output_dir, args.journal, args.workers, cache_dir,
+        args.template_store, error_log, args.progress_interval, args.declaration_index,
+        args.sub_expression_cache_size,
+    )
+    try:
+        job.run()
+    finally:
+        if error_log is not None:
+            error_log.close()
@@ -0,0 +1,217 @@
+# declaration_index.py
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from lru_cache import LRUCache
+from statement_stack import StackItem
+from template_store import SLOT, UINT, EMPTY_SLOT, key_hash
+
+# File layout, all integers little-endian:
+#   header  magic, format version, number of declarations, number of hash table slots,
+#           table offset, data offset
+#   table   one (name hash, name offset, record offset) slot per bucket, open addressing,
+#           with offsets relative to the data section
+#   data    names:    u32 length + UTF-8 name
+#           records:  u32 length + UTF-8 JSON of the declaration's stack item and source file
+INDEX_MAGIC = b"DECLINDX"
+INDEX_FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIIII")
+
+# Tags of the top-level stack items that other files may refer to
+DECLARATION_TAGS = ("theorem", "lemma")
+
+def declaration_records(stack, source_path: str) -> list:
+    """Return index records for the top-level declarations on a stack, bottom to top."""
+    return [
+        dict(item.fields(), file=source_path)
+        for item in stack.items if item.spaces == 0 and item.tag in DECLARATION_TAGS
+    ]
+
+def build_declaration_index(index_path: str, records: list):
+    """Write an index of records to index_path. The first record with a name wins."""
+    by_name = {}
+    for record in records:
+        by_name.setdefault(record["name"], record)
+
+    data = bytearray()
+    def add_string(text: str) -> int:
+        offset = len(data)
+        encoded = text.encode("utf-8")
+        data.extend(UINT.pack(len(encoded)))
+        data.extend(encoded)
+        return offset
+
+    slots = []
+    for name, record in by_name.items():
+        name_offset = add_string(name)
+        record_offset = add_string(json.dumps(record, ensure_ascii=False))
+        slots.append((key_hash(name.encode("utf-8")), name_offset, record_offset))
+
+    # A power-of-two table at most half full keeps probe sequences short
+    num_slots = 8
+    while num_slots < 2 * len(slots):
+        num_slots *= 2
+    table = [(0, EMPTY_SLOT, EMPTY_SLOT)] * num_slots
+    for slot in slots:
+        index = slot[0] & (num_slots - 1)
+        while table[index][1] != EMPTY_SLOT:
+            index = (index + 1) & (num_slots - 1)
+        table[index] = slot
+
+    table_offset = HEADER.size
+    data_offset = table_offset + num_slots * SLOT.size
+    header = HEADER.pack(INDEX_MAGIC, INDEX_FORMAT_VERSION, len(by_name), num_slots, table_offset, data_offset)
+
+    # Write atomically, since running workers may have the old index mapped
+    directory = os.path.dirname(os.path.abspath(index_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(header)
+            for slot in table:
+                file.write(SLOT.pack(*slot))
+            file.write(data)
+        os.replace(temp_path, index_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class DeclarationIndex:
+    """
+    A read-only, memory-mapped index from declaration name to its stack item.
+
+    A stack with an index consults it when get_by_name finds nothing on the stack, so a
+    file can obtain from or apply declarations in other files of the library without
+    loading them. The index is built by corpus runs (see update_declaration_index), and
+    records are decoded only when first looked up. Stacks in different threads may share
+    one index.
+    """
+
+    def __init__(self, index_path: str, cache_size: int = 65536):
+        self.index_path = index_path
+        with open(index_path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.num_declarations, self.num_slots,
+         self.table_offset, self.data_offset) = HEADER.unpack_from(self.buffer, 0)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not a declaration index.")
+        if version != INDEX_FORMAT_VERSION:
+            raise ValueError(f"{index_path} has format version {version}, expected {INDEX_FORMAT_VERSION}.")
+
+        # Name -> StackItem, or False for names not in the index
+        self.items = LRUCache(cache_size)
+        self.items_lock = threading.Lock()
+
+    def close(self):
+        self.buffer.close()
+
+    def read_string(self, offset: int) -> str:
+        start = self.data_offset + offset + UINT.size
+        length = UINT.unpack_from(self.buffer, start - UINT.size)[0]
+        return self.buffer[start:start + length].decode("utf-8")
+
+    def find(self, name: str):
+        """Return the record offset for a name, or None if it is not in the index."""
+        key = name.encode("utf-8")
+        hash_value = key_hash(key)
+        mask = self.num_slots - 1
+        index = hash_value & mask
+        while True:
+            slot_hash, name_offset, record_offset = SLOT.unpack_from(self.buffer, self.table_offset + index * SLOT.size)
+            if name_offset == EMPTY_SLOT:
+                return None
+            if slot_hash == hash_value:
+                start = self.data_offset + name_offset + UINT.size
+                length = UINT.unpack_from(self.buffer, start - UINT.size)[0]
+                if self.buffer[start:start + length] == key:
+                    return record_offset
+            index = (index + 1) & mask
+
+    def lookup(self, name: str):
+        """Return the stack item of the declaration with a name, or None."""
+        with self.items_lock:
+            item = self.items.get(name)
+        if item is None:
+            record_offset = self.find(name)
+            if record_offset is None:
+                item = False
+            else:
+                record = json.loads(self.read_string(record_offset))
+                del record["file"]
+                item = StackItem(**record)
+            with self.items_lock:
+                self.items.put(name, item)
+        return item or None
+
+    def records(self) -> list:
+        """Decode every record in the index."""
+        records = []
+        for index in range(self.num_slots):
+            _, name_offset, record_offset = SLOT.unpack_from(self.buffer, self.table_offset + index * SLOT.size)
+            if name_offset != EMPTY_SLOT:
+                records.append(json.loads(self.read_string(record_offset)))
+        return records
+
+    def __len__(self):
+        return self.num_declarations
+
+def item_digest(item) -> str:
+    """Return a digest of the stack item an index lookup gave, or None if it found nothing."""
+    if item is None:
+        return None
+    return hashlib.sha256(json.dumps(item.fields(), ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()
+
+class RecordingIndex:
+    """
+    Looks names up in a DeclarationIndex, or finds nothing if index is None, recording a
+    digest of what each name gave. Corpus jobs journal the lookups of each file, so that
+    it is redone once a declaration it used, or failed to find, changes in the index.
+    """
+
+    def __init__(self, index: DeclarationIndex = None):
+        self.index = index
+        self.lookups = {}  # name -> item_digest of the first lookup
+
+    def lookup(self, name: str):
+        item = self.index.lookup(name) if self.index is not None else None
+        self.lookups.setdefault(name, item_digest(item))
+        return item
+
+def lookups_match(index, lookups: dict) -> bool:
+    """Check that every name of a RecordingIndex's lookups gives the same in index, which may be None."""
+    return all(
+        item_digest(index.lookup(name) if index is not None else None) == digest
+        for name, digest in lookups.items()
+    )
+
+def open_declaration_index(index_path: str):
+    """Open the index at index_path, or return None if there is none yet."""
+    try:
+        return DeclarationIndex(index_path)
+    except (FileNotFoundError, ValueError, struct.error):
+        return None
+
+def update_declaration_index(index_path: str, records_by_file: dict):
+    """
+    Rebuild the index with the records of the given files (file path -> records) in place
+    of what it had for those files, keeping the records of every other file that still
+    exists, so declarations of deleted files are dropped.
+    """
+    records = []
+    index = open_declaration_index(index_path)
+    if index is not None:
+        records = [
+            record for record in index.records()
+            if record["file"] not in records_by_file and os.path.exists(record["file"])
+        ]
+        index.close()
+    for file_records in records_by_file.values():
+        records.extend(file_records)
+    build_declaration_index(index_path, records)
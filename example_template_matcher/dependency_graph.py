@@ -0,0 +1,208 @@
+# dependency_graph.py
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from declaration_index import DeclarationIndex
+from error_log import fallback_translation
+from file_cleaner import replace_intro_variable_in_statement, clean_statement
+from statement_stack import PersistentStatementStack
+from statement_translator import SUB_EXPRESSION_CACHE_SIZE, StatementTranslator, TranslatorConfig
+from template_store import TemplateStore
+from text_compiler import compile_output
+from translation_cache import record_translation, variant_matches, apply_effects
+
+# Anything between whitespace, brackets and commas may name an earlier declaration
+NAME_PATTERN = re.compile(r"[^\s()\[\]{}⟨⟩,]+")
+
+def declared_name(statement: str):
+    """Return the name a statement declares (the word after its keyword), or None."""
+    words = statement.split(None, 2)
+    return words[1] if len(words) > 1 else None
+
+def referenced_names(statement: str) -> set:
+    return set(NAME_PATTERN.findall(statement))
+
+
+class DependencyGraph:
+    """
+    The dependency graph of the declarations in a file.
+
+    A declaration depends on every earlier declaration whose name it mentions, such as
+    the lemmas it obtains from or applies. Declarations in the same wave depend on
+    nothing in that wave or later ones, so a wave can be translated concurrently once the
+    waves before it are done.
+    """
+
+    def __init__(self, statements: list):
+        self.statements = statements
+        self.dependencies = []  # index -> sorted indices of the earlier declarations it mentions
+        self.levels = []  # index -> length of its longest dependency chain
+        declarations = {}  # name -> indices of the declarations with that name
+
+        for index, statement in enumerate(statements):
+            dependencies = set()
+            for name in referenced_names(statement):
+                dependencies.update(declarations.get(name, ()))
+            self.dependencies.append(sorted(dependencies))
+            self.levels.append(1 + max((self.levels[i] for i in dependencies), default=-1))
+
+            name = declared_name(statement)
+            if name is not None:
+                declarations.setdefault(name, []).append(index)
+
+    def closure(self, index: int) -> list:
+        """Return the indices of everything a declaration depends on, directly or not, in order."""
+        seen = set()
+        pending = list(self.dependencies[index])
+        while pending:
+            i = pending.pop()
+            if i not in seen:
+                seen.add(i)
+                pending.extend(self.dependencies[i])
+        return sorted(seen)
+
+    def waves(self) -> list:
+        """Group the declarations by level, each wave in file order."""
+        waves = [[] for _ in range(max(self.levels, default=-1) + 1)]
+        for index, level in enumerate(self.levels):
+            waves[level].append(index)
+        return waves
+
+
+# Translator built once per worker process by _init_worker, from the worker's one
+# TranslatorConfig, and reused for every chunk
+_worker_translator = None
+
+def _init_worker(template_dict: dict, store_path: str = None, index_path: str = None,
+                 cache_size: int = SUB_EXPRESSION_CACHE_SIZE):
+    global _worker_translator
+    templates = TemplateStore.open(store_path) if store_path else template_dict
+    _worker_translator = StatementTranslator(None, cache_size=cache_size, config=TranslatorConfig.for_templates(templates))
+    if index_path:
+        _worker_translator.statement_stack.declaration_index = DeclarationIndex(index_path)
+
+def _translate_speculatively(statement: str, base: list):
+    """
+    Translate a statement on a stack holding only the effects of the declarations it
+    depends on. Returns (variant, cleaned statement, LaTeX), or None if translation
+    failed, in which case the merge retranslates it and raises the error in order.
+    """
+    stack = _worker_translator.statement_stack
+    stack.rebuild([])
+    for effects in base:
+        apply_effects(stack, effects)
+    stack.prune_stack(0)
+    try:
+        variant = record_translation(_worker_translator, statement)
+        # The merge needs only the cleaned translation, so the raw one is not sent back
+        cleaned_statement = clean_statement(replace_intro_variable_in_statement(variant.pop("translation")))
+        return variant, cleaned_statement, compile_output([cleaned_statement])
+    except Exception:
+        return None
+
+
+class ParallelTranslator:
+    """
+    Translates the declarations of one file concurrently, with output identical to
+    translating them in order.
+
+    Each declaration is translated on a pool, wave by wave (see DependencyGraph), on a
+    stack built from the effects of the declarations it depends on. The translations
+    are then merged in file order onto the real stack: a declaration whose recorded
+    stack lookups (see StackDependencies) give the same results on the real stack is
+    taken as is, and any other is retranslated there, as the sequential run would.
+    With an error_log, failures are handled as in a resilient iter_translations, and
+    with a declaration_index, names not in the file are looked up there.
+
+    templates is a TranslatorConfig, or anything it is made from, whose templates are a
+    dictionary or a TemplateStore that the workers can load. Every file's translator
+    shares the config, and the pool, with a config per worker, is kept until close.
+    """
+
+    def __init__(self, templates, max_workers: int = None, error_log=None, declaration_index: DeclarationIndex = None,
+                 cache_size: int = SUB_EXPRESSION_CACHE_SIZE):
+        self.config = TranslatorConfig.for_templates(templates)
+        self.max_workers = max_workers
+        self.error_log = error_log
+        self.declaration_index = declaration_index
+        self.cache_size = cache_size
+        self.reused = 0
+        self.retranslated = 0
+
+        index_path = declaration_index.index_path if declaration_index is not None else None
+        if self.config.template_dict is not None:
+            self.initargs = (self.config.template_dict, None, index_path, cache_size)
+        elif isinstance(self.config.template_trie, TemplateStore):
+            self.initargs = (None, self.config.template_trie.store_path, index_path, cache_size)
+        else:
+            raise ValueError("Parallel declarations need a template dictionary or a TemplateStore to hand to their workers.")
+        self.executor = None  # Started on first use
+
+    def speculate(self, statements: list) -> list:
+        """Translate every statement on the pool, returning the results in file order."""
+        graph = DependencyGraph(statements)
+        results = [None] * len(statements)
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker, initargs=self.initargs)
+
+        chunk_divisor = 4 * (self.max_workers or os.cpu_count() or 1)
+        for wave in graph.waves():
+            # Only the effects of a variant are needed to rebuild a base
+            bases = [
+                [
+                    {"edits": results[i][0]["edits"], "added_items": results[i][0]["added_items"]}
+                    for i in graph.closure(index) if results[i] is not None
+                ]
+                for index in wave
+            ]
+            wave_results = self.executor.map(
+                _translate_speculatively, [statements[index] for index in wave], bases,
+                chunksize=max(1, len(wave) // chunk_divisor),
+            )
+            for index, result in zip(wave, wave_results):
+                results[index] = result
+        return results
+
+    def translate(self, statements):
+        """Yield (statement, cleaned_statement, latex) for each statement, in order."""
+        statements = list(statements)
+        results = self.speculate(statements)
+
+        statement_stack = PersistentStatementStack() if self.error_log is not None else None
+        statement_translator = StatementTranslator(
+            None, cache_size=self.cache_size, statement_stack=statement_stack, config=self.config
+        )
+        stack = statement_translator.statement_stack
+        stack.declaration_index = self.declaration_index
+
+        for index, (statement, result) in enumerate(zip(statements, results)):
+            # Every translation starts by pruning the stack to the top level
+            stack.prune_stack(0)
+            if result is not None and variant_matches(stack, result[0]):
+                self.reused += 1
+                apply_effects(stack, result[0])
+                _, cleaned_statement, latex = result
+            else:
+                self.retranslated += 1
+                snapshot = stack.snapshot() if self.error_log is not None else None
+                try:
+                    translated_statement = statement_translator(statement)
+                    cleaned_statement = clean_statement(replace_intro_variable_in_statement(translated_statement))
+                    latex = compile_output([cleaned_statement])
+                except Exception as e:
+                    if self.error_log is None:
+                        raise
+                    stack.restore(snapshot)
+                    self.error_log.record(index, statement, e)
+                    cleaned_statement, latex = fallback_translation(statement, e)
+            yield statement, cleaned_statement, latex
+
+    def stats(self) -> dict:
+        return {"reused": self.reused, "retranslated": self.retranslated}
+
+    def close(self):
+        """Shut down the worker pool, if it was started."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,55 @@
+# error_log.py
+
+import json
+import os
+import traceback
+from text_compiler import compile_fallback
+
+class ErrorLog:
+    """
+    Records the declarations that failed to translate in a resilient run.
+
+    Each failure is one JSON object: the source file, the declaration's index and name,
+    the exception, and the file, line and function it was raised in. Records are kept in
+    memory and, if a path is given, appended to it as JSON lines as they happen.
+    """
+
+    def __init__(self, path: str = None):
+        self.records = []
+        self.file = open(path, 'a', encoding='utf-8') if path else None
+        self.source_path = None  # Lean file the declarations being translated come from
+
+    def record(self, index: int, statement: str, error: Exception) -> dict:
+        """Record the failure of the declaration at index, returning the record."""
+        words = statement.split(None, 2)
+        frame = traceback.extract_tb(error.__traceback__)[-1] if error.__traceback__ else None
+        record = {
+            "file": self.source_path,
+            "index": index,
+            "name": words[1] if len(words) > 1 else "",
+            "error": type(error).__name__,
+            "message": str(error),
+            "location": f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}" if frame else None,
+        }
+        self.add(record)
+        return record
+
+    def add(self, record: dict):
+        """Add a record made elsewhere, such as by a corpus worker."""
+        self.records.append(record)
+        if self.file:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def __len__(self):
+        return len(self.records)
+
+def fallback_translation(statement: str, error: Exception) -> tuple:
+    """Return the (cleaned_statement, latex) that stand in for a declaration that failed to translate."""
+    message = f"{type(error).__name__}: {' '.join(str(error).split())}"
+    return f"{statement}\n  -- untranslated: {message}", compile_fallback(statement, message)
@@ -1,5 +1,6 @@
 # file_cleaner.py
 
+import functools
 import re
 
 def remove_lean_comments(file_content: str) -> str:
@@ -17,12 +18,17 @@ def remove_lean_comments(file_content: str) -> str:
 
     return file_content
 
+@functools.lru_cache(maxsize=None)
+def line_start_pattern(words: tuple, rest: str = "", flags: int = 0):
+    """Return a cached pattern matching lines that start with any of the words."""
+    return re.compile(r"^\s*(" + "|".join(re.escape(word) for word in words) + r")\b" + rest, flags)
+
 def remove_specific_lines(file_content: str, words_to_remove: list) -> str:
-    # Create a regular expression to match lines starting with any of the specified words
-    pattern = r"^\s*(" + "|".join(re.escape(word) for word in words_to_remove) + r")\b.*"
+    # Match lines starting with any of the specified words
+    pattern = line_start_pattern(tuple(words_to_remove), ".*", re.MULTILINE)
     
     # Remove lines matching the pattern
-    file_content = re.sub(pattern, "", file_content, flags=re.MULTILINE)
+    file_content = pattern.sub("", file_content)
     
     # Clean up extra blank lines left by the removals
     file_content = re.sub(r"\n\s*\n", "\n\n", file_content)
@@ -38,7 +44,7 @@ def extract_statements(file_content: str, keywords: list) -> list:
     statements = []
     current_statement = []
     in_statement = False
-    keywords_pattern = re.compile(r"^\s*(" + "|".join(re.escape(word) for word in keywords) + r")\b")
+    keywords_pattern = line_start_pattern(tuple(keywords))
 
     # Go through each line in the file content
     for line in file_content.splitlines():
@@ -57,64 +63,318 @@ def extract_statements(file_content: str, keywords: list) -> list:
 
     return statements
 
-def clean_output(translated_statements):
-    equation_symbols = ["+", "-", "*", "/", "="]  # Add other symbols as needed
-    # Create a regex pattern that matches any of the equation symbols
-    equation_symbols_pattern = "|".join(map(re.escape, equation_symbols))
+# Tokens of a regular expression that shift_group_references must tell apart
+REGEX_TOKEN_PATTERN = re.compile(
+    r"\\(?P<octal>0[0-7]{0,2}|[0-7]{3})"  # Octal escapes, which look like references
+    r"|\\(?P<reference>[1-9][0-9]?)"
+    r"|\(\?\((?P<condition>[1-9][0-9]*)\)"
+    r"|(?P<class>\[\^?\]?(?:\\.|[^\]\\])*\])"  # Inside a class, \1 is an octal escape
+    r"|\\.",
+    re.DOTALL,
+)
+
+def shift_group_references(pattern: str, offset: int) -> str:
+    """Renumber the numbered backreferences of a pattern that is placed after offset other groups."""
+    def shift(match):
+        if match.group("reference"):
+            number = int(match.group("reference")) + offset
+            if number > 99:
+                raise ValueError(f"Pattern {pattern!r} refers to group {number} of the combined pattern, past 99.")
+            return f"\\{number}"
+        if match.group("condition"):
+            return f"(?({int(match.group('condition')) + offset})"
+        return match.group()
+    return REGEX_TOKEN_PATTERN.sub(shift, pattern)
+
+class OutputCleaner:
+    """
+    A post-processor for translated statements, with its rules compiled into one pattern.
+
+    Parentheses whose contents contain no equation symbol are removed at any nesting
+    depth. The remaining rules collapse repeated "because", drop an "and" right after
+    "because" and remove whitespace before commas and periods. Extra rules are
+    (pattern, replacement) pairs, where the replacement is a template string or a
+    function of the match; they join the same pattern, so they add no extra scans.
+    They come first in it, so an extra rule that matches where a built-in rule would
+    also match takes precedence, and the text it replaces is not cleaned further.
+
+    Numbered backreferences in extra rules, \\1 or (?(1)...), are renumbered for their
+    place in the combined pattern, which can refer to at most 99 groups that way. Named
+    groups must have names unique across the extra rules, and not be rule<N>, because,
+    because_and or punctuation.
+    """
+
+    EQUATION_SYMBOLS = ["+", "-", "*", "/", "="]  # Add other symbols as needed
+
+    def __init__(self, extra_rules: list = (), equation_symbols: list = EQUATION_SYMBOLS):
+        symbols = "|".join(map(re.escape, equation_symbols))
+        self.parentheses_pattern = re.compile(r"(?P<open>\()|(?P<close>\))|(?P<symbol>" + symbols + ")")
 
-    cleaned_statements = []
-    for line in translated_statements:
-        # Remove any parentheses without symbols from equation_symbols
-        # This regex finds parentheses that don't contain any equation symbols
-        cleaned_line = re.sub(r'\(([^()]*?)\)', 
-                              lambda m: m.group(1) if not re.search(equation_symbols_pattern, m.group(1)) else m.group(0), 
-                              line)
+        # The first alternative that matches at a position wins, so extra rules go first
+        alternatives = []
+        self.extra_rules = {}
+        num_groups = 0
+        for i, (pattern, replacement) in enumerate(extra_rules):
+            name = f"rule{i}"
+            rule_pattern = re.compile(pattern)
+            # Inside the combined pattern, the rule's groups come after every group before it and its own
+            alternatives.append(f"(?P<{name}>{shift_group_references(pattern, num_groups + 1)})")
+            self.extra_rules[name] = (rule_pattern, replacement)
+            num_groups += rule_pattern.groups + 1
+        alternatives.append(r"(?P<because>(?:because\s+)+(?P<because_and>and\b)?)")
+        alternatives.append(r"(?P<punctuation>\s+(?=[,.]))")
+        self.rules_pattern = re.compile("|".join(alternatives))
 
-        # Remove redundant "because"
-        cleaned_line = re.sub(r'(because\s+)+', 'because ', cleaned_line)
+    def clean(self, line: str) -> str:
+        """Apply every rule to a translated statement."""
+        if "(" in line:
+            line = self.remove_parentheses(line)
+        return self.rules_pattern.sub(self.apply_rule, line)
 
-        # Remove "and" after "because"
-        cleaned_line = re.sub(r'\bbecause\s+and\b', 'because', cleaned_line)
+    def remove_parentheses(self, line: str) -> str:
+        """Remove parentheses, nested or not, whose contents have no equation symbols."""
+        output = []
+        open_parentheses = []  # [index in output, whether an equation symbol is inside] for each open "("
+        position = 0
 
-        # Remove spaces before commas and periods
-        cleaned_line = re.sub(r'\s+([,.])', r'\1', cleaned_line)
+        for match in self.parentheses_pattern.finditer(line):
+            output.append(line[position:match.start()])
+            position = match.end()
 
-        cleaned_statements.append(cleaned_line)
-    return cleaned_statements
+            if match.lastgroup == "open":
+                open_parentheses.append([len(output), False])
+                output.append("(")
+            elif match.lastgroup == "symbol":
+                if open_parentheses:
+                    open_parentheses[-1][1] = True
+                output.append(match.group())
+            elif open_parentheses:
+                index, has_symbol = open_parentheses.pop()
+                if has_symbol:
+                    output.append(")")
+                    if open_parentheses:
+                        open_parentheses[-1][1] = True
+                else:
+                    output[index] = ""
+            else:
+                output.append(")")  # Unmatched
+
+        output.append(line[position:])
+        return "".join(output)
+
+    def apply_rule(self, match) -> str:
+        """Return the replacement for a match of the combined rules pattern."""
+        kind = match.lastgroup
+        if kind == "because" or kind == "because_and":
+            # Collapse redundant "because" and remove "and" after it, keeping the space unless punctuation follows
+            if match.group("because_and") or match.string.startswith((",", "."), match.end()):
+                return "because"
+            return "because "
+
+        if kind == "punctuation":
+            return ""  # Remove spaces before commas and periods
+
+        rule_pattern, replacement = self.extra_rules[kind]
+        rule_match = rule_pattern.match(match.string, match.start())
+        if callable(replacement):
+            return replacement(rule_match)
+        return rule_match.expand(replacement)
+
+# Post-processor used by clean_output and clean_statement
+output_cleaner = OutputCleaner()
+
+def clean_output(translated_statements):
+    return [clean_statement(line) for line in translated_statements]
+
+def clean_statement(line: str) -> str:
+    return output_cleaner.clean(line)
 
 def replace_succ_with_increment(content: str) -> str:
     # Replace occurrences of `.succ` with `(x+1)`
     return re.sub(r"(\w+)\.succ", r"(\1+1)", content)
 
 def replace_intro_variable(statements):
-    updated_statements = []
-    
-    for statement in statements:
-        lines = statement.splitlines()
-        modified_lines = []
-        for_every_stack = []
-        
+    return [replace_intro_variable_in_statement(statement) for statement in statements]
+
+# Patterns for replace_intro_variable, compiled once
+FOR_EVERY_PATTERN = re.compile(r"\bfor every (\w+)\b")
+INTRO_PATTERN = re.compile(r"\bintro (\w+)\b")
+
+@functools.lru_cache(maxsize=1024)
+def whole_word_pattern(word: str):
+    """Return a cached pattern matching word as a whole word."""
+    return re.compile(rf"\b{re.escape(word)}\b")
+
+def replace_intro_variable_in_statement(statement: str) -> str:
+    modified_lines = []
+    binders = []  # (index in modified_lines, VARIABLE_NAME) for each "for every" seen so far
+    renames = {}  # index in modified_lines -> [(VARIABLE_NAME, intro variable)], in order
+
+    for line in statement.splitlines():
+        # Track "for every VARIABLE_NAME" declarations, and the line they appear on
+        for match in FOR_EVERY_PATTERN.finditer(line):
+            binders.append((len(modified_lines), match.group(1)))
+
+        # Process "intro VARIABLE_NAME" to record the rename and remove it
+        intro_match = INTRO_PATTERN.search(line)
+        if intro_match and binders:
+            line_index, variable_name = binders.pop()
+            if line_index < len(modified_lines):  # The binder is not on this removed line
+                renames.setdefault(line_index, []).append((variable_name, intro_match.group(1)))
+            continue  # Skip adding the "intro" line to remove it
+
+        # Add non-"intro" lines to the output
+        modified_lines.append(line)
+
+    # Replace VARIABLE_NAME in the lines of the "for every" binders
+    for line_index, line_renames in renames.items():
+        line = modified_lines[line_index]
+        for variable_name, intro_var in line_renames:
+            line = whole_word_pattern(variable_name).sub(intro_var, line)
+        modified_lines[line_index] = line
+
+    return "\n".join(modified_lines)
+
+
+# Streaming versions of the cleaning steps, which hold one line or one statement at a time
+
+class LeanSourceCleaner:
+    """
+    A fused cleaner for Lean source, with its patterns compiled once.
+
+    A single scan over each line strips comments, including nested block comments, while
+    leaving `--` and `/-` inside string literals alone. A string ends with its line, so an
+    unmatched quote cannot hide the comments of the lines after it. The same scan removes
+    the ").1"/").2" direction markers and replaces `.succ`. Lines starting with one of the
+    words to remove are dropped, and runs of blank lines collapse into one.
+    """
+
+    # What the scan looks for in code, inside a block comment, and inside a string
+    CODE_PATTERN = re.compile(r"""/-|--|"|'"'|\)(?:\.[12])+|(?<!\w)(\w+)\.succ""")
+    COMMENT_PATTERN = re.compile(r"/-|-/")
+    STRING_PATTERN = re.compile(r'\\.|"')
+
+    def __init__(self, words_to_remove: list):
+        self.words_pattern = re.compile(r"^\s*(" + "|".join(re.escape(word) for word in words_to_remove) + r")\b")
+
+    def clean(self, file_content: str) -> str:
+        """Clean the whole content of a Lean file."""
+        return "\n".join(self.iter_lines(file_content.splitlines()))
+
+    def iter_lines(self, lines):
+        """Yield the cleaned lines of a Lean file one at a time."""
+        first_line = True
+        blank_run = False
+
+        for text in self.iter_code_lines(lines):
+            # Remove trailing whitespace and specified lines
+            text = text.rstrip(" \t")
+            if self.words_pattern.match(text):
+                text = ""
+
+            # Collapse runs of blank lines into a single blank line
+            if first_line:
+                first_line = False
+            elif not text.strip():
+                blank_run = True
+                continue
+            if blank_run:
+                yield ""
+                blank_run = False
+            yield text
+
+        if blank_run:
+            yield ""
+
+    def iter_code_lines(self, lines):
+        """Yield lines with comments removed and markers and `.succ` rewritten, joining the lines a block comment spans."""
+        pieces = []  # Pieces of the current line, which grows while a block comment spans lines
+        comment_depth = 0
+
         for line in lines:
-            # Track "for every VARIABLE_NAME" declarations
-            for match in re.finditer(r"\bfor every (\w+)\b", line):
-                for_every_stack.append(match.group(1))
-            
-            # Process "intro VARIABLE_NAME" to replace and remove it
-            intro_match = re.search(r"\bintro (\w+)\b", line)
-            if intro_match and for_every_stack:
-                intro_var = intro_match.group(1)
-                variable_name = for_every_stack.pop()
-                
-                # Replace VARIABLE_NAME in the most recent "for every" line
-                for j in range(len(modified_lines)-1, -1, -1):
-                    if re.search(rf"\bfor every {re.escape(variable_name)}\b", modified_lines[j]):
-                        modified_lines[j] = re.sub(rf"\b{re.escape(variable_name)}\b", intro_var, modified_lines[j])
+            line = line.rstrip("\r\n")
+            i = 0
+            in_string = False
+            while True:
+                if comment_depth:
+                    match = self.COMMENT_PATTERN.search(line, i)
+                    if match is None:
                         break
-                continue  # Skip adding the "intro" line to remove it
+                    comment_depth += 1 if match.group() == "/-" else -1
+                    i = match.end()
+                    continue
 
-            # Add non-"intro" lines to the output
-            modified_lines.append(line)
-        
-        updated_statements.append("\n".join(modified_lines))
-    
-    return updated_statements
\ No newline at end of file
+                if in_string:
+                    match = self.STRING_PATTERN.search(line, i)
+                    if match is None:
+                        pieces.append(line[i:])
+                        break
+                    pieces.append(line[i:match.end()])
+                    in_string = match.group() != '"'
+                    i = match.end()
+                    continue
+
+                match = self.CODE_PATTERN.search(line, i)
+                if match is None:
+                    pieces.append(line[i:])
+                    break
+                pieces.append(line[i:match.start()])
+                token = match.group()
+                i = match.end()
+                if token == "/-":
+                    comment_depth = 1
+                elif token == "--":
+                    break  # The rest of the line is a comment
+                elif token == '"':
+                    pieces.append(token)
+                    in_string = True
+                elif match.group(1):
+                    pieces.append(f"({match.group(1)}+1)")
+                elif token[0] == ")":
+                    pieces.append(")")
+                else:
+                    pieces.append(token)  # A character literal
+
+            # Only yield once the line is outside of a comment
+            if not comment_depth:
+                yield "".join(pieces)
+                pieces = []
+
+        if pieces:
+            yield "".join(pieces)
+
+@functools.lru_cache(maxsize=None)
+def get_source_cleaner(words_to_remove: tuple) -> LeanSourceCleaner:
+    """Return the cleaner for a set of words to remove, compiling it on first use."""
+    return LeanSourceCleaner(words_to_remove)
+
+def clean_lean_source(file_content: str, words_to_remove: list) -> str:
+    """Clean a Lean file in one scan, doing the work of the separate cleaning functions."""
+    return get_source_cleaner(tuple(words_to_remove)).clean(file_content)
+
+def iter_clean_lines(lines, words_to_remove: list):
+    """
+    Yield the lines of a Lean file with comments, the specified lines and the direction
+    markers removed and `.succ` replaced, one line at a time.
+    """
+    return get_source_cleaner(tuple(words_to_remove)).iter_lines(lines)
+
+def iter_statements(lines, keywords: list):
+    """Yield statements one at a time from an iterable of cleaned lines."""
+    current_statement = []
+    in_statement = False
+    keywords_pattern = line_start_pattern(tuple(keywords))
+
+    for line in lines:
+        if keywords_pattern.match(line):  # Line starts with one of the keywords
+            if in_statement:
+                # Yield the completed statement
+                yield "\n".join(current_statement)
+                current_statement = []
+            in_statement = True
+        if in_statement:
+            current_statement.append(line)
+
+    # Yield the last statement if it exists
+    if current_statement:
+        yield "\n".join(current_statement)
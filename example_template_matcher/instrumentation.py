@@ -0,0 +1,199 @@
+# instrumentation.py
+
+import cProfile
+import json
+import os
+import signal
+import time
+from contextlib import contextmanager
+
+class Instrumentation:
+    """
+    Opt-in timers and counters for the translation pipeline.
+
+    Stage times are exclusive: while a stage runs inside another (a generator pulling
+    from the one before it, say), the outer stage's clock is paused. Components take an
+    instrumentation argument that defaults to None and check it before recording, so
+    leaving it off costs one comparison per hook.
+    """
+
+    def __init__(self):
+        self.stages = {}  # name -> {"wall", "cpu", "calls"}
+        self.statements = []  # per-statement timings, in order
+        self.counters = {}
+        self.maxima = {}
+        self.active = []  # [name, wall start, CPU start] of the running stages, innermost last
+
+    ############
+    ## STAGES ##
+    ############
+
+    def start(self, name: str):
+        """Start timing a stage, pausing the stage it runs inside."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        if self.active:
+            self.accrue(self.active[-1], wall, cpu)
+        self.active.append([name, wall, cpu])
+
+    def stop(self):
+        """Stop timing the innermost stage and resume the one it ran inside."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        frame = self.active.pop()
+        self.accrue(frame, wall, cpu)
+        self.stages[frame[0]]["calls"] += 1
+        if self.active:
+            self.active[-1][1] = wall
+            self.active[-1][2] = cpu
+
+    def accrue(self, frame: list, wall: float, cpu: float):
+        stage = self.stages.setdefault(frame[0], {"wall": 0.0, "cpu": 0.0, "calls": 0})
+        stage["wall"] += wall - frame[1]
+        stage["cpu"] += cpu - frame[2]
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time the body of a with statement as a stage."""
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def timed_iter(self, name: str, iterable):
+        """Wrap an iterable so that the time spent producing each item counts towards a stage."""
+        iterator = iter(iterable)
+        while True:
+            self.start(name)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.stop()
+            yield item
+
+    @contextmanager
+    def statement(self, statement: str):
+        """Time the translation of one statement from start to finish."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            words = statement.split(None, 2)
+            self.statements.append({
+                "index": len(self.statements),
+                "name": words[1] if len(words) > 1 else "",
+                "lines": statement.count("\n") + 1,
+                "wall": time.perf_counter() - wall,
+                "cpu": time.process_time() - cpu,
+            })
+
+    ##############
+    ## COUNTERS ##
+    ##############
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def maximum(self, name: str, value):
+        """Record value if it is the largest seen under name."""
+        if value > self.maxima.get(name, value - 1):
+            self.maxima[name] = value
+
+    ############
+    ## OUTPUT ##
+    ############
+
+    def report(self) -> dict:
+        """Return everything recorded as a JSON-serializable dict."""
+        return {
+            "stages": self.stages,
+            "total": {
+                "wall": sum(stage["wall"] for stage in self.stages.values()),
+                "cpu": sum(stage["cpu"] for stage in self.stages.values()),
+            },
+            "statements": self.statements,
+            "counters": self.counters,
+            "maxima": self.maxima,
+        }
+
+    def merge(self, report: dict):
+        """Add a report from another run, such as a corpus worker, to this one."""
+        for name, other in report["stages"].items():
+            stage = self.stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0})
+            for key in stage:
+                stage[key] += other[key]
+        for statement in report["statements"]:
+            self.statements.append(dict(statement, index=len(self.statements)))
+        for name, n in report["counters"].items():
+            self.count(name, n)
+        for name, value in report["maxima"].items():
+            self.maximum(name, value)
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(self.report(), file, indent=4)
+
+
+class StackSampler:
+    """
+    A sampling profiler that writes collapsed stacks, the input format of flamegraph.pl
+    and speedscope.
+
+    Samples the main thread's Python stack every interval seconds of CPU time, using
+    SIGPROF, so it is only available on Unix.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        if not hasattr(signal, "setitimer"):
+            raise RuntimeError("Stack sampling needs signal.setitimer, which this platform lacks")
+        self.interval = interval
+        self.samples = {}  # collapsed stack -> number of samples
+        self.previous_handler = None
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.samples[stack] = self.samples.get(stack, 0) + 1
+
+    def start(self):
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+
+    def write(self, path: str):
+        with open(path, 'w', encoding='utf-8') as file:
+            for stack, n in sorted(self.samples.items()):
+                file.write(f"{stack} {n}\n")
+
+
+@contextmanager
+def profiling(profile_path: str = None, collapsed_path: str = None):
+    """
+    Profile the body of a with statement.
+
+    Writes cProfile statistics (readable with pstats or snakeviz) to profile_path and
+    sampled collapsed stacks to collapsed_path, for whichever paths are given.
+    """
+    profiler = cProfile.Profile() if profile_path else None
+    sampler = StackSampler() if collapsed_path else None
+    if sampler:
+        sampler.start()
+    if profiler:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        if sampler:
+            sampler.stop()
+            sampler.write(collapsed_path)
@@ -0,0 +1,146 @@
+# lexer.py
+
+import re
+
+# Character classes
+WORD = 0
+SPACE = 1
+COMMA = 2
+OPEN = 3
+CLOSE = 4
+
+# Characters for which str.isspace() is true
+WHITESPACE = "".join(chr(code) for code in range(0x3001) if chr(code).isspace())
+
+class Token:
+    """A plain token and its [start, end) span in the source."""
+    __slots__ = ("text", "start", "end")
+
+    def __init__(self, text: str, start: int, end: int):
+        self.text = text
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"Token({self.text!r}, {self.start}, {self.end})"
+
+
+class Group:
+    """
+    A bracketed sub-expression and its [start, end) span in the source, delimiters included.
+
+    A group that is never closed, or that is closed implicitly by an enclosing group's
+    delimiter, ends where its contents end and has closed set to False.
+    """
+    __slots__ = ("left", "right", "children", "start", "end", "closed")
+
+    def __init__(self, left: str, right: str, start: int):
+        self.left = left
+        self.right = right
+        self.children = []
+        self.start = start
+        self.end = None
+        self.closed = False
+
+    def __repr__(self):
+        return f"Group({self.left!r}, {self.children!r}, {self.start}, {self.end})"
+
+
+class Lexer:
+    """
+    A single-pass lexer that turns lines into token trees.
+
+    Whitespace separates tokens, commas are tokens of their own, and each bracketed
+    sub-expression becomes a Group of tokens. Groups are tracked on an explicit stack,
+    so arbitrarily deep nesting costs linear time and no recursion.
+    """
+
+    def __init__(self, left_right_pairs: list):
+        self.left_right_pairs = left_right_pairs
+        self.right_delimiters = {left: right for left, right in left_right_pairs}
+
+        # Lookup table from character to class; anything missing is part of a word
+        self.char_classes = {char: SPACE for char in WHITESPACE}
+        self.char_classes[","] = COMMA
+        for left, right in left_right_pairs:
+            self.char_classes[right] = CLOSE
+        for left, right in left_right_pairs:
+            self.char_classes[left] = OPEN
+
+        # Word patterns, keyed by which right delimiters currently close an open group
+        self.word_patterns = {}
+
+    def word_pattern(self, active_rights: tuple):
+        """Return the pattern for a word, which stops at the right delimiters of open groups."""
+        pattern = self.word_patterns.get(active_rights)
+        if pattern is None:
+            stop_chars = "," + "".join(left for left, _ in self.left_right_pairs) + "".join(active_rights)
+            pattern = re.compile(r"[^\s" + re.escape(stop_chars) + r"]+")
+            self.word_patterns[active_rights] = pattern
+        return pattern
+
+    def lex_line(self, line: str, offset: int = 0) -> list:
+        """Lex a single line into a list of Tokens and Groups, with spans starting at offset."""
+        char_classes = self.char_classes
+        nodes = []
+        children = nodes
+        open_groups = []
+        open_counts = {right: 0 for _, right in self.left_right_pairs}
+        word_pattern = self.word_pattern(())
+
+        i = 0
+        length = len(line)
+        while i < length:
+            char = line[i]
+            char_class = char_classes.get(char, WORD)
+
+            if char_class == SPACE:
+                i += 1
+
+            elif char_class == COMMA:
+                children.append(Token(",", offset + i, offset + i + 1))
+                i += 1
+
+            elif char_class == OPEN:
+                group = Group(char, self.right_delimiters[char], offset + i)
+                children.append(group)
+                open_groups.append(group)
+                open_counts[group.right] += 1
+                children = group.children
+                word_pattern = self.word_pattern(tuple(right for right, count in open_counts.items() if count))
+                i += 1
+
+            elif char_class == CLOSE and open_counts[char]:
+                # Close the innermost group with this delimiter, along with any groups inside it
+                while True:
+                    group = open_groups.pop()
+                    open_counts[group.right] -= 1
+                    if group.right == char:
+                        group.end = offset + i + 1
+                        group.closed = True
+                        break
+                    group.end = offset + i
+                children = open_groups[-1].children if open_groups else nodes
+                word_pattern = self.word_pattern(tuple(right for right, count in open_counts.items() if count))
+                i += 1
+
+            else:
+                # Accumulate characters until whitespace, a comma, or a delimiter
+                end = word_pattern.match(line, i).end()
+                children.append(Token(line[i:end], offset + i, offset + end))
+                i = end
+
+        # Groups left open end with the line
+        for group in open_groups:
+            group.end = offset + length
+
+        return nodes
+
+    def lex_statement(self, statement: str) -> list:
+        """Lex each line of a statement, with spans measured from the start of the statement."""
+        lines = []
+        offset = 0
+        for line in statement.splitlines(keepends=True):
+            lines.append(self.lex_line(line.rstrip("\r\n"), offset))
+            offset += len(line)
+        return lines
@@ -0,0 +1,59 @@
+# lru_cache.py
+
+from collections import OrderedDict
+
+class LRUCache:
+    """A bounded mapping that evicts the least recently used entry, with hit/miss/eviction counters."""
+
+    def __init__(self, capacity: int = 1024):
+        if capacity < 0:
+            raise ValueError(f"Cache capacity must be non-negative, got {capacity}.")
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, is_valid=None):
+        """
+        Return the value for key, or None on a miss.
+
+        If is_valid is given, a value for which it returns False is dropped and counted as a miss.
+        """
+        value = self.entries.get(key)
+        if value is None or (is_valid is not None and not is_valid(value)):
+            if value is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Insert or replace the value for key, evicting the least recently used entry if full."""
+        if self.capacity == 0:
+            return
+        if key in self.entries:
+            self.entries.move_to_end(key)
+        self.entries[key] = value
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Remove every entry, keeping the counters."""
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        """Return the size and counters of the cache."""
+        return {
+            "capacity": self.capacity,
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self.entries)
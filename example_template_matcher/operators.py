@@ -1,40 +1,69 @@
 # operators.py
 
+import functools
+import re
+
+# Registry of the operations templates can apply to stack statements, as {sN, name}
+OPERATORS = {}
+
+def register(operation):
+    """Register a function as an operator under its own name."""
+    OPERATORS[operation.__name__] = operation
+    return operation
+
+def get_operator(name):
+    """Return the registered operator with the given name."""
+    operation = OPERATORS.get(name)
+    if operation is None:
+        raise AttributeError(f"Operation '{name}' not found in operations module")
+    return operation
+
+@functools.lru_cache(maxsize=None)
+def swap_function(swaps):
+    """
+    Build a function that applies a tuple of (old, new) swaps in one scan.
+
+    Single-character swaps become a str.translate table; otherwise the olds are joined
+    into one alternation, tried in the order given.
+    """
+    if all(len(old) == 1 for old, _ in swaps):
+        table = str.maketrans({old: new for old, new in reversed(swaps)})
+        return lambda statement: statement.translate(table)
+
+    replacements = {}
+    for old, new in swaps:
+        replacements.setdefault(old, new)
+    pattern = re.compile("|".join(re.escape(old) for old in replacements))
+    return lambda statement: pattern.sub(lambda match: replacements[match.group()], statement)
+
 def multi_swap(statement, swaps):
     """Swaps multiple characters in a string."""
-    # Create unique temporary placeholders
-    temp_placeholders = [f"_TEMP_{i}_" for i in range(len(swaps))]
-    
-    # First pass: replace each item in swaps with a unique placeholder
-    for (old, _), temp in zip(swaps, temp_placeholders):
-        statement = statement.replace(old, temp)
-    
-    # Second pass: replace each placeholder with its final swap value
-    for (_, new), temp in zip(swaps, temp_placeholders):
-        statement = statement.replace(temp, new)
-    
-    return statement
+    return swap_function(tuple(map(tuple, swaps)))(statement)
+
+# Each inequality and its negation
+INEQUALITY_SWAPS = (("≤", ">"), (">", "≤"), ("≥", "<"), ("<", "≥"))
 
+@register
 def negate_inequality(statement: str) -> str:
     """
     Negates an inequality.
     """
-    swaps = [("≤", ">"), (">", "≤"), ("≥", "<"), ("<", "≥")]
+    return multi_swap(statement, INEQUALITY_SWAPS)
 
-    return multi_swap(statement, swaps)
+BRACE_PATTERN = re.compile(r"[{}]")
 
+@register
 def find_set(statement: str) -> str:
     """Finds and returns the first set expression enclosed in curly braces {}."""
-    stack = []
+    depth = 0
     start_index = -1
-    for i, char in enumerate(statement):
-        if char == '{':
-            if not stack:
-                start_index = i
-            stack.append(char)
-        elif char == '}':
-            if stack:
-                stack.pop()
-                if not stack and start_index != -1:
-                    return statement[start_index:i+1]
-    return ""
\ No newline at end of file
+    for match in BRACE_PATTERN.finditer(statement):
+        if match.group() == '{':
+            if not depth:
+                start_index = match.start()
+            depth += 1
+        elif depth:
+            depth -= 1
+            if not depth:
+                return statement[start_index:match.end()]
+    return ""
@@ -0,0 +1,84 @@
+# persistent_map.py
+
+# Bits of the hash consumed per level of the trie, and the hash width
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 64
+
+class PersistentMap:
+    """
+    An immutable hash map. set returns a new map that shares all but one path of the
+    trie with this one, so keeping every version of a map is cheap.
+
+    Each trie node is a dict from a slice of the key's hash to an entry: a (key, value,
+    hash) leaf, a child node, or, once the hash runs out, a list of colliding leaves.
+    """
+
+    __slots__ = ("root", "count")
+
+    def __init__(self, root=None, count: int = 0):
+        self.root = root
+        self.count = count
+
+    def get(self, key, default=None):
+        node = self.root
+        key_hash = hash(key) & ((1 << HASH_BITS) - 1)
+        shift = 0
+        while node is not None:
+            entry = node.get((key_hash >> shift) & MASK)
+            if entry is None:
+                return default
+            if entry.__class__ is tuple:
+                return entry[1] if entry[0] == key else default
+            if entry.__class__ is list:
+                for leaf in entry:
+                    if leaf[0] == key:
+                        return leaf[1]
+                return default
+            node = entry
+            shift += BITS
+        return default
+
+    def set(self, key, value) -> "PersistentMap":
+        """Return a map with key set to value."""
+        key_hash = hash(key) & ((1 << HASH_BITS) - 1)
+        root, added = set_in_node(self.root, (key, value, key_hash), 0)
+        return PersistentMap(root, self.count + added)
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self):
+        return self.count
+
+def set_in_node(node, leaf, shift):
+    """Return a copy of node with leaf set, and whether its key is new."""
+    node = dict(node) if node is not None else {}
+    index = (leaf[2] >> shift) & MASK
+    entry = node.get(index)
+
+    if entry is None:
+        node[index] = leaf
+        return node, True
+
+    if entry.__class__ is tuple:
+        if entry[0] == leaf[0]:
+            node[index] = leaf
+            return node, False
+        if shift + BITS >= HASH_BITS and entry[2] == leaf[2]:
+            # Same full hash, so the two can only live side by side
+            node[index] = [entry, leaf]
+            return node, True
+        # Push the existing leaf down a level and set the new one next to it
+        child, _ = set_in_node(None, entry, shift + BITS)
+        node[index], added = set_in_node(child, leaf, shift + BITS)
+        return node, added
+
+    if entry.__class__ is list:
+        leaves = [existing for existing in entry if existing[0] != leaf[0]]
+        node[index] = leaves + [leaf]
+        return node, len(leaves) == len(entry)
+
+    node[index], added = set_in_node(entry, leaf, shift + BITS)
+    return node, added
@@ -0,0 +1,249 @@
+# pipeline.py
+
+import json
+from contextlib import nullcontext
+from declaration_index import DeclarationIndex
+from dependency_graph import ParallelTranslator
+from error_log import ErrorLog, fallback_translation
+from file_cleaner import iter_clean_lines, iter_statements, replace_intro_variable_in_statement, clean_statement
+from instrumentation import Instrumentation
+from statement_stack import PersistentStatementStack
+from statement_translator import SUB_EXPRESSION_CACHE_SIZE, StatementTranslator, TranslatorConfig
+from template_store import load_template_store
+from text_compiler import compile_output
+from translation_cache import TranslationCache
+
+def load_template_dict(templates_path: str) -> dict:
+    """Load templates.json and index the templates by expression."""
+    with open(templates_path, 'r', encoding='utf-8') as file:
+        templates = json.load(file)
+    return {template["expression"]: template for template in templates}
+
+def load_templates(templates_path: str, store_path: str = None):
+    """Load the templates as a dictionary, or as a memory-mapped TemplateStore if store_path is given."""
+    if store_path:
+        return load_template_store(templates_path, store_path)
+    return load_template_dict(templates_path)
+
+def make_translator(template_dict, instrumentation: Instrumentation = None, resilient: bool = False,
+                    declaration_index: DeclarationIndex = None,
+                    cache_size: int = SUB_EXPRESSION_CACHE_SIZE) -> StatementTranslator:
+    """
+    Create a StatementTranslator for a dictionary of templates, a compiled matcher (a
+    TemplateStore or TemplateTrie) or a TranslatorConfig. Resilient runs snapshot the
+    stack before every declaration, which the persistent stack does in constant time.
+    cache_size bounds the translator's sub-expression cache; 0 turns it off.
+    """
+    statement_stack = PersistentStatementStack() if resilient else None
+    statement_translator = StatementTranslator(
+        None, cache_size=cache_size, instrumentation=instrumentation, statement_stack=statement_stack,
+        config=TranslatorConfig.for_templates(template_dict),
+    )
+    statement_translator.statement_stack.declaration_index = declaration_index
+    return statement_translator
+
+# Configuration of the cleaning and extraction steps
+WORDS_TO_REMOVE = ["import", "open", "namespace", "end", "section"]
+STATEMENT_KEYWORDS = ["theorem", "lemma", "definition"]
+
+def iter_translations(lines, template_dict: dict, translation_cache: TranslationCache = None,
+                      instrumentation: Instrumentation = None, statement_translator: StatementTranslator = None,
+                      error_log: ErrorLog = None, words_to_remove: list = WORDS_TO_REMOVE,
+                      statement_keywords: list = STATEMENT_KEYWORDS):
+    """
+    Translate an iterable of Lean lines one statement at a time.
+
+    Yields (statement, cleaned_statement, latex) for each statement, so memory is
+    bounded by the largest single declaration rather than the whole file. With a
+    translation_cache, unchanged statements reuse their earlier translations. With an
+    instrumentation, each step is timed and the translator's counters are recorded.
+    template_dict may also be a TemplateStore. A fresh StatementTranslator is created
+    unless statement_translator is given, in which case template_dict is not used.
+
+    With an error_log the run is resilient: a declaration that fails to translate is
+    recorded there, its changes to the stack are rolled back, and a marked fallback is
+    yielded in its place, instead of the error ending the run.
+    """
+    # Steps 1-2: Remove unneeded text and clean up syntax
+    cleaned_lines = iter_clean_lines(lines, words_to_remove)
+    if instrumentation is not None:
+        cleaned_lines = instrumentation.timed_iter("clean", cleaned_lines)
+
+    # Step 3: Extract statements
+    statements = iter_statements(cleaned_lines, statement_keywords)
+    if instrumentation is not None:
+        statements = instrumentation.timed_iter("extract_statements", statements)
+
+    stage = instrumentation.stage if instrumentation is not None else nullcontext
+    timed_statement = instrumentation.statement if instrumentation is not None else nullcontext
+
+    if statement_translator is None:
+        statement_translator = make_translator(template_dict, instrumentation, error_log is not None)
+    stack = statement_translator.statement_stack
+
+    for index, statement in enumerate(statements):
+        snapshot = stack.snapshot() if error_log is not None else None
+        try:
+            with timed_statement(statement):
+                # Step 4: Translate the statement
+                with stage("translate"):
+                    if translation_cache:
+                        translated_statement = translation_cache.translate(statement_translator, statement)
+                    else:
+                        translated_statement = statement_translator(statement)
+
+                # Step 5: Fix intro statements
+                with stage("replace_intro_variable"):
+                    translated_statement = replace_intro_variable_in_statement(translated_statement)
+
+                # Step 6: Clean up the output
+                with stage("clean_output"):
+                    cleaned_statement = clean_statement(translated_statement)
+
+                # Step 7: Compile the output into LaTeX
+                with stage("compile_output"):
+                    latex = compile_output([cleaned_statement])
+        except Exception as e:
+            if error_log is None:
+                raise
+            # Undo whatever the declaration did to the stack, so later ones see the state before it
+            stack.restore(snapshot)
+            error_log.record(index, statement, e)
+            if instrumentation is not None:
+                instrumentation.count("failed_declarations")
+            cleaned_statement, latex = fallback_translation(statement, e)
+
+        yield statement, cleaned_statement, latex
+
+
+class StatementResult:
+    """The translation of one declaration, and the failure it replaces in a resilient run."""
+
+    __slots__ = ("statement", "translation", "latex", "error")
+
+    def __init__(self, statement: str, translation: str, latex: str, error: dict = None):
+        self.statement = statement
+        self.translation = translation
+        self.latex = latex
+        self.error = error  # The ErrorLog record, if the declaration failed
+
+    def to_dict(self) -> dict:
+        result = {"statement": self.statement, "translation": self.translation, "latex": self.latex}
+        if self.error is not None:
+            result["error"] = self.error
+        return result
+
+
+class TranslationResult:
+    """The translations of the declarations of one text, in order."""
+
+    def __init__(self, statements: list):
+        self.statements = statements
+
+    @property
+    def latex(self) -> str:
+        """The LaTeX of the whole text, as compile_output would give for all its declarations."""
+        return "\n".join(result.latex for result in self.statements if result.latex)
+
+    @property
+    def errors(self) -> list:
+        return [result.error for result in self.statements if result.error is not None]
+
+    def to_dict(self) -> dict:
+        return {"statements": [result.to_dict() for result in self.statements], "latex": self.latex}
+
+
+def print_result(result: StatementResult):
+    """A sink that prints a declaration and its translation, as translate_file.py does."""
+    print("\n")
+    print(result.statement)
+    print("\n")
+    print(result.translation)
+
+
+class Pipeline:
+    """
+    The translation steps, configured once and reused for any number of texts.
+
+    The templates are compiled into a TranslatorConfig when the pipeline is created, and
+    every text gets a fresh StatementTranslator (and stack) sharing it. Results are
+    returned rather than printed; each sink, a callable taking a StatementResult, is
+    called as each declaration is done, which is how translate_file.py prints and writes
+    files. template_dict may also be a TemplateStore, a TemplateTrie or a TranslatorConfig,
+    though parallel declarations need a dictionary or a TemplateStore to hand to their
+    workers, and they keep their worker pool until close. Parallel declarations cannot
+    be combined with a translation cache or instrumentation, which only the sequential
+    translator uses. With a declaration_index, obtain and exact can refer to declarations
+    of other files. cache_size bounds each translator's sub-expression cache. A pipeline
+    without a translation cache, instrumentation, error log, sinks or parallel
+    declarations keeps no state between texts, so threads can call translate at once.
+    """
+
+    def __init__(self, template_dict, words_to_remove: list = WORDS_TO_REMOVE,
+                 statement_keywords: list = STATEMENT_KEYWORDS, translation_cache: TranslationCache = None,
+                 instrumentation: Instrumentation = None, error_log: ErrorLog = None,
+                 parallel_declarations: bool = False, max_workers: int = None, sinks=(),
+                 declaration_index: DeclarationIndex = None, cache_size: int = SUB_EXPRESSION_CACHE_SIZE):
+        if parallel_declarations and (translation_cache is not None or instrumentation is not None):
+            raise ValueError("Parallel declarations cannot use a translation cache or instrumentation.")
+        self.translator_config = TranslatorConfig.for_templates(template_dict)
+        self.words_to_remove = tuple(words_to_remove)
+        self.statement_keywords = tuple(statement_keywords)
+        self.translation_cache = translation_cache
+        self.instrumentation = instrumentation
+        self.error_log = error_log
+        self.parallel_declarations = parallel_declarations
+        self.max_workers = max_workers
+        self.sinks = list(sinks)
+        self.declaration_index = declaration_index
+        self.cache_size = cache_size
+        self.parallel_translator = None  # Created on first use, and kept for its worker pool
+
+    @classmethod
+    def from_files(cls, templates_path: str, store_path: str = None, **options) -> "Pipeline":
+        """Create a pipeline for templates.json, or for its TemplateStore if store_path is given."""
+        return cls(load_templates(templates_path, store_path), **options)
+
+    def iter_results(self, lines):
+        """Translate an iterable of Lean lines, yielding a StatementResult for each declaration as it is done."""
+        if self.parallel_declarations:
+            statements = iter_statements(iter_clean_lines(lines, self.words_to_remove), self.statement_keywords)
+            if self.parallel_translator is None:
+                self.parallel_translator = ParallelTranslator(
+                    self.translator_config, self.max_workers, self.error_log, self.declaration_index, self.cache_size
+                )
+            translations = self.parallel_translator.translate(statements)
+        else:
+            statement_translator = make_translator(
+                self.translator_config, self.instrumentation, self.error_log is not None, self.declaration_index,
+                self.cache_size,
+            )
+            translations = iter_translations(
+                lines, None, self.translation_cache, self.instrumentation, statement_translator,
+                self.error_log, self.words_to_remove, self.statement_keywords,
+            )
+
+        num_errors = len(self.error_log) if self.error_log is not None else 0
+        for statement, translation, latex in translations:
+            error = None
+            if self.error_log is not None and len(self.error_log) > num_errors:
+                num_errors = len(self.error_log)
+                error = self.error_log.records[-1]
+            result = StatementResult(statement, translation, latex, error)
+            for sink in self.sinks:
+                sink(result)
+            yield result
+
+    def translate(self, text: str) -> TranslationResult:
+        """Translate the Lean source in text."""
+        return TranslationResult(list(self.iter_results(text.splitlines())))
+
+    def translate_many(self, texts):
+        """Translate each text of an iterable on its own, yielding a TranslationResult for each."""
+        for text in texts:
+            yield self.translate(text)
+
+    def close(self):
+        """Shut down the worker pool of parallel declarations, if one was started."""
+        if self.parallel_translator is not None:
+            self.parallel_translator.close()
@@ -1,28 +1,118 @@
+import copy
+from persistent_map import PersistentMap
+
+class StackItem:
+    """A compact record for a statement on the stack."""
+
+    __slots__ = ("spaces", "tag", "name", "statement", "assumes", "exists", "exists_tags")
+
+    def __init__(self, spaces, tag, name, statement, assumes=None, exists=None, exists_tags=None):
+        self.spaces = spaces
+        self.tag = tag
+        self.name = name
+        self.statement = statement
+        self.assumes = assumes
+        self.exists = exists
+        self.exists_tags = exists_tags
+
+    def fingerprint(self):
+        """Return a hashable snapshot of the item's fields."""
+        return tuple(
+            tuple(value) if isinstance(value, list) else value
+            for value in (getattr(self, attr) for attr in self.__slots__)
+        )
+
+    def fields(self):
+        """Return the fields that are set, in declaration order."""
+        return {attr: getattr(self, attr) for attr in self.__slots__ if getattr(self, attr) is not None}
+
+    def __repr__(self):
+        return f"StackItem({', '.join(f'{attr}={value!r}' for attr, value in self.fields().items())})"
+
+
+def fingerprint(value):
+    """Return a hashable, comparable form of a lookup result."""
+    if isinstance(value, StackItem):
+        return value.fingerprint()
+    return value
+
+
 class StatementStack:
-    """A simple stack implementation using a Python list."""
+    """
+    A stack of statements, indexed by name and grouped into scope frames.
+
+    Each frame is a run of items with the same indentation, so pruning pops only the
+    frames it closes, and name lookups go through a name -> items index.
+    """
 
     def __init__(self):
         """Initialize an empty stack."""
         self.items = []
+        self.name_index = {}  # name -> items with that name, bottom to top
+        self.frames = []  # [spaces, index of the frame's first item], bottom to top
+        self.ordered = True  # Whether the frames' spacing increases from bottom to top
+        self.version = 0  # Incremented on every change to the stack
+        self.read_log = None  # When a list, lookups append (method, args, fingerprint of the result)
+        self.dependencies = None  # When set, a StackDependencies recording what a translation relies on
+        self.instrumentation = None  # When set, an Instrumentation counting lookups and the peak depth
+        self.declaration_index = None  # When set, a DeclarationIndex consulted when get_by_name finds nothing
+
+    def snapshot(self):
+        """
+        Return a copy of the current state of the stack, for restore.
+
+        This copies every item; PersistentStatementStack does it in constant time.
+        """
+        return [copy.copy(item) for item in self.items]
+
+    def restore(self, snapshot):
+        """Return the stack to a state returned by snapshot."""
+        self.rebuild([copy.copy(item) for item in snapshot])
 
     def add_to_stack(self, item):
         """
         Add an item to the top of the stack.
 
-        item = [depth, tag, name, value]
+        item = StackItem(spaces, tag, name, statement, ...)
         """
         self.items.append(item)
+        self.name_index.setdefault(item.name, []).append(item)
+        self.version += 1
+        if self.dependencies is not None:
+            self.dependencies.own_ids.add(id(item))
+        if self.instrumentation is not None:
+            self.instrumentation.maximum("stack_peak_depth", len(self.items))
+
+        if not self.frames or self.frames[-1][0] != item.spaces:
+            if self.frames and self.frames[-1][0] > item.spaces:
+                # An item indented less than the one below it, so frames no longer nest
+                self.ordered = False
+            self.frames.append([item.spaces, len(self.items) - 1])
 
     def prune_stack(self, spaces):
         """
         Remove items from the stack with a greater number of spaces than the provided value.
         """
-        self.items = [existing_item for existing_item in self.items if existing_item['spaces'] <= spaces]
+        if not self.ordered:
+            kept_items = [existing_item for existing_item in self.items if existing_item.spaces <= spaces]
+            if len(kept_items) != len(self.items):
+                self.rebuild(kept_items)
+            return
+
+        # Pop the frames that the new indentation closes
+        start = len(self.items)
+        while self.frames and self.frames[-1][0] > spaces:
+            start = self.frames.pop()[1]
+        self.truncate(start)
 
     def remove_from_stack(self):
         """Remove and return the top item from the stack."""
         if not self.is_empty():
-            return self.items.pop()
+            item = self.items[-1]
+            self.truncate(len(self.items) - 1)
+            if self.frames and self.frames[-1][1] == len(self.items):
+                self.frames.pop()
+            return item
         else:
             raise IndexError("remove_from_stack(): pop from empty stack")
 
@@ -36,57 +126,414 @@ class StatementStack:
             return self.items[-1]
         else:
             raise IndexError("peek(): stack is empty")
-        
+
     def peek_n(self, n):
         """Return the nth item from the top of the stack (s1 is top)."""
-        if n <= len(self.items) and n > 0:
-            return self.items[-n]['statement']
+        if n <= self.size() and n > 0:
+            statement = self.item_at(n).statement
+            if self.instrumentation is not None:
+                self.instrumentation.count("stack_lookups.peek_n")
+            if self.dependencies is not None:
+                self.dependencies.position_access(self, n)
+            if self.read_log is not None:
+                self.read_log.append(("peek_n", (n,), statement))
+            return statement
         else:
-            raise IndexError(f"Cannot peek s{n}: stack has only {len(self.items)} items.")
+            raise IndexError(f"Cannot peek s{n}: stack has only {self.size()} items.")
 
     def size(self):
         """Get the number of items in the stack."""
         return len(self.items)
-    
+
+    def item_at(self, n):
+        """Return the nth item from the top without logging the read."""
+        return self.items[-n]
+
+    def items_from(self, start):
+        """Return the items from index start upwards, bottom to top."""
+        return self.items[start:]
+
+    def items_named(self, name):
+        """Return the items with the specified name, bottom to top, without logging the read."""
+        return self.name_index.get(name, ())
+
     def get_by_name(self, name):
-        """Returns the underlying dictionary of the item with the specified name."""
-        for item in self.items:
-            if item['name'] == name:
-               return item
-        return None # Return None if not found
-    
+        """Returns the first item with the specified name."""
+        named_items = self.items_named(name)
+        item = named_items[0] if named_items else None # None if not found
+        if self.instrumentation is not None:
+            self.instrumentation.count("stack_lookups.get_by_name")
+        if self.dependencies is not None:
+            self.dependencies.name_access(self, name)
+        if item is None:
+            # Fall back on declarations from other files
+            if self.declaration_index is not None:
+                item = self.declaration_index.lookup(name)
+            if self.dependencies is not None:
+                self.dependencies.index_access(name, item)
+        if self.read_log is not None:
+            self.read_log.append(("get_by_name", (name,), fingerprint(item)))
+        return item
+
     def get_statement_by_name(self, name, ignore_defs=False):
         """Return the statement of the item with the specified name."""
-        for item in self.items:
-            if item['name'] == name:
-                if not ignore_defs or item['tag'] not in ["let", "def"]:
-                    return item['statement']
-        return None # Return None if not found
-    
+        statement = None # None if not found
+        if self.instrumentation is not None:
+            self.instrumentation.count("stack_lookups.get_statement_by_name")
+        if self.dependencies is not None:
+            self.dependencies.name_access(self, name)
+        for item in self.items_named(name):
+            if not ignore_defs or item.tag not in ("let", "def"):
+                statement = item.statement
+                break
+        if self.read_log is not None:
+            self.read_log.append(("get_statement_by_name", (name, ignore_defs), statement))
+        return statement
+
     def get_prev_name_by_spacing(self, spaces):
         """Return the name of the previous item with the specified number of spaces, or None if no match."""
-        for item in reversed(self.items):
-            if item['spaces'] == spaces:
-                return item['name']
+        name = self.find_prev_name_by_spacing(spaces)
+        if self.instrumentation is not None:
+            self.instrumentation.count("stack_lookups.get_prev_name_by_spacing")
+        if self.dependencies is not None:
+            self.dependencies.spacing_access(self, spaces, name)
+        if self.read_log is not None:
+            self.read_log.append(("get_prev_name_by_spacing", (spaces,), name))
+        return name
+
+    def find_prev_name_by_spacing(self, spaces):
+        """Look up get_prev_name_by_spacing without logging the read."""
+        if not self.ordered:
+            for item in reversed(self.items):
+                if item.spaces == spaces:
+                    return item.name
+            return None
+
+        # Each frame holds one spacing, so the match is the top item of the frame with that spacing
+        end = len(self.items)
+        for frame_spaces, start in reversed(self.frames):
+            if frame_spaces == spaces:
+                return self.items[end - 1].name
+            if frame_spaces < spaces:
+                break
+            end = start
         return None # Return None if not found
-    
+
     def edit_item_by_name(self, name: str, **kwargs: dict[str, any]) -> bool:
         """Edit the properties of an item in the stack with the specified name."""
-        for item in self.items:
-            if item['name'] == name:
-                for key, value in kwargs.items():
-                    item[key] = value
-                return True  # Indicate success
-        return False  # Indicate failure if item with the specified name is not found
+        if self.dependencies is not None:
+            self.dependencies.name_access(self, name)
+        named_items = self.name_index.get(name)
+        if not named_items:
+            return False  # Indicate failure if item with the specified name is not found
+
+        item = named_items[0]
+        if self.dependencies is not None:
+            self.dependencies.edited(item, kwargs)
+        for key, value in kwargs.items():
+            setattr(item, key, value)
+        self.version += 1
+        if "name" in kwargs or "spaces" in kwargs:
+            self.rebuild(self.items)
+        return True  # Indicate success
+
+    def replay_reads(self, reads) -> bool:
+        """Check whether a sequence of logged lookups gives the same results on the stack now."""
+        read_log, self.read_log = self.read_log, None
+        try:
+            for method, args, result in reads:
+                try:
+                    value = getattr(self, method)(*args)
+                except IndexError:
+                    return False
+                if fingerprint(value) != result:
+                    return False
+            return True
+        finally:
+            self.read_log = read_log
+
+    def truncate(self, start):
+        """Remove the items from index start upwards, keeping the name index in sync."""
+        if start < len(self.items):
+            self.version += 1
+        for item in reversed(self.items[start:]):
+            named_items = self.name_index[item.name]
+            named_items.pop()
+            if not named_items:
+                del self.name_index[item.name]
+        del self.items[start:]
+
+    def rebuild(self, items):
+        """Rebuild the name index and frames for a new list of items."""
+        self.items = []
+        self.name_index = {}
+        self.frames = []
+        self.ordered = True
+        for item in items:
+            self.add_to_stack(item)
 
     def __str__(self):
         """Return a formatted string representation of the stack."""
-        max_attr_length = max(len(attr) for item in self.items for attr in item)
+        item_fields = [item.fields() for item in self.items]
+        max_attr_length = max(len(attr) for fields in item_fields for attr in fields)
 
         formatted_items = "\n".join(
             f"  Item {i + 1}:\n" +
-            "\n".join(f"    {attr.capitalize():<{max_attr_length}}: {value}" for attr, value in item.items())
-            for i, item in enumerate(self.items[::-1])
+            "\n".join(f"    {attr.capitalize():<{max_attr_length}}: {value}" for attr, value in fields.items())
+            for i, fields in enumerate(item_fields[::-1])
         )
-         
+
         return f"Stack (top -> bottom):\n{formatted_items}"
+
+
+class StackNode:
+    """One item of a PersistentStatementStack, with what lookups need about the items up to it."""
+
+    __slots__ = ("item", "below", "size", "names", "frame_below", "ordered")
+
+    def __init__(self, item, below):
+        self.item = item
+        self.below = below
+        if below is None:
+            self.size = 1
+            names = PersistentMap()
+            self.frame_below = None  # The top node of the frames below this item's frame
+            self.ordered = True
+        else:
+            self.size = below.size + 1
+            names = below.names
+            self.frame_below = below.frame_below if below.item.spaces == item.spaces else below
+            self.ordered = below.ordered and below.item.spaces <= item.spaces
+        # name -> items with that name, bottom to top
+        self.names = names.set(item.name, names.get(item.name, ()) + (item,))
+
+
+class PersistentStatementStack(StatementStack):
+    """
+    A StatementStack whose states are immutable and share structure, so snapshot and
+    restore take constant time.
+
+    The stack is a linked list of nodes, each carrying the name index of the items up to
+    it as a PersistentMap. Popping moves to a lower node, and editing an item copies it
+    and re-links the nodes above it, so no snapshot ever changes. Lookups by position
+    walk the list, which is cheap for the shallow references templates make.
+    """
+
+    def __init__(self):
+        """Initialize an empty stack."""
+        self.top = None
+        self.version = 0
+        self.read_log = None
+        self.dependencies = None
+        self.instrumentation = None
+        self.declaration_index = None
+
+    def snapshot(self):
+        """Return the current state of the stack, for restore."""
+        return self.top
+
+    def restore(self, snapshot):
+        """Return the stack to a state returned by snapshot."""
+        if snapshot is not self.top:
+            self.top = snapshot
+            self.version += 1
+
+    @property
+    def items(self):
+        """The items, bottom to top."""
+        return self.items_from(0)
+
+    def add_to_stack(self, item):
+        """
+        Add an item to the top of the stack.
+
+        item = StackItem(spaces, tag, name, statement, ...)
+        """
+        self.top = StackNode(item, self.top)
+        self.version += 1
+        if self.dependencies is not None:
+            self.dependencies.own_ids.add(id(item))
+        if self.instrumentation is not None:
+            self.instrumentation.maximum("stack_peak_depth", self.top.size)
+
+    def prune_stack(self, spaces):
+        """
+        Remove items from the stack with a greater number of spaces than the provided value.
+        """
+        if self.top is not None and not self.top.ordered:
+            kept_items = [existing_item for existing_item in self.items if existing_item.spaces <= spaces]
+            if len(kept_items) != self.size():
+                self.rebuild(kept_items)
+            return
+
+        # Pop the frames that the new indentation closes
+        node = self.top
+        while node is not None and node.item.spaces > spaces:
+            node = node.frame_below
+        self.restore(node)
+
+    def remove_from_stack(self):
+        """Remove and return the top item from the stack."""
+        if not self.is_empty():
+            item = self.top.item
+            self.restore(self.top.below)
+            return item
+        else:
+            raise IndexError("remove_from_stack(): pop from empty stack")
+
+    def is_empty(self):
+        """Check if the stack is empty."""
+        return self.top is None
+
+    def peek(self):
+        """Return the top item of the stack without removing it."""
+        if not self.is_empty():
+            return self.top.item
+        else:
+            raise IndexError("peek(): stack is empty")
+
+    def size(self):
+        """Get the number of items in the stack."""
+        return self.top.size if self.top is not None else 0
+
+    def item_at(self, n):
+        """Return the nth item from the top without logging the read."""
+        node = self.top
+        for _ in range(n - 1):
+            node = node.below
+        return node.item
+
+    def items_from(self, start):
+        """Return the items from index start upwards, bottom to top."""
+        items = []
+        node = self.top
+        while node is not None and node.size > start:
+            items.append(node.item)
+            node = node.below
+        items.reverse()
+        return items
+
+    def items_named(self, name):
+        """Return the items with the specified name, bottom to top, without logging the read."""
+        return self.top.names.get(name, ()) if self.top is not None else ()
+
+    def find_prev_name_by_spacing(self, spaces):
+        """Look up get_prev_name_by_spacing without logging the read."""
+        node = self.top
+        if node is not None and not node.ordered:
+            while node is not None:
+                if node.item.spaces == spaces:
+                    return node.item.name
+                node = node.below
+            return None
+
+        # Each frame holds one spacing, so the match is the top item of the frame with that spacing
+        while node is not None:
+            if node.item.spaces == spaces:
+                return node.item.name
+            if node.item.spaces < spaces:
+                break
+            node = node.frame_below
+        return None # Return None if not found
+
+    def edit_item_by_name(self, name: str, **kwargs: dict[str, any]) -> bool:
+        """Edit the properties of an item in the stack with the specified name."""
+        if self.dependencies is not None:
+            self.dependencies.name_access(self, name)
+        named_items = self.items_named(name)
+        if not named_items:
+            return False  # Indicate failure if item with the specified name is not found
+
+        # Copy the item rather than change it, since snapshots may share it
+        item = named_items[0]
+        edited_item = copy.copy(item)
+        for key, value in kwargs.items():
+            setattr(edited_item, key, value)
+        if self.dependencies is not None:
+            self.dependencies.edited(item, kwargs, edited_item)
+
+        # Re-link the nodes from the edited item up
+        items_above = []
+        node = self.top
+        while node.item is not item:
+            items_above.append(node.item)
+            node = node.below
+        node = StackNode(edited_item, node.below)
+        for above_item in reversed(items_above):
+            node = StackNode(above_item, node)
+        self.restore(node)
+        return True  # Indicate success
+
+    def rebuild(self, items):
+        """Rebuild the stack from a list of items."""
+        node = None
+        for item in items:
+            node = StackNode(item, node)
+        self.top = node
+        self.version += 1
+
+
+class StackDependencies:
+    """
+    Records what a translation relies on from the items that were on the stack when it
+    started (its base), and the edits it makes to them.
+
+    Lookups that land on items the translation added itself need no record, since those
+    items follow from the statement and the earlier lookups. So if every recorded lookup
+    gives the same result on another base, translating the statement there does the same.
+    """
+
+    def __init__(self, stack):
+        self.base_size = stack.size()
+        self.own_ids = set()  # ids of the items added during the translation
+        self.lookups = {}  # (kind, argument) -> result from the base
+        self.edits = []  # (name, changes) made to base items, in order
+
+    def name_access(self, stack, name):
+        """Record the base items with a name, the first time the name is looked up."""
+        key = ("name", name)
+        if key not in self.lookups:
+            self.lookups[key] = tuple(
+                item.fingerprint() for item in stack.items_named(name) if id(item) not in self.own_ids
+            )
+
+    def index_access(self, name, item):
+        """Record what the declaration index gave for a name that is not on the stack."""
+        self.lookups.setdefault(("index", name), fingerprint(item))
+
+    def position_access(self, stack, n):
+        """Record the base item that peek_n(n) reaches, if it is below the added items."""
+        base_n = n - (stack.size() - self.base_size)
+        key = ("position", base_n)
+        if base_n > 0 and key not in self.lookups:
+            self.lookups[key] = stack.item_at(n).statement
+
+    def spacing_access(self, stack, spaces, name):
+        """Record a get_prev_name_by_spacing lookup that no added item answered."""
+        for item in reversed(stack.items_from(self.base_size)):
+            if item.spaces == spaces:
+                return
+        self.lookups.setdefault(("spacing", spaces), name)
+
+    def edited(self, item, changes, edited_item=None):
+        """Record an edit, if it changes a base item. An edited copy of an added item is added too."""
+        if id(item) not in self.own_ids:
+            self.edits.append((item.name, dict(changes)))
+        elif edited_item is not None:
+            self.own_ids.add(id(edited_item))
+
+    def added_items(self, stack):
+        """Return the added items that are still on the stack."""
+        return stack.items_from(self.base_size)
+
+    @staticmethod
+    def lookup(stack, kind, argument):
+        """Look up a recorded (kind, argument) on a stack that has only base items."""
+        if kind == "name":
+            return tuple(item.fingerprint() for item in stack.items_named(argument))
+        if kind == "position":
+            return stack.item_at(argument).statement if 0 < argument <= stack.size() else None
+        if kind == "index":
+            index = stack.declaration_index
+            return fingerprint(index.lookup(argument) if index is not None else None)
+        return stack.find_prev_name_by_spacing(argument)
@@ -1,20 +1,84 @@
 # statement_translator.py
 
-from copy import deepcopy as dc
 import re
-import operators
-from statement_stack import StatementStack
+from statement_stack import StatementStack, StackItem
+from template_trie import TemplateTrie
+from compiled_template import compile_templates, parse_stack_reference, STACK_REFERENCE_PATTERN
+from lexer import Lexer, Token
+from lru_cache import LRUCache
+
+# Anonymous functions, fun h =>
+FUN_PATTERN = re.compile(r"\bfun\s+(\w+)\s*=>")
+
+# Default capacity of each translator's cache of sub-expression translations
+SUB_EXPRESSION_CACHE_SIZE = 1024
 
 ######################
 ## CALLED FUNCTIONS ##
 ######################
 
-class StatementTranslator:
+class TranslatorConfig:
+    """
+    The read-only part of a StatementTranslator: the templates, compiled into a matcher,
+    and the lexer for the delimiter pairs.
+
+    Nothing in it changes once it is built, beyond the lexer memoizing patterns that come
+    out the same whichever thread adds them. So one config can be shared by any number
+    of translators, each with its own stack and caches, in any number of threads.
+    Creating a translator from a config compiles nothing.
+    """
 
-    def __init__(self, template_dict: dict):
+    LEFT_RIGHT_PAIRS = (("(", ")"), ("{", "}"))
+
+    def __init__(self, template_dict: dict, template_trie=None, left_right_pairs: tuple = LEFT_RIGHT_PAIRS):
         self.template_dict = template_dict
-        self.statement_stack = StatementStack()
-        self.left_right_pairs = [("(", ")"), ("{", "}")]
+
+        # Anything with TemplateTrie's match method, such as a TemplateStore, can stand in for the trie
+        if template_trie is None:
+            template_trie = TemplateTrie(compile_templates(template_dict))
+        self.template_trie = template_trie
+        self.left_right_pairs = tuple(left_right_pairs)
+        self.lexer = Lexer(self.left_right_pairs)
+
+    @classmethod
+    def for_templates(cls, templates) -> "TranslatorConfig":
+        """Return the config for a dictionary of templates, a compiled matcher, or a config."""
+        if isinstance(templates, cls):
+            return templates
+        if isinstance(templates, dict):
+            return cls(templates)
+        return cls(None, template_trie=templates)
+
+
+class StatementTranslator:
+    """
+    Translates the statements of one file, in order, keeping their state on its stack.
+
+    A translator is for one caller at a time. Threads translating at once each use their
+    own translator, created with the same config so the templates are compiled once.
+    """
+
+    def __init__(self, template_dict: dict, cache_size: int = SUB_EXPRESSION_CACHE_SIZE, instrumentation=None, template_trie=None,
+                 statement_stack=None, config: TranslatorConfig = None):
+        # The shared, read-only part
+        if config is None:
+            config = TranslatorConfig(template_dict, template_trie)
+        self.config = config
+        self.template_dict = config.template_dict
+        self.template_trie = config.template_trie
+        self.left_right_pairs = config.left_right_pairs
+        self.lexer = config.lexer
+
+        # The state of this translator's calls
+        # Any StatementStack, such as a PersistentStatementStack that can snapshot and restore
+        self.statement_stack = statement_stack if statement_stack is not None else StatementStack()
+
+        # Translations of sub-expressions that only read the stack, keyed by their source text
+        self.sub_expression_cache = LRUCache(cache_size) if cache_size else None
+
+        # Optional Instrumentation, shared with the stack
+        self.instrumentation = instrumentation
+        self.statement_stack.instrumentation = instrumentation
 
     def __call__(self, statement: str):
         # Keep track of how many spaces each line leads with
@@ -27,14 +91,11 @@ class StatementTranslator:
         tokenized_statement = self.tokenize_statement(statement)
         
         # Next apply template matching to each line
-        output = ""
-        for i in range(len(tokenized_statement)):
-            # Extract line, next line, amount of white space
-            line = tokenized_statement[i]
-            if i < len(tokenized_statement) - 1:
-                next_line = tokenized_statement[i+1]
-            else:
-                next_line = None
+        output = []
+        last = len(tokenized_statement) - 1
+        for i, line in enumerate(tokenized_statement):
+            # Extract next line, amount of white space
+            next_line = tokenized_statement[i+1] if i < last else None
             spaces = leading_spaces[i]
             
             # Translate
@@ -42,11 +103,12 @@ class StatementTranslator:
 
             # Make sure to include white space when printing
             if translated_line:
-                output += " " * leading_spaces[i] + translated_line
-                if i < len(tokenized_statement) - 1:
-                    output += "\n"
+                output.append(" " * spaces)
+                output.append(translated_line)
+                if i < last:
+                    output.append("\n")
 
-        return output
+        return "".join(output)
 
 
     ##################
@@ -55,80 +117,119 @@ class StatementTranslator:
 
     def tokenize_line(self, line: str) -> list:
         """Tokenize a single line, treating sub-expressions and commas as single tokens."""
-
-        tokens = []
-        i = 0
-        while i < len(line):
-            # Skip leading whitespace
-            if line[i].isspace():
-                i += 1
-                continue
-
-            # Check if the character is a comma
-            if line[i] == ",":
-                tokens.append(",")  # Add comma as a separate token
-                i += 1
-                continue
-
-            # Check if the character matches any of the left delimiters
-            match = None
-            for left, right in self.left_right_pairs:
-                if line[i] == left:
-                    match = (left, right)
-                    break
-
-            if match:
-                # Find the closing delimiter for the sub-expression
-                left, right = match
-                start_index = i
-                depth = 1
-                i += 1  # Move past the opening delimiter
-
-                while i < len(line) and depth > 0:
-                    if line[i] == left:
-                        depth += 1  # Nested opening
-                    elif line[i] == right:
-                        depth -= 1  # Closing
-
-                    i += 1
-
-                # Extract and recursively translate the contents within the delimiters
-                inner_expression = line[start_index + 1 : i - 1]  # Exclude delimiters
-                translated_inner = self(inner_expression)
-                tokens.append(f"{left}{translated_inner}{right}")  # Treat as one token
-            else:
-                # For non-delimiter tokens, accumulate characters until whitespace, comma, or delimiter
-                start_index = i
-                while i < len(line) and not line[i].isspace() and line[i] != "," and all(line[i] != l for l, _ in self.left_right_pairs):
-                    i += 1
-
-                tokens.append(line[start_index:i])  # Add non-delimiter token
-
-        return tokens
+        return self.translate_tree(self.lexer.lex_line(line), line)
 
     def tokenize_statement(self, statement: str) -> list:
         """Tokenize the statement into lines, each treated as a list of tokens."""
         tokenized_lines = []
-        for line in statement.strip().splitlines():
-            # Tokenize each line individually
-            tokens = self.tokenize_line(line)
+        source = statement.strip()
+        for nodes in self.lexer.lex_statement(source):
+            # Translate the sub-expressions of each line
+            tokens = self.translate_tree(nodes, source)
             if tokens:
                 tokenized_lines.append(tokens)
         return tokenized_lines
 
+    def translate_tree(self, nodes: list, source: str = None) -> list:
+        """
+        Turn a token tree from the lexer into a list of tokens, translating each
+        sub-expression into a single token.
+
+        Sub-expressions are translated innermost first with an explicit stack, so deep
+        nesting cannot hit the recursion limit. If the source the tree was lexed from is
+        given, translations are memoized in sub_expression_cache, whose hits, misses and
+        evictions are counted in the instrumentation.
+        """
+        cache = self.sub_expression_cache if source is not None else None
+        stack = self.statement_stack
+        if cache is not None:
+            stack.read_log = []
+            cache_stats = cache.stats() if self.instrumentation is not None else None
+
+        try:
+            # Each frame is [nodes, index of the next node, tokens so far, cache key, read log start, stack version]
+            frames = [[nodes, 0, [], None, 0, 0]]
+            while True:
+                frame = frames[-1]
+                children, index, tokens = frame[0], frame[1], frame[2]
+
+                if index < len(children):
+                    node = children[index]
+                    if node.__class__ is Token:
+                        tokens.append(node.text)
+                        frame[1] += 1
+                        continue
+
+                    if cache is None:
+                        frames.append([node.children, 0, [], None, 0, 0])
+                        continue
+
+                    # Reuse the translation if every stack lookup it made still gives the same result
+                    key = source[node.start + 1 : node.end - 1 if node.closed else node.end]
+                    stack.prune_stack(0)
+                    cached = cache.get(key, lambda entry: stack.replay_reads(entry[0]))
+                    if cached is not None:
+                        reads, translated_inner = cached
+                        stack.read_log.extend(reads)  # Enclosing sub-expressions depend on them too
+                        tokens.append(f"{node.left}{translated_inner}{node.right}")
+                        frame[1] += 1
+                    else:
+                        frames.append([node.children, 0, [], key, len(stack.read_log), stack.version])
+                    continue
+
+                # All children are done, so translate the sub-expression into its parent
+                frames.pop()
+                if not frames:
+                    return tokens
+                parent = frames[-1]
+                group = parent[0][parent[1]]
+                translated_inner = self.translate_sub_expression(tokens)
+                parent[2].append(f"{group.left}{translated_inner}{group.right}")  # Treat as one token
+                parent[1] += 1
+
+                # Sub-expressions that changed the stack are not cached
+                key, read_start, version = frame[3], frame[4], frame[5]
+                if key is not None and stack.version == version:
+                    cache.put(key, (tuple(stack.read_log[read_start:]), translated_inner))
+        finally:
+            if cache is not None:
+                stack.read_log = None
+                if cache_stats is not None:
+                    self.record_cache_stats(cache_stats)
+
+    def record_cache_stats(self, previous_stats: dict):
+        """Count what the sub-expression cache did since previous_stats in the instrumentation."""
+        stats = self.sub_expression_cache.stats()
+        for counter in ("hits", "misses", "evictions"):
+            self.instrumentation.count(f"sub_expression_cache.{counter}", stats[counter] - previous_stats[counter])
+        self.instrumentation.maximum("sub_expression_cache.size", stats["size"])
+
+    def translate_sub_expression(self, tokens: list) -> str:
+        """Translate the tokens inside a pair of delimiters as a statement of their own."""
+        if not tokens:
+            return ""
+        return self.match_templates(tokens, None, 0)
+
 
     #######################
     ## TEMPLATE MATCHING ##
     #######################
 
     def match_templates(self, tokenized_line: list, tokenized_next_line: list = None, spaces: int = -1) -> str:
-        """Apply template matching to a tokenized line based on the provided templates."""
+        """
+        Apply template matching to a tokenized line based on the provided templates.
+
+        The line is read once, left to right, with a cursor (pos) marking the first token
+        not yet consumed; sub-statements are passed on as a single slice each.
+        """
         
         # Update the statement_stack to match the current scope
         if spaces != -1:
             self.statement_stack.prune_stack(spaces)
 
         output = []
+        pos = 0
+        num_tokens = len(tokenized_line)
 
         # Keep track of what is added to statement stack, so we do not replace 
         # a name with its value on the same line
@@ -136,20 +237,20 @@ class StatementTranslator:
 
         # Case 1: Existential constructions            
         if tokenized_line[0][0] == "⟨":
-            # Step 1: CLean up line
+            # Step 1: Clean up line
             tokenized_line[0] = tokenized_line[0].lstrip('⟨')
             tokenized_line[-1] = tokenized_line[-1].rstrip('⟩')
-            tokenized_line = [token for token in tokenized_line if token != ',']
             
-            # Step 2: Replace statements with values and find tags
+            # Step 2: Replace statements with values and find tags, skipping commas
             values = []
             statement_tags = []
-            for i in range(len(tokenized_line)):
-                token = tokenized_line[i]
+            for token in tokenized_line:
+                if token == ',':
+                    continue
                 item = self.statement_stack.get_by_name(token)
                 if item:
-                    values.append(item["statement"]) 
-                    statement_tags.append(item["tag"])
+                    values.append(item.statement) 
+                    statement_tags.append(item.tag)
 
             # Step 3: Construct output in a x, y, and z format
             output.append("finally, we have")
@@ -158,66 +259,66 @@ class StatementTranslator:
 
             # Step 4: Update relevant statements
             name = self.statement_stack.get_prev_name_by_spacing(spaces-2)
-            self.statement_stack.edit_item_by_name(name, exists=dc(values))
-            self.statement_stack.edit_item_by_name(name, exists_tags=dc(statement_tags))
+            self.statement_stack.edit_item_by_name(name, exists=values, exists_tags=statement_tags)
             
-            # Clear tokenized line to prevent printing twice
-            tokenized_line = []
+            # Consume the line to prevent printing twice
+            pos = num_tokens
 
         # Case 2: exact 
-        if tokenized_line and tokenized_line[0] == "exact":
+        if pos < num_tokens and tokenized_line[pos] == "exact":
             # Step 1: Extract hypotheses
     
             # Skip over "exact"
-            tokenized_line = tokenized_line[1:]
+            pos += 1
 
             # Check if tokenized line still exists
-            if not tokenized_line:
+            if pos >= num_tokens:
                 if tokenized_next_line:
                     return "we conclude the proof by"
                 else:
                     return "we conclude the proof"
 
-            # Remove brackets
-            tokenized_line[0] = tokenized_line[0].lstrip('⟨')
-            tokenized_line[-1] = tokenized_line[-1].rstrip('⟩')
-            tokenized_line = [token for token in tokenized_line if token != ',']
-
-            # Step 2: Substitute hypotheses
+            # Step 2: Substitute hypotheses, removing brackets and skipping commas
             values = []
-            for i in range(len(tokenized_line)):
+            for i in range(pos, num_tokens):
                 token = tokenized_line[i]
+                if i == pos:
+                    token = token.lstrip('⟨')
+                if i == num_tokens - 1:
+                    token = token.rstrip('⟩')
+                if token == ',':
+                    continue
                 item = self.statement_stack.get_by_name(token)
                 # If token is definition, we can skip
-                if item["tag"] in ["def", "let"]:
+                if item.tag in ["def", "let"]:
                    continue
                 else:
-                    values.append(item["statement"]) 
+                    values.append(item.statement) 
             
             # Step 3: Add line to output
             output.append("finally, we conclude by")
             output.append(self.join_values(values))
 
             # We are done with tokenized_line
-            tokenized_line = []
+            pos = num_tokens
 
         # Case 3: rw
-        if tokenized_line and tokenized_line[0] == "rw":
+        if pos < num_tokens and tokenized_line[pos] == "rw":
             # Remove "rw" and brackets, then leave it for later
-            tokenized_line = tokenized_line[1:]
-            tokenized_line[0] = tokenized_line[0].lstrip('[')
+            pos += 1
+            tokenized_line[pos] = tokenized_line[pos].lstrip('[')
             tokenized_line[-1] = tokenized_line[-1].rstrip(']')
 
         # Case 4: intro
-        if tokenized_line and tokenized_line[0] == "intro":
+        if pos < num_tokens and tokenized_line[pos] == "intro":
             # We will handle these later
-            return " ".join(tokenized_line)
+            return " ".join(tokenized_line[pos:] if pos else tokenized_line)
 
         # Case 5: lemma, theorem, have, etc. 
         tags = ["lemma", "theorem", "have"]
-        if tokenized_line and tokenized_line[0] in tags: 
-            tag = tokenized_line[0]
-            name = tokenized_line[1]
+        if pos < num_tokens and tokenized_line[pos] in tags: 
+            tag = tokenized_line[pos]
+            name = tokenized_line[pos+1]
 
             # Step 1: Append tag and statement name
             if tag != "have":
@@ -227,113 +328,109 @@ class StatementTranslator:
                 output.append("we claim")
             
             # Discard tag and statement name
-            tokenized_line = tokenized_line[2:]
+            pos += 2
 
             # Step 2: Create let statements
-            assumptions = []
 
             # Iterate through the assumptions
-            i = 0
+            i = pos
             while tokenized_line[i] != ":":
-                assumptions.append(tokenized_line[i])
                 i += 1
+            assumptions = tokenized_line[pos:i]
 
             # Append assumptions to output
-            if i != 0:
+            if assumptions:
                 assumption_string = self.match_assumptions(assumptions, tag)
                 output.append(assumption_string)
                 output.append("Then")
 
             # Skip over colon
-            tokenized_line = tokenized_line[i+1:]
+            pos = i + 1
 
             # Step 3: Translate statement
-            tokenized_statement = []
 
             # Iterate until proof
-            i = 0 
-            while i < len(tokenized_line) and tokenized_line[i] != ":=":
-                tokenized_statement.append(tokenized_line[i])
+            i = pos
+            while i < num_tokens and tokenized_line[i] != ":=":
                 i += 1
 
             # Translate the statement
-            statement_string = self.match_templates(tokenized_statement)
+            statement_string = self.match_templates(tokenized_line[pos:i])
             output.append(statement_string)
 
             # Skip over ":="
-            tokenized_line = tokenized_line[i+1:]
+            pos = i + 1
 
             # Skip over "by"
-            if tokenized_line and tokenized_line[0] == "by":
-                tokenized_line = tokenized_line[1:]
+            if pos < num_tokens and tokenized_line[pos] == "by":
+                pos += 1
 
             # Step 4: Translate proof
-            if tokenized_line:
+            if pos < num_tokens:
                 output.append(", because")
             elif tag == "have":
                 output.append(". Indeed,")
 
             # Add the statement to the statement stack
-            item = {
-                "spaces": spaces,
-                "tag": tag,
-                "name": name,
-                "assumes": assumptions,
-                "statement": statement_string
-            }
+            item = StackItem(
+                spaces=spaces,
+                tag=tag,
+                name=name,
+                assumes=assumptions,
+                statement=statement_string
+            )
             self.statement_stack.add_to_stack(item)
             recently_added.append(name) 
 
         # Case 6: let 
-        if tokenized_line and tokenized_line[0] == "let":
+        if pos < num_tokens and tokenized_line[pos] == "let":
             # Step 1: Make initial let upper case
             output.append("let")
-            tokenized_line = tokenized_line[1:]
+            pos += 1
 
             # Step 2: Translate L.H.S.
-            lhs = []
 
             # End of L.H.S. is denoted by ":="
-            i = 0 
-            while i < len(tokenized_line) and tokenized_line[i] != ":=":
-                lhs.append(tokenized_line[i])
+            i = pos
+            while i < num_tokens and tokenized_line[i] != ":=":
                 i += 1
+            lhs = tokenized_line[pos:i]
 
             # Add translated L.H.S
             translated_lhs = self.match_templates(lhs)
             output.append(translated_lhs)
 
             # Skip over ":=" and replace it with "be"
-            tokenized_line = tokenized_line[i+1:]
+            pos = i + 1
             output.append("be")
 
             # Step 3: Translate the R.H.S.
-            translated_rhs = self.match_templates(tokenized_line)
+            translated_rhs = self.match_templates(tokenized_line[pos:])
             output.append(translated_rhs)
 
             # Prevent printing twice
-            tokenized_line = []
+            pos = num_tokens
 
             # Step 4: Add definition to statement_stack
-            item = {
-                "spaces": spaces,
-                "tag": "let",
-                "name": lhs[0],
-                "statement": f"{lhs[0]} is {translated_rhs}"
-            }
+            item = StackItem(
+                spaces=spaces,
+                tag="let",
+                name=lhs[0],
+                statement=f"{lhs[0]} is {translated_rhs}"
+            )
             self.statement_stack.add_to_stack(item)
 
         # Case 7: obtain
-        if tokenized_line and tokenized_line[0] == "obtain": 
+        if pos < num_tokens and tokenized_line[pos] == "obtain": 
             # Skip over obtain
-            tokenized_line = tokenized_line[1:]
+            pos += 1
 
             # Step 1: Extract variables from ⟨ ⟩
             names = []
-            i = 0
+            i = pos
 
             # Look for tokens until we reach ":="
-            while i < len(tokenized_line) and tokenized_line[i] != ':=':
+            while i < num_tokens and tokenized_line[i] != ':=':
                 # Remove brackets and commas, adding only variable names to the list
                 token = tokenized_line[i].strip("⟨⟩,")
                 if token:
@@ -341,20 +438,20 @@ class StatementTranslator:
                 i += 1
 
             # Step 2: Move past ":=" and identify the theorem name
-            if i < len(tokenized_line) and tokenized_line[i] == ':=':
-                tokenized_line = tokenized_line[i + 1:]
-            underlying_theorem = tokenized_line[0]
-            tokenized_line = tokenized_line[1:]
+            if i < num_tokens and tokenized_line[i] == ':=':
+                pos = i + 1
+            underlying_theorem = tokenized_line[pos]
+            arguments = tokenized_line[pos+1:]
 
             # Step 3: Retrieve theorem details from the stack
             statement_item = self.statement_stack.get_by_name(underlying_theorem)
-            assumes = statement_item.get('assumes', [])
-            exists_list = statement_item.get('exists', [])
-            tags = statement_item.get('exists_tags', [])
+            assumes = statement_item.assumes or []
+            exists_list = statement_item.exists or []
+            tags = statement_item.exists_tags or []
 
             # Step 4: Create substitution map from assumptions to provided arguments
             variable_names = [re.match(r'\((\w+)\s*:', a).group(1) for a in assumes]
-            substitutions = dict(zip(variable_names, tokenized_line))
+            substitutions = dict(zip(variable_names, arguments))
 
             # Step 5: Apply substitutions to each statement in the "exists" list
             substituted_exists = [
@@ -372,12 +469,12 @@ class StatementTranslator:
             # Step 7: Add each name and its statement to the statement stack
             statements = substituted_exists
             for name, stmt, tag in zip(names, statements, tags):
-                item = {
-                    "spaces": spaces,
-                    "tag": tag,
-                    "name": name,
-                    "statement": stmt
-                }
+                item = StackItem(
+                    spaces=spaces,
+                    tag=tag,
+                    name=name,
+                    statement=stmt
+                )
                 self.statement_stack.add_to_stack(item)
             
             # Step 8: Add results to output
@@ -386,87 +483,72 @@ class StatementTranslator:
             output.append((", and " if len(statements) > 1 else ""))
             output.append(statements[-1])
 
-            # Clear tokenized_line to prevent further processing
-            tokenized_line = []
+            # Consume the line to prevent further processing
+            pos = num_tokens
 
         # Case 8: General 
-        i = 0
-        while i < len(tokenized_line):
-            # First apply template matching
-            formatted_token = ""
-            token = tokenized_line[i]
-
-            # Check if the token is a template, or if we need to trim it and check again
-            if token in self.template_dict:
-                template_key = token
-            else:
-                # Split the token on the first period, if it exists, and check the remainder
-                template_key = token.split('.', 1)[-1] if '.' in token else token
-
-            # Determine if the (possibly trimmed) token has a template
-            if template_key in self.template_dict:
-                # Get the template
-                template_info = self.template_dict[template_key]
-                template = template_info["template"]
-                num_args = template_info["variables"]
-
-                # Collect necessary arguments if specified
-                args = tokenized_line[i+1:i+1+num_args]
-
-                # Apply the template, filling placeholders if needed
-                for j, arg in enumerate(args):
-                    template = template.replace(f"{{{j}}}", str(arg))
-                formatted_token = template
-
-                # Skip over arguments
-                i += num_args
+        i = pos
+        while i < num_tokens:
+            # Find the longest (possibly multi-token or namespace-qualified) template match
+            match = self.template_trie.match(tokenized_line, i)
+            if match:
+                # Get the compiled template
+                template, num_matched = match
+
+                # Apply the template to the arguments that follow the match, filling placeholders if needed
+                output.append(template.apply(tokenized_line, i + num_matched))
+                if self.instrumentation is not None:
+                    self.instrumentation.count("template_hits")
+
+                # Skip over the matched tokens and arguments
+                i += num_matched + template.arity
             else:
                 # If no template is found, treat it as a standalone token
-                formatted_token = token
-
-            # Add formatted token to output and move on to the next token
-            output.append(formatted_token)
-            i += 1  
+                output.append(tokenized_line[i])
+                if self.instrumentation is not None:
+                    self.instrumentation.count("template_misses")
+                i += 1
 
         # Create an output string
         output_str = " ".join(output)
 
         # Case 9: {s1, negateInequality}
-        matches = list(re.finditer(r"\{s\d+(?:,\s*)?[^\}]+\}", output_str))
-        for match in reversed(matches):
-            # Extract the matched string
-            matched_text = match.group()
-            
-            # Apply the operation or retrieve the statement using apply_operation
-            result = self.apply_operation(matched_text)
-            
-            # Substitute the result into the output string at the current match position
-            output_str = output_str[:match.start()] + result + output_str[match.end():]
+        matches = list(STACK_REFERENCE_PATTERN.finditer(output_str)) if "{s" in output_str else None
+        if matches:
+            # Apply the operations last first, then splice all results in with one join
+            results = [self.apply_operation(match.group()) for match in reversed(matches)]
+            results.reverse()
+            pieces = []
+            end = 0
+            for match, result in zip(matches, results):
+                pieces.append(output_str[end:match.start()])
+                pieces.append(result)
+                end = match.end()
+            pieces.append(output_str[end:])
+            output_str = "".join(pieces)
 
         # Case 10: fun h =>
-        match = re.search(r"\bfun\s+(\w+)\s*=>", output_str)
+        match = FUN_PATTERN.search(output_str)
         if match:
             # Split up string 
             before_fun = output_str[:match.start()].strip().rstrip(".")
             name = match.group(1)
             
             # Add to statement stack
-            item = {
-                "spaces": spaces,
-                "tag": "fun",
-                "name": name,
-                "statement": before_fun
-            }
+            item = StackItem(
+                spaces=spaces,
+                tag="fun",
+                name=name,
+                statement=before_fun
+            )
             self.statement_stack.add_to_stack(item)
 
             # Remove text
             output_str = before_fun
 
         # Case 11: Unmatched statements
-        words = output_str.split()
         replaced_words = []
-
-        for i, word in enumerate(words):
+        for word in output_str.split():
             # Get the statement values, ignoring let and def
             replacement = self.statement_stack.get_statement_by_name(word, ignore_defs=True)
             
@@ -478,10 +560,8 @@ class StatementTranslator:
             else:
                 replaced_words.append(word)
 
-        output_str = " ".join(replaced_words)
-
         # Join the output list into a readable sentence
-        return output_str
+        return " ".join(replaced_words)
 
     def match_assumptions(self, assumptions: list, tag: str):
         # Parse assumptions once
@@ -507,35 +587,14 @@ class StatementTranslator:
         
     def apply_operation(self, command: str) -> str:
         """Apply an operation to a specified statement or return the statement itself if no operation is given."""
+        if self.instrumentation is not None:
+            self.instrumentation.count("apply_operation_calls")
         
-        # Match the command format
-        match = re.match(r"\{(s(\d+))(?:,\s*(\w+))?\}", command)
-        if not match:
-            raise ValueError(f"Invalid command format: {command}")
-        
-        statement_ref, index_str, operation_name = match.groups()
-        index = int(index_str)
-
-        # Retrieve the statement from the stack
-        try:
-            statement = self.statement_stack.peek_n(index)
-        except IndexError as e:
-            raise ValueError(f"Stack does not contain s{index}: {e}")
-
-        # If no operation is specified, return the statement directly
-        if not operation_name:
-            return statement
-
-        # Get the method from operations.py by name
-        if not hasattr(operators, operation_name):
-            raise AttributeError(f"Operation '{operation_name}' not found in operations module")
-
-        operation = getattr(operators, operation_name)
-        
-        # Apply the operation to the statement
-        result = operation(statement)
+        # Parsed references, with their operators, are cached across lines
+        stack_reference = parse_stack_reference(command)
 
-        return result
+        # Apply the registered operator to the statement from the stack
+        return stack_reference.resolve(self.statement_stack)
     
 
     ###############
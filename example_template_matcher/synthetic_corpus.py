@@ -0,0 +1,122 @@
+# synthetic_corpus.py
+
+import json
+import random
+
+def nested_expression(depth: int) -> str:
+    """Return a minFac expression with the given bracket nesting depth."""
+    expression = "(n ! + 1)"
+    for _ in range(depth - 1):
+        expression = f"(minFac {expression})"
+    return expression
+
+def generate_templates(num_templates: int, base_templates: list = (), seed: int = 0) -> list:
+    """
+    Return base_templates followed by synthetic aux_lemma_k templates, up to num_templates in total.
+
+    Synthetic templates take zero or one argument, so declarations can use them either way.
+    """
+    rng = random.Random(seed)
+    templates = list(base_templates)
+    for k in range(max(0, num_templates - len(templates))):
+        if rng.random() < 0.5:
+            templates.append({"expression": f"aux_lemma_{k}", "variables": 1, "template": f"{{0}} has property {k}"})
+        else:
+            templates.append({"expression": f"aux_lemma_{k}", "variables": 0, "template": f"property {k} holds"})
+    return templates
+
+def generate_existence_theorem(index: int, proof_depth: int, bracket_nesting: int, num_aux_lemmas: int, rng) -> list:
+    """Return the lines of a theorem shaped like Euclid's theorem, ending with an existential construction."""
+    lines = [
+        f"theorem thm_{index} (n : ℕ) : ∃ p, n ≤ p ∧ Prime p :=",
+        f"  let p := minFac {nested_expression(bracket_nesting)}",
+        "  have f1 : n ! + 1 ≠ 1 := ne_of_gt <| succ_lt_succ <| factorial_pos _",
+        "  have pp : Prime p := minFac_prime f1",
+    ]
+
+    # Extra claims justified by synthetic lemmas
+    for k in range(rng.randint(0, 3)):
+        if num_aux_lemmas:
+            lemma = f"aux_lemma_{rng.randrange(num_aux_lemmas)}"
+            lines.append(f"  have e{k} : {lemma} p := {lemma} n")
+
+    # A proof by contradiction, nested proof_depth levels deep
+    lines.append("  have np : n ≤ p :=")
+    lines.append("    le_of_not_ge fun h =>")
+    indent = "      "
+    for level in range(proof_depth - 1):
+        lines.append(f"{indent}have c{level} : p ∣ n ! :=")
+        indent += "  "
+    lines.append(f"{indent}have h₁ : p ∣ n ! := dvd_factorial (minFac_pos _) h")
+    lines.append(f"{indent}have h₂ : p ∣ 1 := (Nat.dvd_add_iff_right h₁).2 (minFac_dvd _)")
+    lines.append(f"{indent}pp.not_dvd_one h₂")
+    lines.append("  ⟨p, np, pp⟩")
+    return lines
+
+def generate_unbounded_theorem(index: int, existence_index: int) -> list:
+    """Return the lines of a theorem using intro, obtain and exact on an earlier existence theorem."""
+    return [
+        f"theorem unbounded_{index} : ¬BddAbove {{ p | Prime p }} := by",
+        "  rw [not_bddAbove_iff]",
+        "  intro n",
+        f"  obtain ⟨p, hi, hp⟩ := thm_{existence_index} n.succ",
+        "  exact ⟨p, hp, hi⟩",
+    ]
+
+def generate_corpus(num_declarations: int, proof_depth: int = 2, bracket_nesting: int = 1,
+                    tactic_density: float = 0.2, num_aux_lemmas: int = 0, seed: int = 0) -> str:
+    """
+    Generate a synthetic Lean file that the translator handles end to end.
+
+    tactic_density is the fraction of declarations that use intro, obtain and exact
+    (referring back to an earlier existence theorem); the others are existence theorems
+    with proof_depth levels of nested claims and bracket_nesting levels of brackets.
+    """
+    rng = random.Random(seed)
+    lines = [
+        "/-",
+        "Synthetic corpus generated by synthetic_corpus.py",
+        "-/",
+        "import Mathlib.Data.Nat.Prime.Defs",
+        "",
+        "open Nat",
+        "",
+    ]
+    existence_indices = []
+    for index in range(num_declarations):
+        if existence_indices and rng.random() < tactic_density:
+            declaration = generate_unbounded_theorem(index, rng.choice(existence_indices))
+        else:
+            declaration = generate_existence_theorem(index, proof_depth, bracket_nesting, num_aux_lemmas, rng)
+            existence_indices.append(index)
+        lines.extend(declaration)
+        lines.append("")
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic Lean corpus.")
+    parser.add_argument("output", help="path of the Lean file to write")
+    parser.add_argument("--declarations", type=int, default=100)
+    parser.add_argument("--proof-depth", type=int, default=2)
+    parser.add_argument("--bracket-nesting", type=int, default=1)
+    parser.add_argument("--tactic-density", type=float, default=0.2)
+    parser.add_argument("--templates", type=int, default=0, help="size of the template set to write next to the output")
+    parser.add_argument("--base-templates", default="templates.json")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    num_aux_lemmas = 0
+    if args.templates:
+        with open(args.base_templates, 'r', encoding='utf-8') as file:
+            base_templates = json.load(file)
+        templates = generate_templates(args.templates, base_templates, args.seed)
+        num_aux_lemmas = len(templates) - len(base_templates)
+        with open(args.output.rsplit(".", 1)[0] + "_templates.json", 'w', encoding='utf-8') as file:
+            json.dump(templates, file, ensure_ascii=False, indent=4)
+
+    corpus = generate_corpus(args.declarations, args.proof_depth, args.bracket_nesting,
+                             args.tactic_density, num_aux_lemmas, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        file.write(corpus)
@@ -0,0 +1,265 @@
+# template_store.py
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from compiled_template import CompiledTemplate
+from lru_cache import LRUCache
+
+# File layout, all integers little-endian:
+#   header  magic, format version, source mtime (ns), source size, source SHA-256,
+#           number of templates, number of hash table slots, table offset, data offset
+#   table   one (key hash, key offset, entry offset) slot per bucket, open addressing,
+#           with offsets relative to the data section
+#   data    keys:      u32 length + UTF-8 first token
+#           entries:   u32 count + u32 record offsets, longest expression first
+#           records:   u32 arity, u32 number of tokens, expression, template (u32 length + UTF-8 each)
+STORE_MAGIC = b"TPLSTORE"
+STORE_FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIqQ32sIIII")
+SLOT = struct.Struct("<III")
+UINT = struct.Struct("<I")
+EMPTY_SLOT = 0xFFFFFFFF
+
+class StaleTemplateStore(Exception):
+    """Raised when a template store was built from a different templates.json."""
+
+def key_hash(key: bytes) -> int:
+    return zlib.crc32(key)
+
+def build_template_store(templates_path: str, store_path: str):
+    """
+    Compile templates.json into a binary store at store_path.
+
+    Every template is compiled (and so validated) first. Templates are indexed by the
+    first token of their expression, which is also the key namespace suffixes resolve to.
+    """
+    with open(templates_path, 'rb') as file:
+        source = file.read()
+    source_stat = os.stat(templates_path)
+    templates = json.loads(source)
+
+    # Compile to validate, keeping the last template for each token sequence like the trie does
+    by_tokens = {}
+    for template_info in templates:
+        template = CompiledTemplate.from_dict(template_info)
+        tokens = tuple(template.expression.split())
+        if tokens:
+            by_tokens[tokens] = template
+
+    groups = {}
+    for tokens, template in by_tokens.items():
+        groups.setdefault(tokens[0], []).append((tokens, template))
+
+    data = bytearray()
+    def add_string(text: str) -> None:
+        encoded = text.encode("utf-8")
+        data.extend(UINT.pack(len(encoded)))
+        data.extend(encoded)
+
+    # Records, then each first token's key and entry
+    slots = []
+    for first_token, group in groups.items():
+        group.sort(key=lambda pair: -len(pair[0]))
+        record_offsets = []
+        for tokens, template in group:
+            record_offsets.append(len(data))
+            data.extend(UINT.pack(template.arity))
+            data.extend(UINT.pack(len(tokens)))
+            add_string(template.expression)
+            add_string(template.template)
+
+        key_offset = len(data)
+        add_string(first_token)
+        entry_offset = len(data)
+        data.extend(UINT.pack(len(record_offsets)))
+        for record_offset in record_offsets:
+            data.extend(UINT.pack(record_offset))
+        slots.append((key_hash(first_token.encode("utf-8")), key_offset, entry_offset))
+
+    # A power-of-two table at most half full keeps probe sequences short
+    num_slots = 8
+    while num_slots < 2 * len(slots):
+        num_slots *= 2
+    table = [(0, EMPTY_SLOT, EMPTY_SLOT)] * num_slots
+    for slot in slots:
+        index = slot[0] & (num_slots - 1)
+        while table[index][1] != EMPTY_SLOT:
+            index = (index + 1) & (num_slots - 1)
+        table[index] = slot
+
+    table_offset = HEADER.size
+    data_offset = table_offset + num_slots * SLOT.size
+    header = HEADER.pack(
+        STORE_MAGIC, STORE_FORMAT_VERSION, source_stat.st_mtime_ns, source_stat.st_size,
+        hashlib.sha256(source).digest(), len(by_tokens), num_slots, table_offset, data_offset,
+    )
+
+    # Write atomically, since running workers may have the old store mapped
+    directory = os.path.dirname(os.path.abspath(store_path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(header)
+            for slot in table:
+                file.write(SLOT.pack(*slot))
+            file.write(data)
+        os.replace(temp_path, store_path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class TemplateStore:
+    """
+    A read-only, memory-mapped template store, with the match interface of TemplateTrie.
+
+    The file is mapped rather than read, so processes opening the same store share its
+    pages. Entries are decoded only when a token first looks them up, and templates only
+    when they first match. Threads may match at once: decoding the same entry twice
+    gives the same result, and the LRU of resolved tokens is locked.
+    """
+
+    def __init__(self, store_path: str, cache_size: int = 65536):
+        self.store_path = store_path
+        with open(store_path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, self.source_mtime_ns, self.source_size, self.source_sha256,
+         self.num_templates, self.num_slots, self.table_offset, self.data_offset) = HEADER.unpack_from(self.buffer, 0)
+        if magic != STORE_MAGIC:
+            raise ValueError(f"{store_path} is not a template store.")
+        if version != STORE_FORMAT_VERSION:
+            raise StaleTemplateStore(f"{store_path} has format version {version}, expected {STORE_FORMAT_VERSION}.")
+
+        # First token -> [(following tokens, record offset)], and record offset -> CompiledTemplate
+        self.entries = {}
+        self.templates = {}
+        # Token -> first tokens it may refer to, for the tokens seen most recently
+        self.resolved = LRUCache(cache_size)
+        self.resolved_lock = threading.Lock()
+
+    @classmethod
+    def open(cls, store_path: str, templates_path: str = None) -> "TemplateStore":
+        """Open a store, checking that it is up to date with templates_path if given."""
+        store = cls(store_path)
+        if templates_path is not None and not store.is_current(templates_path):
+            store.close()
+            raise StaleTemplateStore(f"{store_path} is out of date with {templates_path}.")
+        return store
+
+    def is_current(self, templates_path: str) -> bool:
+        """Check the store against templates.json, hashing it only if its mtime or size changed."""
+        source_stat = os.stat(templates_path)
+        if source_stat.st_mtime_ns == self.source_mtime_ns and source_stat.st_size == self.source_size:
+            return True
+        with open(templates_path, 'rb') as file:
+            return hashlib.sha256(file.read()).digest() == self.source_sha256
+
+    def close(self):
+        self.buffer.close()
+
+    def read_string(self, offset: int) -> tuple:
+        """Return the string at offset in the data section and the offset after it."""
+        start = self.data_offset + offset + UINT.size
+        length = UINT.unpack_from(self.buffer, start - UINT.size)[0]
+        return self.buffer[start:start + length].decode("utf-8"), offset + UINT.size + length
+
+    def find_entry(self, first_token: str):
+        """Return the entry offset for a first token, or None if no expression starts with it."""
+        key = first_token.encode("utf-8")
+        hash_value = key_hash(key)
+        mask = self.num_slots - 1
+        index = hash_value & mask
+        while True:
+            slot_hash, key_offset, entry_offset = SLOT.unpack_from(self.buffer, self.table_offset + index * SLOT.size)
+            if key_offset == EMPTY_SLOT:
+                return None
+            if slot_hash == hash_value:
+                start = self.data_offset + key_offset + UINT.size
+                length = UINT.unpack_from(self.buffer, start - UINT.size)[0]
+                if self.buffer[start:start + length] == key:
+                    return entry_offset
+            index = (index + 1) & mask
+
+    def get_entry(self, first_token: str) -> list:
+        """Decode the expressions starting with first_token, longest first."""
+        entry = self.entries.get(first_token)
+        if entry is None:
+            entry = []
+            entry_offset = self.find_entry(first_token)
+            if entry_offset is not None:
+                count = UINT.unpack_from(self.buffer, self.data_offset + entry_offset)[0]
+                for k in range(count):
+                    record_offset = UINT.unpack_from(self.buffer, self.data_offset + entry_offset + UINT.size * (k + 1))[0]
+                    expression, _ = self.read_string(record_offset + 2 * UINT.size)
+                    entry.append((tuple(expression.split()[1:]), record_offset))
+            self.entries[first_token] = entry
+        return entry
+
+    def get_template(self, record_offset: int) -> CompiledTemplate:
+        template = self.templates.get(record_offset)
+        if template is None:
+            arity = UINT.unpack_from(self.buffer, self.data_offset + record_offset)[0]
+            expression, offset = self.read_string(record_offset + 2 * UINT.size)
+            template_text, _ = self.read_string(offset)
+            template = self.templates[record_offset] = CompiledTemplate(expression, template_text, arity)
+        return template
+
+    def resolve_namespace(self, token: str) -> list:
+        """Return the first tokens of expressions that token may refer to, longest first."""
+        with self.resolved_lock:
+            resolved = self.resolved.get(token)
+        if resolved is None:
+            components = token.split('.')
+            resolved = [
+                suffix for suffix in ('.'.join(components[k:]) for k in range(len(components)))
+                if self.get_entry(suffix)
+            ]
+            with self.resolved_lock:
+                self.resolved.put(token, resolved)
+        return resolved
+
+    def match(self, tokens: list, start: int = 0):
+        """
+        Find the longest expression starting at tokens[start].
+
+        Returns (template, number of tokens matched), or None if no expression matches.
+        """
+        for first_token in self.resolve_namespace(tokens[start]):
+            for following_tokens, record_offset in self.get_entry(first_token):
+                end = start + 1 + len(following_tokens)
+                if end <= len(tokens) and tuple(tokens[start + 1:end]) == following_tokens:
+                    return self.get_template(record_offset), end - start
+        return None
+
+    def __len__(self):
+        return self.num_templates
+
+def load_template_store(templates_path: str, store_path: str) -> TemplateStore:
+    """Open the store for templates_path, building or rebuilding it first if needed."""
+    if os.path.exists(store_path):
+        try:
+            return TemplateStore.open(store_path, templates_path)
+        except (StaleTemplateStore, ValueError, struct.error):
+            pass
+    build_template_store(templates_path, store_path)
+    return TemplateStore.open(store_path)
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compile templates.json into a memory-mappable template store.")
+    parser.add_argument("templates", help="path to templates.json")
+    parser.add_argument("store", help="path of the store to write")
+    args = parser.parse_args()
+
+    build_template_store(args.templates, args.store)
+    store = TemplateStore.open(args.store)
+    print(f"Wrote {len(store)} templates to {args.store} ({os.path.getsize(args.store)} bytes).")
+    store.close()
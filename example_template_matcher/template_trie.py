@@ -0,0 +1,91 @@
+# template_trie.py
+
+class _TrieNode:
+    __slots__ = ("children", "value")
+
+    def __init__(self):
+        self.children = {}
+        self.value = None
+
+
+class TemplateTrie:
+    """
+    A token trie over the template expressions, built once from the template dictionary.
+
+    Expressions may span several space-separated tokens (e.g. "¬ ∃" or "∀ x ∈"), and
+    lookups return the longest match. Qualified tokens such as Mathlib.Nat.Prime resolve
+    to the longest namespace suffix (Nat.Prime, then Prime) that starts an expression.
+    """
+
+    def __init__(self, template_dict: dict):
+        self.root = _TrieNode()
+        # Trie over the reversed "."-components of each expression's first token
+        self.namespace_root = _TrieNode()
+
+        for expression, template in template_dict.items():
+            self.insert(expression, template)
+
+    def insert(self, expression: str, template):
+        """Add an expression and the template it maps to."""
+        tokens = expression.split()
+        if not tokens:
+            return
+
+        # Walk (or create) the path of tokens
+        node = self.root
+        for token in tokens:
+            child = node.children.get(token)
+            if child is None:
+                child = node.children[token] = _TrieNode()
+            node = child
+        node.value = template
+
+        # Index the first token by its namespace components, last component first
+        node = self.namespace_root
+        for component in reversed(tokens[0].split('.')):
+            child = node.children.get(component)
+            if child is None:
+                child = node.children[component] = _TrieNode()
+            node = child
+        node.value = tokens[0]
+
+    def resolve_namespace(self, token: str) -> list:
+        """Return the first tokens of expressions that token may refer to, longest first."""
+        if '.' not in token:
+            return [token] if token in self.root.children else []
+
+        # Walk the components from the right, recording every suffix that starts an expression
+        suffixes = []
+        node = self.namespace_root
+        for component in reversed(token.split('.')):
+            node = node.children.get(component)
+            if node is None:
+                break
+            if node.value is not None:
+                suffixes.append(node.value)
+        suffixes.reverse()
+        return suffixes
+
+    def match(self, tokens: list, start: int = 0):
+        """
+        Find the longest expression starting at tokens[start].
+
+        Returns (template, number of tokens matched), or None if no expression matches.
+        """
+        for first_token in self.resolve_namespace(tokens[start]):
+            node = self.root.children[first_token]
+            best = (node.value, 1) if node.value is not None else None
+
+            # Extend the match over the following tokens for as long as the trie allows
+            i = start + 1
+            while i < len(tokens) and node.children:
+                node = node.children.get(tokens[i])
+                if node is None:
+                    break
+                i += 1
+                if node.value is not None:
+                    best = (node.value, i - start)
+
+            if best:
+                return best
+        return None
@@ -0,0 +1,11 @@
+# conftest.py
+
+import os
+import sys
+
+# The modules are flat scripts, imported the way they import each other
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PACKAGE_DIR)
+
+TEMPLATES_PATH = os.path.join(PACKAGE_DIR, "templates.json")
+LEAN_EXAMPLE_PATH = os.path.join(PACKAGE_DIR, "lean_example.lean")
@@ -0,0 +1,107 @@
+# lean_fuzz.py
+
+# Random Lean-like declarations for the differential tests. They reuse the words of
+# lean_example.lean, so templates match, and cover each case of match_templates,
+# including malformed lines that make the translator raise.
+
+WORDS = [
+    "Prime", "p", "n", "minFac", "∃", "∧", "≤", "<|", "le_of_not_ge", "fun", "h", "=>", "exact", "rw", "intro",
+    ":=", ":", "!", "+", "1", "hp.not_dvd_one", "Nat.Prime", "x", "h₁", "_", "not_bddAbove_iff", "factorial_pos",
+    "⟨p,", "hp⟩", ",", "∣",
+]
+NAMES = ["a", "b", "c", "exists_infinite_primes"]
+
+def expression(rng, balanced: bool = True, depth: int = 0) -> str:
+    tokens = []
+    for _ in range(rng.randint(1, 5)):
+        if rng.random() < 0.2 and depth < 6:
+            left, right = rng.choice([("(", ")"), ("{", "}")])
+            if not balanced and rng.random() < 0.2:
+                right = ""
+            tokens.append(left + expression(rng, balanced, depth + 1) + right)
+        else:
+            tokens.append(rng.choice(WORDS))
+    return " ".join(tokens)
+
+def statement(rng, balanced: bool = True) -> str:
+    """A declaration with random proof lines, which may not translate."""
+    lines = [f"theorem {rng.choice(NAMES)} (n : ℕ) : {expression(rng, balanced)} :="]
+    for _ in range(rng.randint(0, 6)):
+        indent = " " * rng.choice([2, 4, 6])
+        kind = rng.random()
+        if kind < 0.3:
+            line = f"have {rng.choice(['h', 'pp', 'np'])} : {expression(rng, balanced)} := {expression(rng, balanced)}"
+        elif kind < 0.45:
+            line = f"let {rng.choice(['p', 'q'])} := {expression(rng, balanced)}"
+        elif kind < 0.55:
+            line = rng.choice(["⟨p, np, pp⟩", "⟨p⟩", "⟨ p , q ⟩", "⟨h, pp⟩"])
+        elif kind < 0.62:
+            line = rng.choice(["exact", "exact ⟨p, hp, h⟩", "exact ⟨pp⟩", "exact h", "exact ⟨p , pp⟩"])
+        elif kind < 0.7:
+            line = "rw " + rng.choice(["[not_bddAbove_iff]", "[h]", "[", "[ Prime ]", "[intro n]"]) + " " + expression(rng, balanced)
+        elif kind < 0.75:
+            line = rng.choice(["intro n", "intro x y", "rw [intro]"])
+        elif kind < 0.82:
+            line = (
+                "obtain " + rng.choice(["⟨p, hi, hp⟩", "⟨q, h⟩", "⟨p⟩", ""]) + rng.choice([" := ", " "])
+                + rng.choice(NAMES + [""]) + " " + rng.choice(["n", "n.succ", "", "(n + 1)"])
+            )
+        elif kind < 0.86:
+            line = rng.choice([
+                "let ⟨x, hx⟩ := h", "let := p", "let x :=", "have :=", "have h : := p",
+                "have h (m : ℕ) : Prime m := pp", "lemma q (k : ℕ) : k ≤ k := le_refl",
+            ])
+        else:
+            line = expression(rng, balanced)
+        lines.append(indent + line)
+    return "\n".join(lines)
+
+SIMPLE_WORDS = [
+    "Prime", "p", "n", "minFac", "∃", "∧", "≤", "<|", "le_of_not_ge", "h", "!", "+", "1", "hp.not_dvd_one", "x",
+    "h₁", "_", "factorial_pos", "∣", "a", "b", "c",
+]
+
+def simple_expression(rng, depth: int = 0) -> str:
+    tokens = []
+    for _ in range(rng.randint(1, 4)):
+        if rng.random() < 0.2 and depth < 3:
+            tokens.append("(" + simple_expression(rng, depth + 1) + ")")
+        else:
+            tokens.append(rng.choice(SIMPLE_WORDS))
+    return " ".join(tokens)
+
+def file_statements(rng, count: int) -> list:
+    """Declarations that mostly translate, later ones obtaining from and referring to earlier ones."""
+    names = []
+    statements = []
+    for _ in range(count):
+        name = rng.choice(["a", "b", "c", "d", "e"])
+        lines = [f"theorem {name} (n : ℕ) : ∃ p, {simple_expression(rng)} :="]
+        hypotheses = []
+        for _ in range(rng.randint(0, 5)):
+            kind = rng.random()
+            if kind < 0.3:
+                hypothesis = rng.choice(["h", "pp", "np", "x"])
+                hypotheses.append(hypothesis)
+                lines.append(f"  have {hypothesis} : {simple_expression(rng)} := {simple_expression(rng)}")
+            elif kind < 0.4:
+                lines.append(f"  let {rng.choice(['p', 'q'])} := {simple_expression(rng)}")
+            elif kind < 0.5 and names:
+                lines.append(f"  obtain ⟨p, hp⟩ := {rng.choice(names)} n")
+            elif kind < 0.6 and hypotheses:
+                lines.append(f"  ⟨{', '.join(rng.sample(hypotheses, min(2, len(hypotheses))))}⟩")
+            elif kind < 0.7:
+                lines.append("  le_of_not_ge fun h =>")
+            else:
+                lines.append("  " + simple_expression(rng))
+        names.append(name)
+        statements.append("\n".join(lines))
+    return statements
+
+def files(rng, count: int) -> list:
+    """Lists of declarations, a mix of mostly-translating files and random ones."""
+    return [
+        file_statements(rng, rng.randint(2, 8)) if rng.random() < 0.5
+        else [statement(rng, rng.random() < 0.7) for _ in range(rng.randint(1, 4))]
+        for _ in range(count)
+    ]
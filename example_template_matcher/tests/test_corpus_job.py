@@ -0,0 +1,118 @@
+# test_corpus_job.py
+
+import json
+import os
+import shutil
+import pytest
+from conftest import TEMPLATES_PATH, LEAN_EXAMPLE_PATH
+from corpus_job import CorpusJob, Journal
+from declaration_index import open_declaration_index
+from error_log import ErrorLog
+from translate_file import translate_corpus
+
+def write_split_example(source_dir):
+    """Split lean_example.lean so that b.lean obtains from a theorem declared in a.lean."""
+    with open(LEAN_EXAMPLE_PATH, 'r', encoding='utf-8') as file:
+        lines = file.read().splitlines(keepends=True)
+    os.makedirs(source_dir)
+    with open(os.path.join(source_dir, "a.lean"), 'w', encoding='utf-8') as file:
+        file.writelines(lines[:38])  # exists_infinite_primes
+    with open(os.path.join(source_dir, "b.lean"), 'w', encoding='utf-8') as file:
+        file.writelines(lines[18:25] + lines[39:46])  # not_bddAbove_setOf_prime, which obtains from it
+
+def run_job(tmp_path) -> dict:
+    job = CorpusJob(
+        str(tmp_path / "src"), TEMPLATES_PATH, str(tmp_path / "out"), max_workers=1,
+        cache_dir=str(tmp_path / "cache"), error_log=ErrorLog(), progress_interval=0,
+        index_path=str(tmp_path / "declarations.idx"),
+    )
+    summary = job.run()
+    summary["failed_names"] = [record["name"] for record in job.error_log.records]
+    return summary
+
+def read(path) -> str:
+    with open(path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+def test_resume_redoes_files_whose_index_lookups_changed(tmp_path):
+    write_split_example(tmp_path / "src")
+
+    # The first run has no index yet, so b.lean cannot resolve exists_infinite_primes
+    first = run_job(tmp_path)
+    assert first["translated"] == 2 and first["failed_names"] == ["not_bddAbove_setOf_prime"]
+    assert "Untranslated" in read(tmp_path / "out" / "b.tex")
+
+    # The index now has it, so only b.lean is redone, and it matches a run over the whole corpus
+    second = run_job(tmp_path)
+    assert second["skipped"] == 1 and second["translated"] == 1 and second["failed_names"] == []
+    translate_corpus(str(tmp_path / "src"), TEMPLATES_PATH, str(tmp_path / "reference"), 1,
+                     error_log=ErrorLog(), index_path=str(tmp_path / "declarations.idx"))
+    assert read(tmp_path / "out" / "b.tex") == read(tmp_path / "reference" / "b.tex")
+    assert "By exists_infinite_primes" in read(tmp_path / "out" / "b.tex")
+
+    # Nothing changed since, so nothing is redone
+    assert run_job(tmp_path)["translated"] == 0
+
+def test_resume_redoes_files_when_a_used_declaration_changes(tmp_path):
+    write_split_example(tmp_path / "src")
+    run_job(tmp_path)
+    run_job(tmp_path)
+
+    # Changing a.lean changes exists_infinite_primes in the index, which b.lean looked up
+    with open(tmp_path / "src" / "a.lean", 'a', encoding='utf-8') as file:
+        file.write("\ntheorem extra (n : ℕ) : n ≤ n := le_refl n\n")
+    assert run_job(tmp_path)["translated"] == 1  # a.lean, whose declaration kept its translation
+    with open(tmp_path / "src" / "a.lean", 'r', encoding='utf-8') as file:
+        content = file.read().replace("∃ p, n ≤ p ∧ Prime p", "∃ p, n < p ∧ Prime p")
+    with open(tmp_path / "src" / "a.lean", 'w', encoding='utf-8') as file:
+        file.write(content)
+    assert run_job(tmp_path)["translated"] == 1  # a.lean
+    assert run_job(tmp_path)["translated"] == 1  # b.lean, in the run after the index changed
+    assert run_job(tmp_path)["translated"] == 0
+
+def test_deleted_files_leave_the_index(tmp_path):
+    write_split_example(tmp_path / "src")
+    run_job(tmp_path)
+    run_job(tmp_path)
+    os.remove(tmp_path / "src" / "a.lean")
+
+    # The run after a.lean is deleted drops its declarations from the index
+    assert run_job(tmp_path)["translated"] == 0
+    index = open_declaration_index(str(tmp_path / "declarations.idx"))
+    assert {record["file"] for record in index.records()} == {str(tmp_path / "src" / "b.lean")}
+    assert index.lookup("exists_infinite_primes") is None
+    index.close()
+
+    # so b.lean, which obtains from exists_infinite_primes, is redone in the next one
+    summary = run_job(tmp_path)
+    assert summary["translated"] == 1 and summary["failed_names"] == ["not_bddAbove_setOf_prime"]
+
+def test_failure_without_error_log_cancels_pending_files(tmp_path):
+    # b.lean cannot resolve exists_infinite_primes without an index, so it raises
+    write_split_example(tmp_path / "split")
+    os.makedirs(tmp_path / "src")
+    shutil.copy(tmp_path / "split" / "b.lean", tmp_path / "src" / "a_fails.lean")
+    for k in range(20):
+        shutil.copy(tmp_path / "split" / "a.lean", tmp_path / "src" / f"b{k:02d}.lean")
+
+    job = CorpusJob(str(tmp_path / "src"), TEMPLATES_PATH, str(tmp_path / "out"), max_workers=1)
+    with pytest.raises(AttributeError):
+        job.run()
+    # Only the files already handed to the worker were translated
+    assert len([name for name in os.listdir(tmp_path / "out") if name.endswith(".tex")]) < 5
+
+def test_journal_skips_torn_last_line(tmp_path):
+    path = str(tmp_path / "job.journal")
+    journal = Journal(path)
+    journal.append({"file": "a.lean", "output": "a.tex", "source_hash": "s", "templates_hash": "t"})
+    journal.close()
+    with open(path, 'a', encoding='utf-8') as file:
+        file.write('{"file": "b.lean", "outp')
+
+    journal = Journal(path)
+    assert list(journal.completed) == ["a.lean"]
+    journal.append({"file": "c.lean", "output": "c.tex", "source_hash": "s", "templates_hash": "t"})
+    journal.close()
+    with open(path, 'r', encoding='utf-8') as file:
+        lines = file.read().splitlines()
+    assert json.loads(lines[-1])["file"] == "c.lean"
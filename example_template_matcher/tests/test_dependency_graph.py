@@ -0,0 +1,96 @@
+# test_dependency_graph.py
+
+import random
+import pytest
+from conftest import TEMPLATES_PATH, LEAN_EXAMPLE_PATH
+from dependency_graph import DependencyGraph, ParallelTranslator
+from error_log import ErrorLog
+from file_cleaner import replace_intro_variable_in_statement, clean_statement
+from instrumentation import Instrumentation
+from lean_fuzz import files
+from pipeline import Pipeline, iter_translations, load_template_dict
+from statement_translator import StatementTranslator, TranslatorConfig
+from template_trie import TemplateTrie
+from text_compiler import compile_output
+from translation_cache import TranslationCache
+
+@pytest.fixture(scope="module")
+def config():
+    return TranslatorConfig(load_template_dict(TEMPLATES_PATH))
+
+def translate_sequentially(config, statements: list) -> list:
+    statement_translator = StatementTranslator(None, config=config)
+    output = []
+    try:
+        for statement in statements:
+            cleaned_statement = clean_statement(replace_intro_variable_in_statement(statement_translator(statement)))
+            output.append((cleaned_statement, compile_output([cleaned_statement])))
+    except Exception as e:
+        output.append(("error", type(e).__name__, str(e)))
+    return output
+
+def translate_in_parallel(parallel_translator, statements: list) -> list:
+    output = []
+    try:
+        for _, cleaned_statement, latex in parallel_translator.translate(statements):
+            output.append((cleaned_statement, latex))
+    except Exception as e:
+        output.append(("error", type(e).__name__, str(e)))
+    return output
+
+def test_dependency_graph():
+    statements = [
+        "theorem a (n : ℕ) : Prime n := rfl",
+        "theorem b (n : ℕ) : Prime n := by\n  obtain ⟨p, hp⟩ := a n",
+        "theorem c (n : ℕ) : Prime n := rfl",
+        "theorem d (n : ℕ) : Prime n := by\n  exact ⟨b, c⟩",
+    ]
+    graph = DependencyGraph(statements)
+    assert graph.levels == [0, 1, 0, 2]
+    assert graph.closure(3) == [0, 1, 2]
+    assert graph.waves() == [[0, 2], [1], [3]]
+
+def test_parallel_matches_sequential(config):
+    parallel_translator = ParallelTranslator(config, max_workers=2)
+    try:
+        for statements in files(random.Random(1), 40):
+            assert translate_in_parallel(parallel_translator, statements) == translate_sequentially(config, statements)
+    finally:
+        parallel_translator.close()
+    assert parallel_translator.reused > 0
+
+def test_resilient_parallel_matches_resilient_sequential(config):
+    for statements in files(random.Random(2), 30):
+        text = "\n\n".join(statements)
+        sequential_log, parallel_log = ErrorLog(), ErrorLog()
+        expected = list(iter_translations(text.splitlines(), config, error_log=sequential_log))
+        parallel_translator = ParallelTranslator(config, max_workers=2, error_log=parallel_log)
+        try:
+            assert list(parallel_translator.translate([statement for statement, _, _ in expected])) == expected
+        finally:
+            parallel_translator.close()
+        assert parallel_log.records == sequential_log.records
+
+def test_pipeline_keeps_one_pool_and_config(config):
+    with open(LEAN_EXAMPLE_PATH, 'r', encoding='utf-8') as file:
+        text = file.read()
+    pipeline = Pipeline(config, parallel_declarations=True, max_workers=1)
+    try:
+        expected = Pipeline(config).translate(text).to_dict()
+        assert pipeline.translate(text).to_dict() == expected
+        executor = pipeline.parallel_translator.executor
+        assert pipeline.translate(text).to_dict() == expected
+        assert pipeline.parallel_translator.executor is executor
+        assert pipeline.parallel_translator.config is config
+    finally:
+        pipeline.close()
+
+def test_parallel_needs_templates_workers_can_load(config):
+    with pytest.raises(ValueError):
+        ParallelTranslator(TemplateTrie({}))
+
+def test_parallel_pipeline_rejects_cache_and_instrumentation(tmp_path, config):
+    with pytest.raises(ValueError):
+        Pipeline(config, parallel_declarations=True, translation_cache=TranslationCache(str(tmp_path), "t", "o"))
+    with pytest.raises(ValueError):
+        Pipeline(config, parallel_declarations=True, instrumentation=Instrumentation())
@@ -0,0 +1,47 @@
+# test_file_cleaner.py
+
+import re
+import pytest
+from file_cleaner import OutputCleaner, clean_lean_source, clean_statement
+
+def test_built_in_rules():
+    assert clean_statement("a because because and b , c .") == "a because b, c."
+    assert clean_statement("((p prime)) and (n + 1)") == "p prime and (n + 1)"
+
+def test_extra_rules_take_precedence_over_built_in_rules():
+    # Both start where the built-in punctuation or "because" rule would match
+    cleaner = OutputCleaner([(r"\s+,", " ;"), (r"because because", "since")])
+    assert cleaner.clean("a , b because because c") == "a ; b since c"
+    # The built-in rules still apply wherever no extra rule matches
+    assert cleaner.clean("a because  because and b .") == "a because b."
+
+def test_extra_rule_replacement_functions():
+    cleaner = OutputCleaner([(r"\bn\+1\b", lambda match: "the successor of n")])
+    assert cleaner.clean("(n+1) is prime , ok") == "(the successor of n) is prime, ok"
+
+def test_extra_rules_with_backreferences():
+    cleaner = OutputCleaner([(r"(\w+) \1\b", r"\1"), (r"(a)(b)?(?(2)c|d) \1", "X")])
+    assert cleaner.clean("the the cat , ok") == re.sub(r"(\w+) \1\b", r"\1", "the the cat") + ", ok"
+    assert cleaner.clean("ad a abc a ab a") == "X X ab a"
+
+    # Escaped backslashes and octal escapes in classes are not references
+    cleaner = OutputCleaner([(r"(x)", "y"), (r"\\1 [\1]", "Z")])
+    assert cleaner.clean("x \\1 \x01") == "y Z"
+
+def test_extra_rules_referring_past_group_99():
+    with pytest.raises(ValueError, match="past 99"):
+        OutputCleaner([("(a)" * 99, ""), (r"(b)\1", "")])
+
+def test_unmatched_quote_ends_with_its_line():
+    source = (
+        'theorem a : x = "-- kept" := b -- dropped\n'
+        'theorem b : y = "open -- kept\n'
+        'theorem c : n.succ > 0 := (h).1 -- dropped\n'
+        '/- dropped -/ theorem d : z := e'
+    )
+    assert clean_lean_source(source, ["import"]).splitlines() == [
+        'theorem a : x = "-- kept" := b',
+        'theorem b : y = "open -- kept',
+        "theorem c : (n+1) > 0 := (h)",
+        " theorem d : z := e",
+    ]
@@ -0,0 +1,77 @@
+# test_operators.py
+
+import pytest
+from conftest import TEMPLATES_PATH
+from operators import OPERATORS, find_set, get_operator, multi_swap, negate_inequality
+from pipeline import load_template_dict
+from statement_translator import StatementTranslator
+
+# Outputs and errors below were recorded before the operator registry was added
+
+@pytest.fixture(scope="module")
+def template_dict():
+    template_dict = load_template_dict(TEMPLATES_PATH)
+    template_dict["bad_op"] = {"expression": "bad_op", "variables": 0, "template": "{s1, nope} x"}
+    template_dict["deep"] = {
+        "expression": "deep", "variables": 1,
+        "template": "{s3} and {0} and {s1, find_set} {s2, negate_inequality}",
+    }
+    template_dict["neg"] = {"expression": "neg", "variables": 1, "template": "not {s1, negate_inequality} by {0}"}
+    return template_dict
+
+def test_registry():
+    assert set(OPERATORS) == {"negate_inequality", "find_set"}
+    assert get_operator("find_set") is find_set
+    with pytest.raises(AttributeError, match="Operation 'multi_swap' not found in operations module"):
+        get_operator("multi_swap")
+
+@pytest.mark.parametrize("statement, negated, found_set", [
+    ("a ≤ b", "a > b", ""),
+    ("a > b ≥ c < d", "a ≤ b < c ≥ d", ""),
+    ("≤≤>", ">>≤", ""),
+    ("{x | x > 0} ∪ {y}", "{x | x ≤ 0} ∪ {y}", "{x | x > 0}"),
+    ("no braces", "no braces", ""),
+    ("{a {b} c}", "{a {b} c}", "{a {b} c}"),
+    ("{", "{", ""),
+    ("}{", "}{", ""),
+])
+def test_operators(statement, negated, found_set):
+    assert negate_inequality(statement) == negated
+    assert find_set(statement) == found_set
+
+def test_multi_swap_is_simultaneous():
+    assert multi_swap("ab ba abab", (("ab", "ba"), ("ba", "ab"))) == "ba ab baba"
+    assert multi_swap("a ≤ b", (("≤", ">"), (">", "≤"))) == "a > b"
+    assert multi_swap("a ≤ b", [["≤", ">"], [">", "≤"]]) == "a > b"
+
+@pytest.mark.parametrize("statement, error_type, message", [
+    ("theorem a (n : ℕ) : n ≤ m := bad_op", AttributeError, "Operation 'nope' not found in operations module"),
+    ("theorem a : x := deep y", ValueError, "Stack does not contain s2: Cannot peek s2: stack has only 1 items."),
+    (
+        "theorem a : {s1} := x\n  have h : n < p := deep {s1, find_set}\n  have g : p ≥ 1 := deep {s1 | p}",
+        ValueError, "Invalid command format: {s1 , find_set}",
+    ),
+    ("theorem a : {s2, multi_swap} := x", ValueError, "Invalid command format: {s2 , multi_swap}"),
+])
+def test_reference_errors(template_dict, statement, error_type, message):
+    with pytest.raises(error_type) as error:
+        StatementTranslator(template_dict)(statement)
+    assert str(error.value) == message
+
+@pytest.mark.parametrize("statement, translation", [
+    (
+        "theorem a (n : ℕ) : {x | x ≤ n} := b\n  have h : p ≥ n := q\n  have g : n < p := deep h",
+        "theorem a Let n be in ℕ. Then {x | x ≤ n} , because b\n  we claim p ≥ n , because q\n"
+        "  we claim n < p , because {s3} and and p ≥ n and p < n",
+    ),
+    (
+        "theorem a (n : ℕ) : n ≤ p := neg h\n  have g : p > n := neg g",
+        "theorem a Let n be in ℕ. Then n ≤ p , because not n > p by h\n  we claim p > n , because not p ≤ n by g",
+    ),
+    (
+        "theorem a (n : ℕ) : n ≤ p := b\n  have g : p > n := neg {s1}",
+        "theorem a Let n be in ℕ. Then n ≤ p , because b\n  we claim p > n , because not p ≤ n by {s1}",
+    ),
+])
+def test_reference_translations(template_dict, statement, translation):
+    assert StatementTranslator(template_dict)(statement) == translation
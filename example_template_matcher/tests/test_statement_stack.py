@@ -0,0 +1,120 @@
+# test_statement_stack.py
+
+import random
+import pytest
+from persistent_map import PersistentMap
+from statement_stack import PersistentStatementStack, StackItem, StatementStack
+
+NAMES = "abcde"
+TAGS = ["let", "have", "fun", "def"]
+
+class ListStack:
+    """The stack as a plain list of dicts, searched linearly, as it was before it was indexed."""
+
+    def __init__(self):
+        self.items = []
+
+    def add(self, item: dict):
+        self.items.append(item)
+
+    def prune(self, spaces: int):
+        self.items = [item for item in self.items if item["spaces"] <= spaces]
+
+    def get(self, name: str):
+        return next((item for item in self.items if item["name"] == name), None)
+
+    def get_statement(self, name: str, ignore_defs: bool):
+        for item in self.items:
+            if item["name"] == name and not (ignore_defs and item["tag"] in ["let", "def"]):
+                return item["statement"]
+        return None
+
+    def prev_name(self, spaces: int):
+        return next((item["name"] for item in reversed(self.items) if item["spaces"] == spaces), None)
+
+    def edit(self, name: str, **changes) -> bool:
+        item = self.get(name)
+        if item is None:
+            return False
+        item.update(changes)
+        return True
+
+def check_against(stack, reference: ListStack, rng):
+    name = rng.choice(NAMES)
+    item = stack.get_by_name(name)
+    expected = reference.get(name)
+    assert (item.statement if item else None) == (expected["statement"] if expected else None)
+    assert stack.get_statement_by_name(name, True) == reference.get_statement(name, True)
+    assert stack.get_statement_by_name(name) == reference.get_statement(name, False)
+    spaces = rng.choice([-1, 0, 2, 4, 6])
+    assert stack.get_prev_name_by_spacing(spaces) == reference.prev_name(spaces)
+    assert stack.size() == len(reference.items)
+    for n in range(1, len(reference.items) + 1):
+        assert stack.peek_n(n) == reference.items[-n]["statement"]
+
+@pytest.mark.parametrize("stack_class", [StatementStack, PersistentStatementStack])
+def test_stack_matches_list(stack_class):
+    rng = random.Random(5)
+    for _ in range(300):
+        stack = stack_class()
+        reference = ListStack()
+        for count in range(60):
+            operation = rng.random()
+            if operation < 0.4:
+                # Items may be pushed with less indentation than the one below
+                fields = dict(spaces=rng.choice([-1, 0, 2, 4, 6]), tag=rng.choice(TAGS), name=rng.choice(NAMES),
+                              statement=f"s{count}")
+                stack.add_to_stack(StackItem(**fields))
+                reference.add(fields)
+            elif operation < 0.55:
+                spaces = rng.choice([0, 2, 4])
+                stack.prune_stack(spaces)
+                reference.prune(spaces)
+            elif operation < 0.6 and reference.items:
+                assert stack.remove_from_stack().statement == reference.items.pop()["statement"]
+            elif operation < 0.65:
+                name, statement = rng.choice(NAMES), f"edited {count}"
+                assert stack.edit_item_by_name(name, statement=statement) == reference.edit(name, statement=statement)
+            check_against(stack, reference, rng)
+
+@pytest.mark.parametrize("stack_class", [StatementStack, PersistentStatementStack])
+def test_snapshots_are_unchanged_by_later_edits(stack_class):
+    rng = random.Random(6)
+    def state(stack):
+        return [item.fingerprint() for item in stack.items]
+
+    for _ in range(200):
+        stack = stack_class()
+        snapshots = []
+        for count in range(60):
+            operation = rng.random()
+            if operation < 0.4:
+                stack.add_to_stack(StackItem(rng.choice([0, 2, 4, 6]), "have", rng.choice(NAMES), f"s{count}"))
+            elif operation < 0.55:
+                stack.prune_stack(rng.choice([0, 2, 4]))
+            elif operation < 0.65:
+                stack.edit_item_by_name(rng.choice(NAMES), statement=f"edited {count}", exists=["p"])
+            elif operation < 0.75:
+                snapshots.append((stack.snapshot(), state(stack)))
+            elif operation < 0.85 and snapshots:
+                snapshot, expected = rng.choice(snapshots)
+                stack.restore(snapshot)
+                assert state(stack) == expected
+
+            for snapshot, expected in snapshots:
+                restored = stack_class()
+                restored.restore(snapshot)
+                assert state(restored) == expected
+
+def test_persistent_map_matches_dict():
+    rng = random.Random(7)
+    versions = [(PersistentMap(), {})]
+    for _ in range(3000):
+        persistent_map, expected = rng.choice(versions)
+        key, value = rng.randrange(200), rng.random()
+        versions.append((persistent_map.set(key, value), {**expected, key: value}))
+    for persistent_map, expected in versions[::50]:
+        assert len(persistent_map) == len(expected)
+        for key in range(200):
+            assert (key in persistent_map) == (key in expected)
+            assert persistent_map.get(key) == expected.get(key)
@@ -0,0 +1,68 @@
+# test_statement_translator.py
+
+import json
+import os
+import pytest
+from conftest import TEMPLATES_PATH, LEAN_EXAMPLE_PATH
+from instrumentation import Instrumentation
+from pipeline import Pipeline, load_template_dict
+from statement_translator import SUB_EXPRESSION_CACHE_SIZE, StatementTranslator, TranslatorConfig
+from translate_file import main
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# Fuzzed files (see lean_fuzz.py), balanced and unbalanced, with the translation or error of
+# each statement as recorded before match_templates was driven by a cursor
+with open(os.path.join(DATA_DIR, "translations.jsonl"), encoding="utf-8") as file:
+    RECORDED_CASES = [json.loads(line) for line in file]
+
+@pytest.fixture(scope="module")
+def config():
+    return TranslatorConfig(load_template_dict(TEMPLATES_PATH))
+
+def translate(config, statements: list) -> list:
+    statement_translator = StatementTranslator(None, config=config)
+    translations = []
+    for statement in statements:
+        try:
+            translations.append(statement_translator(statement))
+        except Exception as e:
+            translations.append({"error": type(e).__name__, "message": str(e)})
+    return translations
+
+@pytest.mark.parametrize("case", range(len(RECORDED_CASES)))
+def test_translations_match_recorded(config, case):
+    recorded = RECORDED_CASES[case]
+    assert translate(config, recorded["statements"]) == recorded["translations"]
+
+def test_recorded_cases_cover_errors_and_translations():
+    translations = [translation for case in RECORDED_CASES for translation in case["translations"]]
+    assert {translation["error"] for translation in translations if isinstance(translation, dict)} == {
+        "AttributeError", "IndexError", "ValueError",
+    }
+    assert sum(isinstance(translation, str) for translation in translations) > 250
+
+def test_lean_example_output_matches_recorded(capsys):
+    main(LEAN_EXAMPLE_PATH, TEMPLATES_PATH)
+    with open(os.path.join(DATA_DIR, "lean_example.txt"), encoding="utf-8") as file:
+        assert capsys.readouterr().out == file.read()
+
+def test_sub_expression_cache_stats_are_counted(config):
+    with open(LEAN_EXAMPLE_PATH, encoding="utf-8") as file:
+        text = file.read()
+
+    counters = {}
+    for cache_size in [SUB_EXPRESSION_CACHE_SIZE, 2, 0]:
+        instrumentation = Instrumentation()
+        pipeline = Pipeline(config, instrumentation=instrumentation, cache_size=cache_size)
+        assert pipeline.translate(text + "\n" + text).latex
+        counters[cache_size] = {
+            name: n for name, n in instrumentation.report()["counters"].items() if name.startswith("sub_expression_cache.")
+        }
+
+    # The second copy of the text hits what the first one cached, unless a small cache evicted it
+    default = counters[SUB_EXPRESSION_CACHE_SIZE]
+    assert default["sub_expression_cache.hits"] > 0 and default["sub_expression_cache.evictions"] == 0
+    assert counters[2]["sub_expression_cache.evictions"] > 0
+    assert counters[2]["sub_expression_cache.hits"] < default["sub_expression_cache.hits"]
+    assert counters[0] == {}
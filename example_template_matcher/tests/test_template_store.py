@@ -0,0 +1,132 @@
+# test_template_store.py
+
+import json
+import os
+import random
+import pytest
+from conftest import TEMPLATES_PATH
+from compiled_template import compile_templates
+from lean_fuzz import files
+from pipeline import load_template_dict
+from statement_translator import StatementTranslator, TranslatorConfig
+from template_store import (
+    HEADER, STORE_FORMAT_VERSION, StaleTemplateStore, TemplateStore, build_template_store, load_template_store,
+)
+from template_trie import TemplateTrie
+
+COMPONENTS = ["Mathlib", "Nat", "Prime", "succ", "Finset", "card", "x"]
+WORDS = ["∀", "∃", "¬", "∈", "x", "n", ",", ":=", "(", "Prime", "Nat.Prime", "succ"]
+
+def random_token(rng) -> str:
+    if rng.random() < 0.4:
+        return ".".join(rng.choice(COMPONENTS) for _ in range(rng.randint(2, 4)))
+    return rng.choice(WORDS + COMPONENTS)
+
+def random_templates(rng, count: int) -> list:
+    """Templates with namespace-qualified first tokens and multi-token expressions, some repeated."""
+    return [
+        {
+            "expression": " ".join(random_token(rng) for _ in range(rng.choices([1, 2, 3], [3, 2, 1])[0])),
+            "variables": 0,
+            "template": f"template {k}",
+        }
+        for k in range(count)
+    ]
+
+def match_result(match):
+    if match is None:
+        return None
+    template, length = match
+    return template.expression, template.template, template.arity, length
+
+def write_templates(path, templates: list) -> str:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(templates, file, ensure_ascii=False)
+    return str(path)
+
+@pytest.mark.parametrize("seed", range(4))
+def test_store_matches_trie(tmp_path, seed):
+    rng = random.Random(seed)
+    templates = random_templates(rng, 150)
+    templates_path = write_templates(tmp_path / "templates.json", templates)
+    build_template_store(templates_path, str(tmp_path / "templates.store"))
+    store = TemplateStore.open(str(tmp_path / "templates.store"), templates_path)
+    trie = TemplateTrie(compile_templates(load_template_dict(templates_path)))
+
+    # Sequences mix random tokens with expressions, whole or cut short
+    expressions = [template["expression"].split() for template in templates]
+    lengths = []
+    for _ in range(5000):
+        tokens = []
+        length = rng.randint(1, 6)
+        while len(tokens) < length:
+            if rng.random() < 0.3:
+                expression = rng.choice(expressions)
+                tokens.extend(expression[:rng.randint(1, len(expression))])
+            else:
+                tokens.append(random_token(rng))
+        start = rng.randrange(len(tokens))
+        expected = match_result(trie.match(tokens, start))
+        assert match_result(store.match(tokens, start)) == expected
+        lengths.append(expected[3] if expected else 0)
+    assert lengths.count(2) > 100 and lengths.count(3) > 10
+    store.close()
+
+def test_translations_match_with_store(tmp_path):
+    store = load_template_store(TEMPLATES_PATH, str(tmp_path / "templates.store"))
+    with_dict = TranslatorConfig.for_templates(load_template_dict(TEMPLATES_PATH))
+    with_store = TranslatorConfig.for_templates(store)
+
+    def translate(config, statements: list) -> list:
+        statement_translator = StatementTranslator(None, config=config)
+        translations = []
+        for statement in statements:
+            try:
+                translations.append(statement_translator(statement))
+            except Exception as e:
+                translations.append(("error", type(e).__name__, str(e)))
+        return translations
+
+    for statements in files(random.Random(14), 100):
+        assert translate(with_store, statements) == translate(with_dict, statements)
+    store.close()
+
+def test_store_is_rebuilt_only_when_templates_change(tmp_path):
+    templates = random_templates(random.Random(0), 20)
+    templates_path = write_templates(tmp_path / "templates.json", templates)
+    store_path = str(tmp_path / "templates.store")
+    load_template_store(templates_path, store_path).close()
+
+    # Touching the templates leaves the store current, since the hash still matches
+    stat = os.stat(store_path)
+    os.utime(templates_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    load_template_store(templates_path, store_path).close()
+    assert os.stat(store_path).st_mtime_ns == stat.st_mtime_ns
+
+    # Changed templates make the old store stale, and loading rebuilds it
+    templates[0] = {"expression": "changed", "variables": 0, "template": "changed"}
+    write_templates(tmp_path / "templates.json", templates)
+    with pytest.raises(StaleTemplateStore):
+        TemplateStore.open(store_path, templates_path)
+    store = load_template_store(templates_path, store_path)
+    assert match_result(store.match(["changed"])) == ("changed", "changed", 0, 1)
+    store.close()
+
+def test_store_of_another_format_is_rebuilt(tmp_path):
+    store_path = str(tmp_path / "templates.store")
+    build_template_store(TEMPLATES_PATH, store_path)
+    with open(store_path, "r+b") as file:
+        magic, _, *rest = HEADER.unpack(file.read(HEADER.size))
+        file.seek(0)
+        file.write(HEADER.pack(magic, STORE_FORMAT_VERSION + 1, *rest))
+    with pytest.raises(StaleTemplateStore):
+        TemplateStore(store_path)
+    store = load_template_store(TEMPLATES_PATH, store_path)
+    assert len(store) == len(load_template_dict(TEMPLATES_PATH))
+    store.close()
+
+    with open(store_path, "wb") as file:
+        file.write(b"not a store")
+    store = load_template_store(TEMPLATES_PATH, store_path)
+    assert len(store) == len(load_template_dict(TEMPLATES_PATH))
+    store.close()
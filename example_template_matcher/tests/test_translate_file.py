@@ -0,0 +1,40 @@
+# test_translate_file.py
+
+import os
+import pytest
+from conftest import TEMPLATES_PATH, LEAN_EXAMPLE_PATH
+from translate_file import _init_corpus_worker, _translate_corpus_file, main
+
+def test_corpus_file_reports_missing_source(tmp_path):
+    _init_corpus_worker(TEMPLATES_PATH)
+    output_path = str(tmp_path / "out" / "missing.tex")
+    with pytest.raises(FileNotFoundError) as error:
+        _translate_corpus_file(str(tmp_path / "missing.lean"), output_path)
+    assert error.value.filename.endswith("missing.lean")
+    assert os.listdir(tmp_path / "out") == []
+
+def test_corpus_file_leaves_no_partial_output(tmp_path, monkeypatch):
+    _init_corpus_worker(TEMPLATES_PATH)
+    output_path = str(tmp_path / "out" / "example.tex")
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr("translate_file.LatexEmitter.emit", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        _translate_corpus_file(LEAN_EXAMPLE_PATH, output_path)
+    assert os.listdir(tmp_path / "out") == []
+
+def test_main_reports_missing_source(tmp_path, capsys):
+    main(str(tmp_path / "missing.lean"), TEMPLATES_PATH, output_path=str(tmp_path / "out.tex"))
+    assert capsys.readouterr().out == f"File {tmp_path / 'missing.lean'} not found.\n"
+    assert not os.path.exists(tmp_path / "out.tex")
+
+def test_main_surfaces_output_errors(tmp_path, capsys):
+    output_path = str(tmp_path / "missing_dir" / "out.tex")
+    with pytest.raises(FileNotFoundError) as error:
+        main(LEAN_EXAMPLE_PATH, TEMPLATES_PATH, output_path=output_path, quiet=True)
+    assert error.value.filename == output_path
+    assert "not found" not in capsys.readouterr().out
+
+    (tmp_path / "taken").write_text("")
+    with pytest.raises(NotADirectoryError):
+        main(LEAN_EXAMPLE_PATH, TEMPLATES_PATH, fragments_dir=str(tmp_path / "taken"), quiet=True)
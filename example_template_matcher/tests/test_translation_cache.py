@@ -0,0 +1,131 @@
+# test_translation_cache.py
+
+import json
+import random
+import pytest
+from conftest import TEMPLATES_PATH, LEAN_EXAMPLE_PATH
+from declaration_index import build_declaration_index, declaration_records, open_declaration_index
+from lean_fuzz import file_statements, files
+from pipeline import Pipeline, iter_translations, load_template_dict, make_translator
+from statement_translator import StatementTranslator, TranslatorConfig
+from translation_cache import TranslationCache
+
+@pytest.fixture(scope="module")
+def config():
+    return TranslatorConfig(load_template_dict(TEMPLATES_PATH))
+
+def translate(config, statements: list, translation_cache: TranslationCache = None) -> tuple:
+    """Translate statements up to the first error, returning the translations and the final stack."""
+    statement_translator = StatementTranslator(None, config=config)
+    translations = []
+    for statement in statements:
+        try:
+            if translation_cache is not None:
+                translations.append(translation_cache.translate(statement_translator, statement))
+            else:
+                translations.append(statement_translator(statement))
+        except Exception as e:
+            translations.append(("error", type(e).__name__, str(e)))
+            break
+    return translations, [item.fingerprint() for item in statement_translator.statement_stack.items]
+
+def test_cached_translations_match_uncached(tmp_path, config):
+    translation_cache = TranslationCache(str(tmp_path), "templates", "operators")
+    for statements in files(random.Random(11), 80):
+        expected = translate(config, statements)
+        assert translate(config, statements, translation_cache) == expected
+
+        # Every statement that translated is now a hit
+        hits = translation_cache.hits
+        assert translate(config, statements, translation_cache) == expected
+        num_translated = sum(isinstance(translation, str) for translation in expected[0])
+        assert translation_cache.hits - hits == num_translated
+
+def test_edited_files_match_uncached(tmp_path, config):
+    rng = random.Random(12)
+    translation_cache = TranslationCache(str(tmp_path), "templates", "operators")
+    num_checked = 0
+    for _ in range(60):
+        statements = file_statements(rng, rng.randint(2, 8))
+        translate(config, statements, translation_cache)
+
+        # Replace declarations one at a time, so later ones may depend on a changed one
+        for _ in range(3):
+            statements[rng.randrange(len(statements))] = file_statements(rng, 1)[0]
+            assert translate(config, statements, translation_cache) == translate(config, statements)
+            num_checked += 1
+    assert num_checked == 180 and translation_cache.hits > 150
+
+def test_changed_declaration_invalidates_dependents(tmp_path, config):
+    translation_cache = TranslationCache(str(tmp_path), "templates", "operators")
+    statements = [
+        "theorem first (n : ℕ) : ∃ p, n ≤ p ∧ Prime p :=\n  let p := minFac (n ! + 1)\n  have np : n ≤ p := le_of_not_ge\n"
+        "  have pp : Prime p := minFac_prime\n  ⟨p, np, pp⟩",
+        "theorem second (n : ℕ) : ∃ p, n ≤ p :=\n  obtain ⟨p, hi, hp⟩ := first n\n  exact ⟨p, hp, hi⟩",
+        "theorem third (n : ℕ) : ∃ p, n < p :=\n  minFac n",
+    ]
+    translate(config, statements, translation_cache)
+    statements[0] = statements[0].replace("have np : n ≤ p", "have np : p ≤ n")
+
+    # first and second, which obtains from it, are translated again, while third is reused
+    hits, misses = translation_cache.hits, translation_cache.misses
+    expected = translate(config, statements)
+    assert all(isinstance(translation, str) for translation in expected[0])
+    assert translate(config, statements, translation_cache) == expected
+    assert (translation_cache.hits - hits, translation_cache.misses - misses) == (1, 2)
+
+def test_other_templates_or_operators_miss(tmp_path, config):
+    statements = ["theorem a (n : ℕ) : ∃ p, Prime p :=\n  minFac n"]
+    translate(config, statements, TranslationCache(str(tmp_path), "templates", "operators"))
+    for translation_cache in [
+        TranslationCache(str(tmp_path), "other templates", "operators"),
+        TranslationCache(str(tmp_path), "templates", "other operators"),
+    ]:
+        translate(config, statements, translation_cache)
+        assert translation_cache.stats() == {"hits": 0, "misses": 1}
+
+    # Editing templates.json changes the key of every entry
+    templates_path = tmp_path / "templates.json"
+    with open(TEMPLATES_PATH, encoding="utf-8") as file:
+        templates = json.load(file)
+    templates_path.write_text(json.dumps(templates), encoding="utf-8")
+    translate(config, statements, TranslationCache.for_templates(str(tmp_path / "cache"), str(templates_path)))
+    templates[0]["template"] += " "
+    templates_path.write_text(json.dumps(templates), encoding="utf-8")
+    translation_cache = TranslationCache.for_templates(str(tmp_path / "cache"), str(templates_path))
+    translate(config, statements, translation_cache)
+    assert translation_cache.stats() == {"hits": 0, "misses": 1}
+
+def test_changed_index_declaration_invalidates_dependents(tmp_path):
+    with open(LEAN_EXAMPLE_PATH, 'r', encoding='utf-8') as file:
+        lines = file.read().splitlines()
+    a_lines = lines[:38]  # exists_infinite_primes
+    b_lines = lines[18:25] + lines[39:46]  # not_bddAbove_setOf_prime, which obtains from it
+    template_dict = load_template_dict(TEMPLATES_PATH)
+
+    # Index the declaration of a, then the same with another part in what it shows exists
+    a_translator = make_translator(template_dict)
+    list(iter_translations(a_lines, None, statement_translator=a_translator))
+    records = declaration_records(a_translator.statement_stack, "a.lean")
+    assert [record["name"] for record in records] == ["exists_infinite_primes"]
+    changed_records = [dict(record, exists=[part.replace("n ≤ p", "p ≤ n") for part in record["exists"]]) for record in records]
+
+    def translate_b(records: list, translation_cache: TranslationCache = None) -> list:
+        index_path = str(tmp_path / "declarations.idx")
+        build_declaration_index(index_path, records)
+        declaration_index = open_declaration_index(index_path)
+        pipeline = Pipeline(template_dict, translation_cache=translation_cache, declaration_index=declaration_index)
+        result = pipeline.translate("\n".join(b_lines))
+        declaration_index.close()
+        return [statement.translation for statement in result.statements]
+
+    translation_cache = TranslationCache(str(tmp_path / "cache"), "templates", "operators")
+    assert translate_b(records, translation_cache) == translate_b(records)
+    assert translate_b(records, translation_cache) == translate_b(records)
+    assert translation_cache.stats() == {"hits": 1, "misses": 1}
+
+    # The index now gives another declaration, so b is translated again
+    expected = translate_b(changed_records)
+    assert expected != translate_b(records)
+    assert translate_b(changed_records, translation_cache) == expected
+    assert translation_cache.stats() == {"hits": 1, "misses": 2}
@@ -0,0 +1,81 @@
+# test_translation_server.py
+
+import io
+import json
+import os
+import shutil
+import pytest
+from conftest import TEMPLATES_PATH, LEAN_EXAMPLE_PATH
+from translation_server import TranslationServer, INTERNAL_ERROR, TRANSLATION_ERROR
+
+# templates.json files that parse as JSON but do not have the shape of a template list
+MALFORMED_TEMPLATES = [
+    "[1]",
+    '[{"expression": "Prime", "variables": 1, "template": 5}]',
+]
+
+def make_server(tmp_path, store: bool = False) -> TranslationServer:
+    templates_path = str(tmp_path / "templates.json")
+    shutil.copy(TEMPLATES_PATH, templates_path)
+    return TranslationServer(templates_path, str(tmp_path / "templates.store") if store else None)
+
+def write_templates(server: TranslationServer, content: str):
+    """Replace templates.json, making sure the server sees it as changed."""
+    with open(server.templates_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    stat = os.stat(server.templates_path)
+    os.utime(server.templates_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+def request(server: TranslationServer, method: str, **params) -> dict:
+    return server.handle({"jsonrpc": "2.0", "id": 1, "method": method, "params": params})
+
+def test_translate():
+    server = TranslationServer(TEMPLATES_PATH)
+    with open(LEAN_EXAMPLE_PATH, 'r', encoding='utf-8') as file:
+        response = request(server, "translate", text=file.read())
+    assert "\\begin{theorem}[exists_infinite_primes]" in response["result"]["latex"]
+
+@pytest.mark.parametrize("store", [False, True])
+@pytest.mark.parametrize("content", MALFORMED_TEMPLATES)
+def test_malformed_templates_keep_old_ones(tmp_path, capsys, store, content):
+    server = make_server(tmp_path, store)
+    expected = request(server, "translate", text="theorem t (n : ℕ) : Prime n := by\n  intro n")
+    write_templates(server, content)
+
+    # The failed reload is reported once, and the old templates serve both requests
+    for _ in range(2):
+        assert request(server, "translate", text="theorem t (n : ℕ) : Prime n := by\n  intro n") == expected
+    assert server.reloads == 1
+    assert capsys.readouterr().err.count("Could not reload") == 1
+
+def test_reload_method_reports_malformed_templates(tmp_path):
+    server = make_server(tmp_path)
+    expected = request(server, "translate", text="theorem t (n : ℕ) : Prime n := rfl")
+    write_templates(server, MALFORMED_TEMPLATES[1])
+
+    response = request(server, "reload")
+    assert response["error"]["code"] == TRANSLATION_ERROR
+    assert "TypeError" in response["error"]["message"]
+    assert request(server, "translate", text="theorem t (n : ℕ) : Prime n := rfl") == expected
+
+def test_stdio_survives_malformed_templates(tmp_path):
+    server = make_server(tmp_path)
+    lines = [json.dumps({"jsonrpc": "2.0", "id": i, "method": method}) + "\n" for i, method in enumerate(["stats", "reload", "stats"])]
+
+    output = io.StringIO()
+    write_templates(server, MALFORMED_TEMPLATES[0])
+    server.serve_stdio(io.StringIO("".join(lines)), output)
+
+    responses = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [response["id"] for response in responses] == [0, 1, 2]
+    assert "error" in responses[1] and "result" in responses[2]
+
+def test_unexpected_errors_become_internal_errors(tmp_path):
+    server = make_server(tmp_path)
+    def broken_stats():
+        raise TypeError("broken")
+    server.stats = broken_stats
+
+    response = request(server, "stats")
+    assert response["error"] == {"code": INTERNAL_ERROR, "message": "TypeError: broken"}
+    assert request(server, "translate", text="theorem t : True := trivial")["result"]["statements"]
@@ -1,61 +1,208 @@
-def compile_output(theorem_list):
-    """Converts a list of structured theorem and proof statements into LaTeX formatted code."""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+def process_line(line):
+    """Capitalize the first letter and ensure the line ends with appropriate punctuation."""
+    line = line.strip()
+    if not line:
+        return ''
+    # Capitalize first character
+    line = line[0].upper() + line[1:]
+    # Check if the line ends with common punctuation
+    if not line.endswith(('.', ',', ';', ':')):
+        line += '.'
+    return line
+
+def compile_theorem(theorem_entry):
+    """Converts one structured theorem and its proof into a list of LaTeX lines."""
     output = []
+    lines = theorem_entry.split('\n')
+    in_proof = False
+    proof_paragraph = []  # Store all lines of the proof in a single paragraph
+
+    for line in lines:
+        stripped_line = line.lstrip()
+        if not stripped_line:
+            continue  # Skip empty lines
+
+        if stripped_line.startswith("theorem"):
+            if in_proof:
+                # Output the proof as a single paragraph
+                output.append("\\begin{proof}")
+                output.append(' '.join(proof_paragraph))
+                output.append("\\end{proof}\n")
+                # Reset proof state
+                proof_paragraph = []
+                in_proof = False
+
+            # Process theorem line: "theorem name statement"
+            parts = stripped_line.split(' ', 2)
+            if len(parts) < 3:
+                continue  # Invalid theorem format, skip
+            _, theorem_name, theorem_statement = parts
+            output.append(f"\\begin{{theorem}}[{theorem_name}]")
+            # Ensure the statement ends with appropriate punctuation
+            theorem_statement = process_line(theorem_statement)
+            output.append(theorem_statement)
+            output.append("\\end{theorem}\n")
+
+        elif line.lstrip():  # Any indented line is part of the proof
+            if not in_proof:
+                in_proof = True  # Mark that we're inside a proof
+            # Add the processed line to the proof paragraph
+            proof_paragraph.append(process_line(stripped_line))
+
+    # After processing all lines, check if there's an open proof
+    if in_proof:
+        output.append("\\begin{proof}")
+        output.append(' '.join(proof_paragraph))  # Output the entire proof as a single paragraph
+        output.append("\\end{proof}\n")
 
-    def process_line(line):
-        """Capitalize the first letter and ensure the line ends with appropriate punctuation."""
-        line = line.strip()
-        if not line:
-            return ''
-        # Capitalize first character
-        line = line[0].upper() + line[1:]
-        # Check if the line ends with common punctuation
-        if not line.endswith(('.', ',', ';', ':')):
-            line += '.'
-        return line
+    return output
 
+def compile_output(theorem_list):
+    """Converts a list of structured theorem and proof statements into LaTeX formatted code."""
+    output = []
     for theorem_entry in theorem_list:
-        lines = theorem_entry.split('\n')
-        in_proof = False
-        proof_paragraph = []  # Store all lines of the proof in a single paragraph
-
-        for line in lines:
-            stripped_line = line.lstrip()
-            if not stripped_line:
-                continue  # Skip empty lines
-
-            if stripped_line.startswith("theorem"):
-                if in_proof:
-                    # Output the proof as a single paragraph
-                    output.append("\\begin{proof}")
-                    output.append(' '.join(proof_paragraph))
-                    output.append("\\end{proof}\n")
-                    # Reset proof state
-                    proof_paragraph = []
-                    in_proof = False
-
-                # Process theorem line: "theorem name statement"
-                parts = stripped_line.split(' ', 2)
-                if len(parts) < 3:
-                    continue  # Invalid theorem format, skip
-                _, theorem_name, theorem_statement = parts
-                output.append(f"\\begin{{theorem}}[{theorem_name}]")
-                # Ensure the statement ends with appropriate punctuation
-                theorem_statement = process_line(theorem_statement)
-                output.append(theorem_statement)
-                output.append("\\end{theorem}\n")
-
-            elif line.lstrip():  # Any indented line is part of the proof
-                if not in_proof:
-                    in_proof = True  # Mark that we're inside a proof
-                # Add the processed line to the proof paragraph
-                proof_paragraph.append(process_line(stripped_line))
-
-        # After processing all lines, check if there's an open proof
-        if in_proof:
-            output.append("\\begin{proof}")
-            output.append(' '.join(proof_paragraph))  # Output the entire proof as a single paragraph
-            output.append("\\end{proof}\n")
+        output.extend(compile_theorem(theorem_entry))
 
     # Combine all parts into the final LaTeX code
     return '\n'.join(output)
+
+def compile_fallback(theorem_entry, message):
+    """Converts a declaration that could not be translated into LaTeX showing its Lean source, marked as untranslated."""
+    parts = theorem_entry.lstrip().split(' ', 2)
+    theorem_name = parts[1] if len(parts) > 1 else "untranslated"
+    output = [
+        f"% Untranslated: {message}",
+        f"\\begin{{theorem}}[{theorem_name}]",
+        "\\textbf{Untranslated.}",
+        "\\begin{verbatim}",
+        theorem_entry.strip('\n'),
+        "\\end{verbatim}",
+        "\\end{theorem}\n",
+    ]
+    return '\n'.join(output)
+
+
+class LatexEmitter:
+    """
+    Writes the LaTeX for each theorem to a file handle as soon as it is compiled.
+
+    The text written is the same as compile_output applied to every emitted theorem at once.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.started = False
+
+    def emit(self, theorem_entry, latex=None):
+        """Write one theorem, compiling it unless its LaTeX is given, and return the LaTeX."""
+        if latex is None:
+            latex = compile_output([theorem_entry])
+        if latex:
+            if self.started:
+                self.file.write('\n')
+            self.file.write(latex)
+            self.started = True
+        return latex
+
+    def close(self):
+        self.file.flush()
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def write_atomically(path, text):
+    """Replace the file at path with text, so readers never see a partial file."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class FragmentEmitter:
+    """
+    Writes each theorem to a fragment file of its own, plus a master file that inputs them in order.
+
+    A manifest records the content hash of every fragment, and fragments (and the master
+    file) whose content is unchanged are left untouched, so their modification times tell
+    downstream LaTeX builds which theorems changed. Fragments of theorems that are no
+    longer emitted are removed on close.
+    """
+
+    MANIFEST_NAME = "fragments.json"
+
+    def __init__(self, directory, master_name="main.tex", fragment_dir="fragments"):
+        self.directory = directory
+        self.master_path = os.path.join(directory, master_name)
+        self.fragment_dir = fragment_dir
+        self.manifest_path = os.path.join(directory, fragment_dir, self.MANIFEST_NAME)
+        os.makedirs(os.path.join(directory, fragment_dir), exist_ok=True)
+
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as file:
+                self.previous_hashes = json.load(file)
+        except (FileNotFoundError, ValueError):
+            self.previous_hashes = {}
+        self.hashes = {}  # fragment name -> content hash, in emission order
+        self.written = 0
+        self.unchanged = 0
+
+    def fragment_name(self, theorem_entry):
+        """Name a fragment after its theorem, using only characters that are safe in \\input."""
+        parts = theorem_entry.lstrip().split(' ', 2)
+        name = re.sub(r"[^A-Za-z0-9_-]", "-", parts[1]) if len(parts) > 1 else "theorem"
+        unique_name = name
+        suffix = 2
+        while unique_name in self.hashes:
+            unique_name = f"{name}-{suffix}"
+            suffix += 1
+        return unique_name
+
+    def emit(self, theorem_entry, latex=None):
+        """Write one theorem's fragment, compiling it unless its LaTeX is given, and return whether the file was written."""
+        if latex is None:
+            latex = compile_output([theorem_entry])
+        if not latex:
+            return False
+
+        name = self.fragment_name(theorem_entry)
+        path = os.path.join(self.directory, self.fragment_dir, name + ".tex")
+        digest = content_hash(latex)
+        self.hashes[name] = digest
+        if self.previous_hashes.get(name) == digest and os.path.exists(path):
+            self.unchanged += 1
+            return False
+        write_atomically(path, latex)
+        self.written += 1
+        return True
+
+    def close(self):
+        """Write the master file and manifest, and remove the fragments of vanished theorems."""
+        master = "".join(f"\\input{{{self.fragment_dir}/{name}}}\n" for name in self.hashes)
+        try:
+            with open(self.master_path, 'r', encoding='utf-8') as file:
+                master_changed = file.read() != master
+        except FileNotFoundError:
+            master_changed = True
+        if master_changed:
+            write_atomically(self.master_path, master)
+
+        for name in self.previous_hashes:
+            if name not in self.hashes:
+                try:
+                    os.unlink(os.path.join(self.directory, self.fragment_dir, name + ".tex"))
+                except FileNotFoundError:
+                    pass
+
+        if self.hashes != self.previous_hashes:
+            write_atomically(self.manifest_path, json.dumps(self.hashes, indent=4))
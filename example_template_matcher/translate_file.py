@@ -1,79 +1,307 @@
 # translate_file.py
 
-import json
+import argparse
+import contextlib
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from declaration_index import RecordingIndex, declaration_records, open_declaration_index, update_declaration_index
+from error_log import ErrorLog
 from file_cleaner import *
-from statement_translator import StatementTranslator 
-from statement_stack import StatementStack
-from text_compiler import compile_output
+from instrumentation import Instrumentation, profiling
+from pipeline import load_template_dict, iter_translations, make_translator, Pipeline, print_result
+from statement_translator import SUB_EXPRESSION_CACHE_SIZE
+from template_store import TemplateStore, load_template_store
+from text_compiler import LatexEmitter, FragmentEmitter
+from translation_cache import TranslationCache
 
-def main(file_path: str, templates_path: str):
-    # Load the Lean file
+def translate_content(content: str, template_dict: dict):
+    """Run the translation steps on the content of a Lean file."""
+    statements = []
+    cleaned_statements = []
+    latex_fragments = []
+    for statement, cleaned_statement, latex in iter_translations(content.splitlines(), template_dict):
+        statements.append(statement)
+        cleaned_statements.append(cleaned_statement)
+        if latex:
+            latex_fragments.append(latex)
+    return statements, cleaned_statements, "\n".join(latex_fragments)
+
+def main(file_path: str, templates_path: str, output_path: str = None, cache_dir: str = None,
+         instrumentation: Instrumentation = None, store_path: str = None, fragments_dir: str = None,
+         parallel_declarations: bool = False, max_workers: int = None, error_log: ErrorLog = None,
+         quiet: bool = False, index_path: str = None, cache_size: int = SUB_EXPRESSION_CACHE_SIZE):
+    # Open the Lean file first, so that only its own errors are reported as such
     try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            content = file.read()
+        file = open(file_path, 'r', encoding='utf-8')
     except FileNotFoundError:
         print(f"File {file_path} not found.")
         return
     except IOError as e:
         print(f"An error occurred while reading the file: {e}")
         return
-    
-    # Load the templates
-    with open(templates_path, 'r', encoding='utf-8') as file:
-        templates = json.load(file)
-    template_dict = {template["expression"]: template for template in templates}
 
-    # Step 1: Remove unneeded text
+    with file:
+        # Load the templates into a pipeline, with the declarations of other files if there is an index
+        translation_cache = TranslationCache.for_templates(cache_dir, templates_path) if cache_dir else None
+        declaration_index = open_declaration_index(index_path) if index_path else None
+        pipeline = Pipeline.from_files(
+            templates_path, store_path, translation_cache=translation_cache, instrumentation=instrumentation,
+            error_log=error_log, parallel_declarations=parallel_declarations, max_workers=max_workers,
+            declaration_index=declaration_index, cache_size=cache_size,
+        )
+        if error_log is not None:
+            error_log.source_path = file_path
 
-    # Remove comments
-    content = remove_lean_comments(content)
+        # Print the statements unless asked not to
+        if not quiet:
+            pipeline.sinks.append(print_result)
 
-    # Remove specified lines
-    words_to_remove = ["import", "open", "namespace", "end", "section"]
-    content = remove_specific_lines(content, words_to_remove)
+        # Stream the Lean file through the pipeline
+        latex_fragments = []
+        output_file = None
+        try:
+            fragment_emitter = FragmentEmitter(fragments_dir) if fragments_dir else None
+            if fragment_emitter:
+                pipeline.sinks.append(lambda result: fragment_emitter.emit(result.translation, result.latex))
 
-    # Remove forward/backward markets
-    content = remove_direction_markers(content)
+            # Write LaTeX as it is produced if an output file was given
+            if output_path:
+                output_file = open(output_path, 'w', encoding='utf-8')
+                latex_emitter = LatexEmitter(output_file)
+                pipeline.sinks.append(lambda result: latex_emitter.emit(result.translation, result.latex))
+            for result in pipeline.iter_results(file):
+                if not output_file and result.latex:
+                    latex_fragments.append(result.latex)
 
-    # Step 2: Clean up syntax
-    content = replace_succ_with_increment(content)
+            # Only a complete run knows which fragments are stale
+            if fragment_emitter:
+                fragment_emitter.close()
+        finally:
+            if output_file:
+                output_file.close()
+            pipeline.close()
 
-    # Step 3: Extract statements
-    statement_keywords = ["theorem", "lemma", "definition"]
-    statements = extract_statements(content, statement_keywords)
+    if not output_file and not quiet:
+        print("\n")
+        print("\n".join(latex_fragments))
 
-    # Step 4: Translate statements
-    statement_translator = StatementTranslator(template_dict)
-    translated_statements = []
-    for i in range(len(statements)):
-        # Translate each statement
-        statement = statements[i]
-        translated_statement = statement_translator(statement)
-        translated_statements.append(translated_statement)
 
-    # Step 5: Fix intro statements
-    translated_statements = replace_intro_variable(translated_statements)
+#################
+## CORPUS MODE ##
+#################
 
-    # Step 6: Clean up the output
-    cleaned_statements = clean_output(translated_statements)
+# Templates (and the translation cache) loaded once per worker process by _init_corpus_worker
+_worker_template_dict = None
+_worker_translation_cache = None
+_worker_instrumented = False
+_worker_resilient = False
+_worker_declaration_index = None
+_worker_collect_declarations = False
+_worker_cache_size = SUB_EXPRESSION_CACHE_SIZE
 
-    # Step 7: Compile the output into LaTeX
-    compiled_text = compile_output(cleaned_statements)
+def _init_corpus_worker(templates_path: str, cache_dir: str = None, instrumented: bool = False, store_path: str = None,
+                        resilient: bool = False, index_path: str = None, cache_size: int = SUB_EXPRESSION_CACHE_SIZE):
+    global _worker_template_dict, _worker_translation_cache, _worker_instrumented, _worker_resilient
+    global _worker_declaration_index, _worker_collect_declarations, _worker_cache_size
+    # Workers map the store (sharing its pages) rather than each parsing templates.json
+    if store_path:
+        _worker_template_dict = TemplateStore.open(store_path)
+    else:
+        _worker_template_dict = load_template_dict(templates_path)
+    if cache_dir:
+        _worker_translation_cache = TranslationCache.for_templates(cache_dir, templates_path)
+    _worker_instrumented = instrumented
+    _worker_resilient = resilient
+    # Workers look names up in the index of the last run, and send back their files' declarations for the next
+    if index_path:
+        _worker_declaration_index = open_declaration_index(index_path)
+    _worker_collect_declarations = bool(index_path)
+    _worker_cache_size = cache_size
 
-    # Print the statements
-    for i in range(len(cleaned_statements)):
-        print("\n")
-        print(statements[i])
-        print("\n")
-        print(cleaned_statements[i])
+def _translate_corpus_file(file_path: str, output_path: str) -> tuple:
+    """
+    Translate a single file inside a worker, streaming its LaTeX to output_path.
+
+    The LaTeX goes to a temporary file that replaces output_path only once the file is
+    done, so output_path never holds a partial translation. The temporary file has a fixed
+    name, so a rerun after a crash overwrites it rather than leaving another one behind.
+
+    Returns the number of statements, the worker's report if it is instrumented, the
+    records of the declarations that failed if it is resilient, and, if the run keeps a
+    declaration index, the file's records for it and what it looked up in it (see
+    RecordingIndex).
+    """
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    instrumentation = Instrumentation() if _worker_instrumented else None
+    # The parent writes the error log, so that records from all workers come out in file order
+    error_log = ErrorLog() if _worker_resilient else None
+    if error_log is not None:
+        error_log.source_path = file_path
+    # Lookups are recorded even before there is an index, since a later index may resolve them
+    declaration_index = RecordingIndex(_worker_declaration_index) if _worker_collect_declarations else None
+    num_statements = 0
+    temp_path = output_path + ".tmp"
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file, open(temp_path, 'w', encoding='utf-8') as output_file:
+            # A fresh StatementTranslator (and StatementStack) per file
+            statement_translator = make_translator(
+                _worker_template_dict, instrumentation, error_log is not None, declaration_index, _worker_cache_size
+            )
+            latex_emitter = LatexEmitter(output_file)
+            for _, cleaned_statement, latex in iter_translations(
+                file, None, _worker_translation_cache, instrumentation, statement_translator, error_log
+            ):
+                num_statements += 1
+                latex_emitter.emit(cleaned_statement, latex)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        # The temporary file does not exist yet if the source failed to open
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
+
+    errors = error_log.records if error_log is not None else []
+    declarations, index_lookups = [], {}
+    if declaration_index is not None:
+        declarations = declaration_records(statement_translator.statement_stack, file_path)
+        index_lookups = declaration_index.lookups
+    if instrumentation is None:
+        return num_statements, None, errors, declarations, index_lookups
+    report = instrumentation.report()
+    for statement in report["statements"]:
+        statement["file"] = file_path
+    return num_statements, report, errors, declarations, index_lookups
 
-    print("\n")
-    print(compiled_text)
+def find_lean_files(source: str) -> list:
+    """Return the sorted Lean files in a directory (recursively) or matching a glob pattern."""
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "**", "*.lean")
+    else:
+        pattern = source
+    return sorted(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
 
-    # Step 7: Compile new file
+def corpus_output_paths(source: str, file_paths: list, output_dir: str) -> list:
+    """Return the LaTeX path for each Lean file, mirroring its path below the corpus root in output_dir."""
+    if os.path.isdir(source):
+        root = source
+    else:
+        root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in file_paths])
+
+    output_paths = []
+    for file_path in file_paths:
+        relative_path = os.path.relpath(os.path.abspath(file_path), os.path.abspath(root))
+        output_paths.append(os.path.join(output_dir, os.path.splitext(relative_path)[0] + ".tex"))
+    return output_paths
+
+def translate_corpus(source: str, templates_path: str, output_dir: str, max_workers: int = None, cache_dir: str = None,
+                     instrumentation: Instrumentation = None, store_path: str = None, error_log: ErrorLog = None,
+                     index_path: str = None, cache_size: int = SUB_EXPRESSION_CACHE_SIZE) -> dict:
+    """
+    Translate every Lean file in a directory or glob over a process pool.
+
+    Each worker streams a file's LaTeX to output_dir, mirroring its path relative
+    to the corpus root, and results are collected in input order. Returns a
+    throughput summary. With an instrumentation, the workers' reports are merged into it.
+    With a store_path, the template store is built or refreshed once and the workers map it.
+    With an error_log, declarations that fail are recorded there and replaced by marked
+    fallbacks rather than ending their file (see iter_translations).
+    With an index_path, names a file uses but does not declare are looked up in the
+    declaration index there, which is then updated with the declarations of these files.
+    A run thus resolves the names declared in other files as of the run before.
+    """
+    file_paths = find_lean_files(source)
+    if not file_paths:
+        print(f"No Lean files found for {source}.")
+        return {"files": 0, "statements": 0, "seconds": 0.0, "files_per_second": 0.0, "statements_per_second": 0.0}
+
+    # Output paths mirror the input layout below the common root
+    output_paths = corpus_output_paths(source, file_paths, output_dir)
+
+    if store_path:
+        load_template_store(templates_path, store_path).close()
+
+    start_time = time.perf_counter()
+    statement_count = 0
+    records_by_file = {}
+    initargs = (
+        templates_path, cache_dir, instrumentation is not None, store_path, error_log is not None, index_path, cache_size
+    )
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_corpus_worker, initargs=initargs) as executor:
+        # executor.map yields results in input order
+        results = executor.map(_translate_corpus_file, file_paths, output_paths, chunksize=4)
+        for file_path, (num_statements, report, errors, declarations, _) in zip(file_paths, results):
+            statement_count += num_statements
+            if report is not None:
+                instrumentation.merge(report)
+            for record in errors:
+                error_log.add(record)
+            records_by_file[file_path] = declarations
+    if index_path:
+        update_declaration_index(index_path, records_by_file)
+    elapsed = time.perf_counter() - start_time
+
+    summary = {
+        "files": len(file_paths),
+        "statements": statement_count,
+        "seconds": elapsed,
+        "files_per_second": len(file_paths) / elapsed if elapsed else 0.0,
+        "statements_per_second": statement_count / elapsed if elapsed else 0.0,
+    }
+    if error_log is not None:
+        summary["failed"] = len(error_log)
+    print(
+        f"Translated {summary['files']} files ({summary['statements']} statements) in {elapsed:.2f}s: "
+        f"{summary['files_per_second']:.1f} files/s, {summary['statements_per_second']:.1f} statements/s"
+    )
+    return summary
 
 if __name__ == "__main__":
-    # Set the file path here directly
-    file_path = r"/Users/justinasher/Desktop/symbol_translator_4/lean_example.lean"
-    templates_path = r"/Users/justinasher/Desktop/symbol_translator_4/templates.json"
-    main(file_path, templates_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Translate Lean files into LaTeX.")
+    parser.add_argument("source", nargs="?", help="directory or glob of Lean files to translate in corpus mode")
+    parser.add_argument("--templates", default="templates.json", help="path to templates.json")
+    parser.add_argument("--output-dir", default="output", help="directory for the translated LaTeX files")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    parser.add_argument("--cache-dir", default=None, help="directory of the incremental translation cache")
+    parser.add_argument("--template-store", default=None, help="compiled template store, built from --templates if missing or stale")
+    parser.add_argument("--output", default=None, help="stream the LaTeX to this file instead of printing it (single-file mode)")
+    parser.add_argument("--fragments-dir", default=None, help="also write one LaTeX fragment per theorem and a master file here (single-file mode)")
+    parser.add_argument("--parallel-declarations", action="store_true", help="translate independent declarations of the file concurrently on --workers processes (single-file mode, without --cache-dir or --stats)")
+    parser.add_argument("--error-log", default=None, help="keep going past declarations that fail, logging them to this JSON-lines file")
+    parser.add_argument("--declaration-index", default=None, help="index of declarations for obtain and exact to find in other files, updated in corpus mode")
+    parser.add_argument("--quiet", action="store_true", help="do not print the statements and their translations (single-file mode)")
+    parser.add_argument("--sub-expression-cache-size", type=int, default=SUB_EXPRESSION_CACHE_SIZE, help="sub-expression translations each translator keeps, 0 to turn the cache off")
+    parser.add_argument("--stats", default=None, help="write per-stage timings and counters to this JSON file")
+    parser.add_argument("--profile", default=None, help="write cProfile statistics to this file")
+    parser.add_argument("--collapsed", default=None, help="write sampled collapsed stacks (for flamegraphs) to this file")
+    args = parser.parse_args()
+    if args.parallel_declarations and not args.source and (args.cache_dir or args.stats):
+        parser.error("--parallel-declarations cannot be combined with --cache-dir or --stats")
+
+    instrumentation = Instrumentation() if args.stats else None
+    error_log = ErrorLog(args.error_log) if args.error_log else None
+    # Workers are separate processes, so profiles only cover the parent in corpus mode
+    with profiling(args.profile, args.collapsed):
+        if args.source:
+            translate_corpus(
+                args.source, args.templates, args.output_dir, args.workers, args.cache_dir,
+                instrumentation, args.template_store, error_log, args.declaration_index,
+                args.sub_expression_cache_size,
+            )
+        else:
+            # Set the file path here directly
+            file_path = r"/Users/justinasher/Desktop/symbol_translator_4/lean_example.lean"
+            templates_path = r"/Users/justinasher/Desktop/symbol_translator_4/templates.json"
+            main(
+                file_path, templates_path, args.output, args.cache_dir,
+                instrumentation, args.template_store, args.fragments_dir,
+                args.parallel_declarations, args.workers, error_log, args.quiet, args.declaration_index,
+                args.sub_expression_cache_size,
+            )
+    if instrumentation is not None:
+        instrumentation.write(args.stats)
+    if error_log is not None:
+        error_log.close()
+        if len(error_log):
+            print(f"{len(error_log)} declarations failed to translate; see {args.error_log}")
@@ -0,0 +1,134 @@
+# translation_cache.py
+
+import hashlib
+import json
+import os
+import tempfile
+import operators
+from statement_stack import StackItem, StackDependencies
+
+# Bump when a change to the translator makes earlier cache entries invalid
+CACHE_FORMAT_VERSION = 2
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def hash_file(path: str) -> str:
+    """Return the SHA-256 of a file's contents."""
+    with open(path, 'rb') as file:
+        return hash_bytes(file.read())
+
+def to_json(value):
+    """Convert tuples to lists, so that values compare equal to their JSON round trip."""
+    if isinstance(value, (tuple, list)):
+        return [to_json(element) for element in value]
+    return value
+
+def record_translation(statement_translator, statement: str) -> dict:
+    """
+    Translate a statement, recording the lookups it makes into the stack's current items
+    and its effect on the stack, as a variant that can be replayed on another stack.
+    """
+    stack = statement_translator.statement_stack
+    dependencies = StackDependencies(stack)
+    stack.dependencies = dependencies
+    try:
+        translation = statement_translator(statement)
+    finally:
+        stack.dependencies = None
+
+    return {
+        "lookups": [[kind, argument, to_json(result)] for (kind, argument), result in dependencies.lookups.items()],
+        "translation": translation,
+        "edits": dependencies.edits,
+        "added_items": [item.fields() for item in dependencies.added_items(stack)],
+    }
+
+def variant_matches(stack, variant: dict) -> bool:
+    """Check whether every lookup a variant recorded gives the same result on stack."""
+    return all(
+        to_json(StackDependencies.lookup(stack, kind, argument)) == result
+        for kind, argument, result in variant["lookups"]
+    )
+
+def apply_effects(stack, variant: dict):
+    """Change the stack the way the recorded translation did."""
+    for name, changes in variant["edits"]:
+        stack.edit_item_by_name(name, **changes)
+    for fields in variant["added_items"]:
+        stack.add_to_stack(StackItem(**fields))
+
+
+class TranslationCache:
+    """
+    A persistent, content-addressed cache of per-declaration translations.
+
+    Entries are addressed by a hash of the statement text, templates.json and the
+    operators module. Each entry holds variants of the translation for different stacks:
+    the stack lookups the translation relied on (see StackDependencies), the translated
+    text, and its effect on the stack. A variant is reused only if its lookups still give
+    the same results, so a declaration is retranslated when it changes or when a
+    declaration it depends on does.
+    """
+
+    MAX_VARIANTS = 8
+
+    def __init__(self, directory: str, templates_hash: str, operators_hash: str):
+        self.directory = directory
+        self.context_hash = hash_bytes(f"{CACHE_FORMAT_VERSION}\0{templates_hash}\0{operators_hash}".encode())
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def for_templates(cls, directory: str, templates_path: str) -> "TranslationCache":
+        """Create a cache for the templates at templates_path and the current operators module."""
+        return cls(directory, hash_file(templates_path), hash_file(operators.__file__))
+
+    def entry_path(self, statement: str) -> str:
+        key = hash_bytes(f"{self.context_hash}\0{statement}".encode())
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load(self, path: str) -> list:
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (FileNotFoundError, ValueError):
+            return []
+
+    def save(self, path: str, variants: list):
+        """Write an entry atomically, so a killed run never leaves a partial file."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                json.dump(variants, file, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def translate(self, statement_translator, statement: str) -> str:
+        """Translate a statement with statement_translator, reusing a cached translation when valid."""
+        if not statement.strip():
+            return statement_translator(statement)
+
+        # Every translation starts by pruning the stack to the top level, leaving its base
+        stack = statement_translator.statement_stack
+        stack.prune_stack(0)
+
+        path = self.entry_path(statement)
+        variants = self.load(path)
+        for variant in variants:
+            if variant_matches(stack, variant):
+                self.hits += 1
+                apply_effects(stack, variant)
+                return variant["translation"]
+
+        # Translate, recording the lookups into the base
+        self.misses += 1
+        variant = record_translation(statement_translator, statement)
+        self.save(path, [variant] + variants[:self.MAX_VARIANTS - 1])
+        return variant["translation"]
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,244 @@
+# translation_server.py
+
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from pipeline import Pipeline, load_template_dict
+from statement_translator import TranslatorConfig
+from template_store import load_template_store
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+TRANSLATION_ERROR = -32000
+
+class RPCError(Exception):
+    """An error to report to the client as a JSON-RPC error object."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+class TranslationServer:
+    """
+    Keeps the templates loaded between translation requests.
+
+    Each request gets its own StatementTranslator, so no stack state leaks between
+    requests, but all of them share the compiled templates in one read-only
+    TranslatorConfig, so requests from concurrent connections translate at once. Before
+    each request the server checks templates.json and reloads it if it changed; if the
+    new file does not load, the old templates stay in use.
+    """
+
+    def __init__(self, templates_path: str, store_path: str = None):
+        self.templates_path = templates_path
+        self.store_path = store_path
+        self.translator_config = None
+        self.templates_stat = None
+        self.started = time.time()
+        self.requests = 0
+        self.reloads = 0
+        # Guards reloads and the request count; translations only read the config, so they run outside it
+        self.lock = threading.Lock()
+        self.reload()
+
+    ###############
+    ## TEMPLATES ##
+    ###############
+
+    def reload(self):
+        """
+        Load the templates and compile them into a matcher. If they do not load, the old
+        templates stay in use and an RPCError is raised.
+        """
+        source_stat = os.stat(self.templates_path)
+        # Recorded either way, so a file that fails to load is not retried until it changes again
+        self.templates_stat = (source_stat.st_mtime_ns, source_stat.st_size)
+        try:
+            if self.store_path:
+                templates = load_template_store(self.templates_path, self.store_path)
+            else:
+                templates = load_template_dict(self.templates_path)
+            translator_config = TranslatorConfig.for_templates(templates)
+        except Exception as e:
+            # JSON of the wrong shape fails with about any exception, not only ValueError or KeyError
+            raise RPCError(TRANSLATION_ERROR, f"Could not reload {self.templates_path}: {type(e).__name__}: {e}") from e
+
+        # Requests still translating keep the old config, and an old store is unmapped once the last of them drops it
+        self.translator_config = translator_config
+        self.reloads += 1
+
+    def reload_if_changed(self):
+        """Reload the templates if templates.json was modified since they were loaded."""
+        try:
+            source_stat = os.stat(self.templates_path)
+        except OSError:
+            return
+        if (source_stat.st_mtime_ns, source_stat.st_size) == self.templates_stat:
+            return
+        try:
+            self.reload()
+        except RPCError as e:
+            # Keep serving the old templates, and retry once the file changes again
+            print(e.message, file=sys.stderr)
+        except OSError as e:
+            self.templates_stat = (source_stat.st_mtime_ns, source_stat.st_size)
+            print(f"Could not reload {self.templates_path}: {e}", file=sys.stderr)
+
+    #############
+    ## METHODS ##
+    #############
+
+    def translate(self, text: str = None, path: str = None) -> dict:
+        """Translate Lean source, given as text or as the path of a file."""
+        if (text is None) == (path is None):
+            raise RPCError(INVALID_PARAMS, "translate takes exactly one of 'text' and 'path'.")
+        if path is not None:
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    text = file.read()
+            except OSError as e:
+                raise RPCError(INVALID_PARAMS, f"Could not read {path}: {e}")
+
+        # The pipeline shares the compiled templates and gives the request a fresh translator
+        try:
+            result = Pipeline(self.translator_config).translate(text)
+        except Exception as e:
+            raise RPCError(TRANSLATION_ERROR, f"{type(e).__name__}: {e}")
+        return result.to_dict()
+
+    def stats(self) -> dict:
+        return {
+            "uptime": time.time() - self.started,
+            "requests": self.requests,
+            "reloads": self.reloads,
+            "templates_path": self.templates_path,
+        }
+
+    def handle(self, request) -> dict:
+        """Handle one decoded JSON-RPC request, returning the response (None for notifications)."""
+        if not isinstance(request, dict) or request.get("jsonrpc") != "2.0" or not isinstance(request.get("method"), str):
+            return error_response(None, INVALID_REQUEST, "Invalid request.")
+        request_id = request.get("id")
+        params = request.get("params", {})
+
+        with self.lock:
+            self.requests += 1
+        try:
+            if not isinstance(params, dict):
+                raise RPCError(INVALID_PARAMS, "params must be an object.")
+            method = request["method"]
+            if method == "translate":
+                with self.lock:
+                    self.reload_if_changed()
+                unknown = set(params) - {"text", "path"}
+                if unknown:
+                    raise RPCError(INVALID_PARAMS, f"Unknown parameters: {', '.join(sorted(unknown))}.")
+                result = self.translate(**params)
+            elif method == "reload":
+                with self.lock:
+                    self.reload()
+                result = True
+            elif method == "stats":
+                result = self.stats()
+            else:
+                raise RPCError(METHOD_NOT_FOUND, f"Method not found: {method}")
+        except RPCError as e:
+            return error_response(request_id, e.code, e.message) if "id" in request else None
+        except (OSError, ValueError, KeyError) as e:
+            return error_response(request_id, TRANSLATION_ERROR, f"{type(e).__name__}: {e}") if "id" in request else None
+        except Exception as e:
+            # Anything else is a bug, but it must not take down the serve loop
+            return error_response(request_id, INTERNAL_ERROR, f"{type(e).__name__}: {e}") if "id" in request else None
+
+        if "id" not in request:
+            return None
+        return {"jsonrpc": "2.0", "id": request_id, "result": result}
+
+    def handle_line(self, line: str) -> str:
+        """Handle one line of the line-delimited protocol, returning the response line or None."""
+        try:
+            request = json.loads(line)
+        except ValueError:
+            response = error_response(None, PARSE_ERROR, "Parse error.")
+        else:
+            response = self.handle(request)
+        return None if response is None else json.dumps(response, ensure_ascii=False)
+
+    ################
+    ## TRANSPORTS ##
+    ################
+
+    def serve_stdio(self, input_stream=None, output_stream=None):
+        """Serve one request per line on stdin, writing one response per line to stdout."""
+        input_stream = input_stream or sys.stdin
+        output_stream = output_stream or sys.stdout
+        for line in input_stream:
+            if not line.strip():
+                continue
+            response = self.handle_line(line)
+            if response is not None:
+                output_stream.write(response + "\n")
+                output_stream.flush()
+
+    def serve_unix_socket(self, socket_path: str):
+        """Serve the line-delimited protocol on a Unix socket, one thread per connection."""
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                for line in self.rfile:
+                    if not line.strip():
+                        continue
+                    response = server.handle_line(line.decode("utf-8"))
+                    if response is not None:
+                        self.wfile.write((response + "\n").encode("utf-8"))
+                        self.wfile.flush()
+
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as unix_server:
+            unix_server.daemon_threads = True
+            try:
+                unix_server.serve_forever()
+            finally:
+                os.unlink(socket_path)
+
+def error_response(request_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "id": request_id, "error": {"code": code, "message": message}}
+
+def call(socket_path: str, method: str, **params):
+    """Send one request to a server on a Unix socket and return its result, raising RPCError on errors."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        client.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with client.makefile('r', encoding='utf-8') as responses:
+            response = json.loads(responses.readline())
+    if "error" in response:
+        raise RPCError(response["error"]["code"], response["error"]["message"])
+    return response["result"]
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve translations over JSON-RPC, keeping the templates loaded.")
+    parser.add_argument("--templates", default="templates.json", help="path to templates.json, reloaded when it changes")
+    parser.add_argument("--template-store", default=None, help="compiled template store, built from --templates if missing or stale")
+    parser.add_argument("--socket", default=None, help="serve on this Unix socket instead of stdin/stdout")
+    args = parser.parse_args()
+
+    translation_server = TranslationServer(args.templates, args.template_store)
+    if args.socket:
+        translation_server.serve_unix_socket(args.socket)
+    else:
+        translation_server.serve_stdio()